@@ -0,0 +1,85 @@
+"""Benchmark the vectorized deficit kernel against the original row-by-row calcs.deficit loop.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_deficit
+    python -m benchmarks.bench_deficit --sizes 10000 100000 1000000 --reference-limit 20000
+
+The original loop takes minutes at 1M days, so by default it is only timed up to
+--reference-limit days and extrapolated linearly (it is O(n)) above that. Use --full to time it at every size.
+"""
+import argparse
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from waterpyk import calcs
+
+
+def deficit_reference(df_deficit):
+    """The D and D_wy loops from calcs.deficit before vectorization (waterpyk 2.2.0)."""
+    df_deficit = df_deficit.copy()
+    df_deficit['A'] = df_deficit['ET'] - df_deficit['P']
+    df_deficit['D'] = 0.0  # float so newer pandas does not refuse the upcast
+    for _i in range(df_deficit.shape[0]-1):
+        df_deficit.loc[_i+1, 'D'] = max((df_deficit.loc[_i+1, 'A'] + df_deficit.loc[_i, 'D']), 0)
+
+    df_deficit_wy = pd.DataFrame()
+    for wy in df_deficit.wateryear.unique():
+        temp = df_deficit[df_deficit['wateryear'] == wy][['date','ET','P']]
+        temp['A'] = temp['ET'] - temp['P']
+        temp['D_wy'] = 0.0
+        temp = temp.reset_index()
+        for _i in range(temp.shape[0]-1):
+            temp.loc[_i+1, 'D_wy'] = max((temp.loc[_i+1, 'A'] + temp.loc[_i, 'D_wy']), 0)
+        df_deficit_wy = pd.concat([df_deficit_wy, temp])
+    df_deficit_wy = df_deficit_wy[['date','D_wy']]
+    df_deficit = df_deficit.merge(df_deficit_wy, how = 'left', on = 'date')
+    return df_deficit
+
+
+def make_df_wide(n_days, seed=0):
+    """Synthetic wide dataframe. 'date' is a day number because 1M days does not fit in datetime64[ns]."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'date': np.arange(n_days)})
+    df['ET'] = rng.gamma(2, 1.5, n_days)
+    df['P'] = np.where(rng.random(n_days) < 0.15, rng.gamma(1, 20, n_days), 0)
+    df['wateryear'] = 1900 + df['date'] // 365
+    return df
+
+
+def time_it(func, *args, repeat=3, **kwargs):
+    best = np.inf
+    for _ in range(repeat):
+        t1 = perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, perf_counter() - t1)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--reference-limit', type=int, default=20_000)
+    parser.add_argument('--full', action='store_true', help='time the reference loop at every size')
+    args = parser.parse_args()
+
+    print(f"{'days': >10} {'reference (s)': >15} {'vectorized (s)': >15} {'speedup': >10} {'max abs diff': >13}")
+    for n_days in args.sizes:
+        df = make_df_wide(n_days)
+        t_new, df_new = time_it(calcs.deficit, None, df, snow_correction=False)
+
+        n_ref = n_days if (args.full or n_days <= args.reference_limit) else args.reference_limit
+        t_ref, df_ref = time_it(deficit_reference, df.iloc[:n_ref], repeat=1)
+        diff = max(np.abs(df_ref['D'].to_numpy() - df_new['D'].to_numpy()[:n_ref]).max(),
+                   np.abs(df_ref['D_wy'].to_numpy() - df_new['D_wy'].to_numpy()[:n_ref]).max())
+        label = f'{t_ref:.3f}'
+        if n_ref < n_days:
+            t_ref = t_ref * n_days / n_ref
+            label = f'~{t_ref:.1f}'
+        print(f'{n_days: >10} {label: >15} {t_new: >15.4f} {t_ref / t_new: >9.0f}x {diff: >13.2e}')
+
+
+if __name__ == '__main__':
+    main()
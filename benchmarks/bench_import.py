@@ -0,0 +1,59 @@
+"""Benchmark the time to import waterpyk and check that importing it has no side effects.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --repeat 10
+
+Each import is timed in a fresh interpreter started in an empty temporary directory, so nothing is cached
+between runs and any files or folders created by the import show up. Only the import statement is timed, not the interpreter start-up.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+STATEMENTS = ['import waterpyk', 'import waterpyk.calcs', 'import waterpyk.gee', 'import waterpyk.main']
+
+# Modules that should only be imported when they are used
+HEAVY_MODULES = ['ee', 'geopandas', 'matplotlib', 'seaborn', 'scipy', 'rasterio', 'fiona']
+
+TIMER = """
+import sys, time
+t1 = time.perf_counter()
+{statement}
+t2 = time.perf_counter()
+print(t2 - t1)
+print(','.join(module for module in {heavy} if module in sys.modules))
+"""
+
+
+def run(statement, cwd):
+    """Import in a fresh interpreter. Returns the import time (s), the heavy modules that were imported and anything else printed."""
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([os.getcwd(), os.environ.get('PYTHONPATH', '')])}
+    code = TIMER.format(statement=statement, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, capture_output=True,
+                            text=True, check=True).stdout.splitlines()
+    return float(output[-2]), [module for module in output[-1].split(',') if module], output[:-2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'statement': <24} {'best (s)': >9} {'median (s)': >11}  heavy modules / side effects")
+    for statement in STATEMENTS:
+        times = []
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as cwd:
+                seconds, heavy, printed = run(statement, cwd)
+                created = os.listdir(cwd)
+            times.append(seconds)
+        notes = heavy + ['created ' + name for name in created] + (['printed output'] if printed else [])
+        print(f'{statement: <24} {min(times): >9.3f} {sorted(times)[len(times) // 2]: >11.3f}  {", ".join(notes) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -28,5 +28,6 @@ setup(
     ],
     packages=find_packages(),
     include_package_data=True,
-    package_data={'': ['layers_data/*.csv']}
+    package_data={'': ['layers_data/*.csv']},
+    entry_points={'console_scripts': ['waterpyk=waterpyk.cli:main']}
 )
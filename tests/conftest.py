@@ -0,0 +1,9 @@
+import pytest
+from waterpyk import earthengine
+
+
+@pytest.fixture
+def offline_ee(monkeypatch):
+    """Use the ee module without initializing Earth Engine, for tests that replace the parts of ee they use."""
+    monkeypatch.setattr(earthengine, '_initialized', True)
+    return earthengine.ee
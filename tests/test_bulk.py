@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from waterpyk import bulk, cache, watershed
+
+aiohttp = pytest.importorskip('aiohttp')
+
+BASIN = {'type': 'FeatureCollection', 'features': [{'type': 'Feature', 'properties': {},
+         'geometry': {'type': 'Polygon', 'coordinates': [[[-123.65, 39.72], [-123.62, 39.72], [-123.62, 39.74],
+                                                          [-123.65, 39.74], [-123.65, 39.72]]]}}]}
+
+
+class USGSHandler(BaseHTTPRequestHandler):
+    """Local stand-in for NLDI and NWIS. Gage 00000013 has no basin and 00000007 fails twice before answering."""
+    latency = 0.05
+    requests = []
+    failures = {}
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.requests.append(self.path)
+        if '00000013/basin' in self.path:
+            return self.respond(404, 'not found')
+        if self.failures.get(self.path, 0) > 0:
+            self.failures[self.path] -= 1
+            return self.respond(503, 'busy')
+        if '/nwis/dv' in self.path:
+            return self.respond(200, '# rdb\nagency_cd\tsite_no\n5s\t15s\nUSGS\t1\n')
+        return self.respond(200, json.dumps(BASIN))
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+class USGSServer(ThreadingHTTPServer):
+    request_queue_size = 64
+
+
+@pytest.fixture
+def usgs_server(monkeypatch):
+    server = USGSServer(('127.0.0.1', 0), USGSHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:%d' % server.server_port
+    monkeypatch.setattr(watershed, 'NLDI_URL', url + '/nldi/')
+    monkeypatch.setattr(watershed, 'NWIS_DV_URL', url + '/nwis/dv')
+    monkeypatch.setattr(cache, '_default_cache', None)
+    USGSHandler.requests = []
+    watershed._client.cache_clear()
+    yield server
+    server.shutdown()
+    watershed._client.cache_clear()
+
+
+def test_fetch_gages_concurrently_with_retries(usgs_server, tmp_path):
+    gages = [str(i).zfill(8) for i in range(20)]
+    USGSHandler.failures = {'/nldi/USGS-00000007/basin?f=json': 2}
+    extraction_cache = cache.ExtractionCache(tmp_path)
+
+    t1 = time.time()
+    df = bulk.fetch_gages(gages, resources=['basin', 'streamflow'], concurrency=20, rate_limit=None,
+                          backoff=0.01, cache=extraction_cache)
+    elapsed = time.time() - t1
+    assert elapsed < 40 * USGSHandler.latency / 4, 'requests were not made concurrently'
+
+    assert list(df['gage']) == [gage for gage in gages for resource in range(2)]
+    failed = df[df['status'] == 'failed']
+    assert list(failed['gage']) == ['00000013'] and '404' in failed['error'].iloc[0]
+    assert df.loc[(df['gage'] == '00000007') & (df['resource'] == 'basin'), 'attempts'].item() == 3
+    assert len(extraction_cache) == 39
+
+    # Results are kept for later use, so nothing is downloaded again
+    assert round(watershed.get_client('00000007').latitude(), 2) == 39.73
+    n_requests = len(USGSHandler.requests)
+    df = bulk.fetch_gages(gages, resources=['basin', 'streamflow'], rate_limit=None, retries=0, cache=extraction_cache)
+    assert (df['status'] == 'cached').sum() == 39
+    assert len(USGSHandler.requests) == n_requests + 1  # only the missing basin
+
+
+def test_fetch_gages_rate_limit(usgs_server):
+    t1 = time.time()
+    df = bulk.fetch_gages([str(i) for i in range(10)], resources=['metadata'], rate_limit=20, cache=False)
+    assert (df['status'] == 'ok').all()
+    assert time.time() - t1 >= 9 / 20
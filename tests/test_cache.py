@@ -0,0 +1,41 @@
+import os
+
+from waterpyk.cache import ExtractionCache
+
+
+def test_cache_put_and_get(tmp_path):
+    extraction_cache = ExtractionCache(tmp_path)
+    key = extraction_cache.key(asset_id='OpenLandMap/SOL', bands=['b0'], scale=250)
+    assert extraction_cache.get(key) is None
+    extraction_cache.put(key, [{'b0': 1.5}, None], asset_id='OpenLandMap/SOL')
+    assert extraction_cache.get(key) == [{'b0': 1.5}, None]
+    assert len(extraction_cache) == 1
+
+    info = extraction_cache.info()
+    assert list(info['key']) == [key]
+    assert list(info['asset_id']) == ['OpenLandMap/SOL']
+
+    extraction_cache.clear()
+    assert len(extraction_cache) == 0
+
+
+def test_cache_key_is_stable():
+    key = ExtractionCache.key(asset_id='a', bands=['b'], scale=500)
+    assert key == ExtractionCache.key(scale=500, bands=['b'], asset_id='a')
+    assert key != ExtractionCache.key(asset_id='a', bands=['b'], scale=30)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    extraction_cache = ExtractionCache(tmp_path, max_bytes=float('inf'))
+    keys = [extraction_cache.key(i=i) for i in range(4)]
+    for i, key in enumerate(keys):
+        extraction_cache.put(key, list(range(100)))
+        os.utime(extraction_cache._file(key), (i, i))
+    extraction_cache.get(keys[0])  # recently used again
+
+    extraction_cache.max_bytes = extraction_cache.size() * 0.6
+    extraction_cache.evict()
+    assert extraction_cache.get(keys[1]) is None
+    assert extraction_cache.get(keys[2]) is None
+    assert extraction_cache.get(keys[0]) is not None
+    assert extraction_cache.get(keys[3]) is not None
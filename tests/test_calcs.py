@@ -0,0 +1,242 @@
+import numpy as np
+import pandas as pd
+from waterpyk import calcs
+
+
+def deficit_loop(A, wateryear):
+    # Row-by-row reference implementation of D and D_wy (the original calcs.deficit loops)
+    D = np.zeros(len(A))
+    for i in range(len(A) - 1):
+        D[i+1] = max(A[i+1] + D[i], 0)
+    D_wy = np.zeros(len(A))
+    for i in range(len(A) - 1):
+        if wateryear[i+1] != wateryear[i]:
+            D_wy[i+1] = 0
+        else:
+            D_wy[i+1] = max(A[i+1] + D_wy[i], 0)
+    return D, D_wy
+
+
+def make_df_wide(n_days, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'date': pd.date_range('2000-10-01', periods=n_days, freq='D')})
+    df['ET'] = rng.gamma(2, 1.5, n_days)
+    df['P'] = np.where(rng.random(n_days) < 0.15, rng.gamma(1, 20, n_days), 0)
+    df['wateryear'] = np.where(~df.date.dt.month.isin([10, 11, 12]), df.date.dt.year, df.date.dt.year + 1)
+    return df
+
+
+def test_clipped_cumsum_matches_loop():
+    df = make_df_wide(3000)
+    A = (df['ET'] - df['P']).to_numpy()
+    D_expected, D_wy_expected = deficit_loop(A, df['wateryear'].to_numpy())
+    D = calcs.clipped_cumsum(A)
+    D_wy = calcs.clipped_cumsum(A, calcs.segment_starts(df['wateryear'].to_numpy()))
+    np.testing.assert_allclose(D, D_expected, atol=1e-8)
+    np.testing.assert_allclose(D_wy, D_wy_expected, atol=1e-8)
+
+
+def test_clipped_cumsum_carry_continues_series():
+    df = make_df_wide(1000, seed=1)
+    A = (df['ET'] - df['P']).to_numpy()
+    D = calcs.clipped_cumsum(A)
+    D_tail = calcs.clipped_cumsum(A[600:], carry=D[599])
+    np.testing.assert_allclose(D_tail, D[600:], atol=1e-8)
+
+
+def test_deficit_matches_loop_without_snow():
+    df = make_df_wide(800, seed=2)
+    df_deficit = calcs.deficit(None, df, snow_correction=False)
+    D_expected, D_wy_expected = deficit_loop((df['ET'] - df['P']).to_numpy(), df['wateryear'].to_numpy())
+    np.testing.assert_allclose(df_deficit['D'], D_expected, atol=1e-8)
+    np.testing.assert_allclose(df_deficit['D_wy'], D_wy_expected, atol=1e-8)
+    assert list(df_deficit.columns) == ['date', 'ET', 'P', 'wateryear', 'A', 'D', 'D_wy']
+
+
+def test_deficit_many_matches_single_site():
+    dfs = [make_df_wide(900, seed=seed) for seed in range(5)]
+    P = np.vstack([df['P'].to_numpy() for df in dfs])
+    ET = np.vstack([df['ET'].to_numpy() for df in dfs])
+    wateryear = dfs[0]['wateryear'].to_numpy()
+    D, D_wy, smax, maxdmax = calcs.deficit_many(P, ET, wateryear, snow_correction=False, chunk_size=2)
+    for i, df in enumerate(dfs):
+        df_deficit = calcs.deficit(None, df, snow_correction=False)
+        np.testing.assert_allclose(D[i], df_deficit['D'], atol=1e-8)
+        np.testing.assert_allclose(D_wy[i], df_deficit['D_wy'], atol=1e-8)
+        assert np.isclose(smax[i], df_deficit['D'].max())
+        assert np.isclose(maxdmax[i], df_deficit['D_wy'].max())
+    _, _, smax_only, _ = calcs.deficit_many(P, ET, wateryear, snow_correction=False, return_timeseries=False)
+    np.testing.assert_allclose(smax_only, smax)
+
+
+def test_deficit_many_snow_correction_zeroes_et():
+    df = make_df_wide(400)
+    P = np.zeros((1, 400))
+    ET = df['ET'].to_numpy()[None, :]
+    snow = np.full((1, 400), 50.0)
+    D, D_wy, smax, maxdmax = calcs.deficit_many(P, ET, df['wateryear'].to_numpy(), snow=snow)
+    assert smax[0] == 0 and maxdmax[0] == 0
+
+
+def make_composite_long():
+    # Two bands of an 8-day composite, the second band missing one observation
+    dates = pd.date_range('2003-01-01', periods=10, freq='8D')
+    df = pd.DataFrame({'variable': [d.strftime('%Y_%m_%d') + '_Es' for d in dates],
+                       'value': np.arange(10, dtype=float),
+                       'date': dates, 'band': 'Es'})
+    df2 = df.iloc[[0, 1, 2, 4, 5, 6, 7, 8, 9]].copy()
+    df2['band'] = 'Ec'
+    df2['value'] = df2['value'] * 10
+    df = pd.concat([df, df2], ignore_index=True)
+    df['value_raw'] = df['value']
+    return df
+
+
+def test_interp_daily_linear_matches_pandas_and_keeps_last_day():
+    df = make_composite_long()
+    df_interp = calcs.interp_daily(df)
+    assert list(df_interp.columns) == list(df.columns)
+    assert df_interp.date.max() == df.date.max()
+    for band in ['Es', 'Ec']:
+        expected = df[df.band == band].set_index('date')['value'].resample('D').asfreq().interpolate()
+        result = df_interp[df_interp.band == band].set_index('date')['value']
+        np.testing.assert_allclose(result.to_numpy(), expected.to_numpy())
+    # value_raw is only kept on observation dates
+    assert df_interp['value_raw'].notna().sum() == len(df)
+
+
+def test_interp_daily_step_and_nearest():
+    df = make_composite_long()
+    step = calcs.interp_daily(df, method='step')
+    nearest = calcs.interp_daily(df, method='nearest')
+    es_step = step[step.band == 'Es']['value'].to_numpy()
+    es_nearest = nearest[nearest.band == 'Es']['value'].to_numpy()
+    assert (es_step[:8] == 0).all() and es_step[8] == 1
+    assert (es_nearest[:5] == 0).all() and (es_nearest[5:8] == 1).all()
+
+
+def test_aligned_axis_keeps_days_without_snow():
+    df = make_df_wide(400, seed=4)
+    df_long = pd.concat([pd.DataFrame({'date': df['date'], 'asset_name': 'pml', 'value': df['ET'], 'band': 'ET'}),
+                         pd.DataFrame({'date': df['date'][5:], 'asset_name': 'prism', 'value': df['P'][5:], 'band': 'ppt'}),
+                         pd.DataFrame({'date': df['date'][100:], 'asset_name': 'modis_snow', 'value': 50.0, 'band': 'snow'})])
+    df_wide = calcs.make_wide_df(df_long)
+    assert len(df_wide) == 395 and df_wide['date'].iloc[0] == df['date'].iloc[5]
+    np.testing.assert_array_equal(df_wide['wateryear'], df['wateryear'][5:])
+
+    # Days before the snow data starts are kept and not snow corrected
+    df_deficit = calcs.deficit(df_long, df_wide)
+    assert len(df_deficit) == 395
+    np.testing.assert_array_equal(df_deficit['ET'][:95], df['ET'][5:100])
+    assert (df_deficit['ET'][95:] == 0).all()
+
+    # Left join on dates, including dates missing from the merged dataframe
+    flow = pd.DataFrame({'date': df['date'][::2].astype(str), 'Q_mm': np.arange(200.0)})
+    merged = calcs.merge(df_wide, flow, 'streamflow')
+    assert merged['Q_mm'].iloc[1] == 3 and np.isnan(merged['Q_mm'].iloc[0])
+
+
+def test_make_wide_df_pivots_every_band():
+    df = make_df_wide(100, seed=5)
+    df_long = pd.concat([pd.DataFrame({'date': df['date'], 'asset_name': 'pml', 'value': df['ET'], 'band': 'ET'}),
+                         pd.DataFrame({'date': df['date'], 'asset_name': 'pml', 'value': 0.5, 'band': 'Ei'}),
+                         pd.DataFrame({'date': df['date'], 'asset_name': 'prism', 'value': df['P'], 'band': 'ppt'}),
+                         pd.DataFrame({'date': df['date'][50:], 'asset_name': 'prism', 'value': 10.0, 'band': 'tmax'})])
+    df_wide = calcs.make_wide_df(df_long)
+    assert list(df_wide.columns) == ['date', 'ET', 'P', 'P_min_Ei', 'Ei', 'prism_tmax', 'wateryear']
+    np.testing.assert_allclose(df_wide['P_min_Ei'], df['P'] - 0.5)
+    assert df_wide['prism_tmax'].isna().sum() == 50
+
+    df_wide = calcs.make_wide_df(df_long, column_names=lambda asset_name, band: band, derived_columns={'T_mean': 'prism_tmax / 2', 'ET_2': lambda df: 2 * df['ET']})
+    assert list(df_wide.columns) == ['date', 'ET', 'P', 'ET_2', 'Ei', 'tmax', 'wateryear']
+    assert list(calcs.make_wide_df(df_long, pivot_all=False).columns) == ['date', 'ET', 'P', 'P_min_Ei', 'Ei', 'wateryear']
+
+
+def test_wateryear_matches_groupby():
+    df = make_df_wide(1500, seed=6)
+    df['Q_mm'] = np.where(np.arange(1500) % 7 == 0, np.nan, 1.0)
+    df['D_wy'] = calcs.clipped_cumsum((df['ET'] - df['P']).to_numpy(), calcs.segment_starts(df['wateryear'].to_numpy()))
+    df_wide, df_total = calcs.wateryear(df)
+    assert list(df_total.columns) == ['wateryear', 'D_wy_max', 'ET_summer', 'ET', 'P', 'Q_mm']
+    grouped = df.groupby('wateryear')
+    for col in ['ET', 'P', 'Q_mm']:
+        np.testing.assert_allclose(df_total[col], grouped[col].sum())
+        np.testing.assert_allclose(df_wide[col + '_cumulative'], grouped[col].cumsum())
+    np.testing.assert_allclose(df_total['D_wy_max'], grouped['D_wy'].max())
+    summer = df[df.date.dt.month.isin([6, 7, 8, 9])].groupby('wateryear')['ET'].sum()
+    np.testing.assert_allclose(df_total['ET_summer'], summer.reindex(df_total.index, fill_value=0))
+    np.testing.assert_allclose(df_wide['dV'], df_wide['P_cumulative'] - df_wide['ET_cumulative'] - df_wide['Q_mm_cumulative'])
+
+    # Southern Hemisphere wateryears (April to March) with a winter season
+    df = df[['date', 'ET', 'P']]
+    assert calcs.wateryear_of(['2001-03-31', '2001-04-01'], start_month=4).tolist() == [2001, 2002]
+    assert calcs.wateryear_start(2002, start_month=4) == pd.Timestamp('2001-04-01')
+    df_wide, df_total = calcs.wateryear(df, wateryear_start_month=4, seasons={'winter': [6, 7, 8]})
+    assert 'dV' not in df_wide and 'ET_summer' not in df_total
+    winter = df[df.date.dt.month.isin([6, 7, 8])].groupby(calcs.wateryear_of(df.date[df.date.dt.month.isin([6, 7, 8])], 4))['ET'].sum()
+    np.testing.assert_allclose(df_total['ET_winter'], winter.reindex(df_total.index, fill_value=0))
+
+
+def bursts_loop(D):
+    # Reference: (start, end, max) row of each run of D > 0
+    runs, start = [], None
+    for i, d in enumerate(D):
+        if d > 0 and start is None:
+            start = i
+        if start is not None and (not d > 0 or i == len(D) - 1):
+            end = i if d > 0 else i - 1
+            runs.append((start, end, start + int(np.argmax(D[start:end + 1]))))
+            start = None
+    return runs
+
+
+def test_deficit_bursts_matches_loop():
+    df = make_df_wide(1200, seed=7)
+    df['D'] = calcs.clipped_cumsum((df['ET'] - 1.3 * df['P']).to_numpy())
+    bursts = calcs.deficit_bursts(df)
+    expected = bursts_loop(df['D'].to_numpy())
+    assert len(bursts) == len(expected) > 2
+    assert list(bursts['start']) == [df['date'][start] for start, end, top in expected]
+    assert list(bursts['end']) == [df['date'][end] for start, end, top in expected]
+    assert list(bursts['max_date']) == [df['date'][top] for start, end, top in expected]
+    assert list(bursts['duration']) == [end - start + 1 for start, end, top in expected]
+    np.testing.assert_allclose(bursts['max_D'], [df['D'][top] for start, end, top in expected])
+    assert list(bursts['start_wateryear']) == [df['wateryear'][start] for start, end, top in expected]
+    assert bursts['ongoing'].tolist() == [end == len(df) - 1 for start, end, top in expected]
+
+    # Many sites: bursts never run from one site into the next
+    D = np.vstack([df['D'].to_numpy(), np.full(len(df), 2.0), df['D'].to_numpy()])
+    many = calcs.deficit_bursts_many(D, df['date'], sites=['a', 'b', 'c'])
+    assert list(many['site'].unique()) == ['a', 'b', 'c']
+    pd.testing.assert_frame_equal(many[many.site == 'c'].drop(columns='site').reset_index(drop=True), bursts)
+    assert many[many.site == 'b'][['duration', 'ongoing']].values.tolist() == [[len(df), True]]
+    stacked = pd.concat([df.assign(site='a'), df.assign(site='c')], ignore_index=True)
+    assert len(calcs.deficit_bursts(stacked, by='site', min_duration=5)) == 2 * (bursts['duration'] >= 5).sum()
+
+
+def test_hargreaves_pet_table_and_many_sites():
+    # FAO-56 example 8: 20 S on 3 September gives RA = 32.2 MJ m-2 day-1
+    assert abs(calcs.extraterrestrial_radiation(246, -20) - 32.2) < 0.05
+    latitudes = np.array([-75.0, 0.03, 38.55, 80.0])
+    J = np.arange(1, 367)
+    np.testing.assert_allclose(calcs.extraterrestrial_radiation(J, latitudes[:, None]), calcs._radiation(J, latitudes[:, None]), atol=0.01)
+    assert calcs.extraterrestrial_radiation(355, 80.0) == 0
+
+    df = make_df_wide(800, seed=8)
+    tmin = np.vstack([np.full(800, 5.0), np.full(800, 2.0)])
+    tmax = tmin + 12
+    pet = calcs.hargreaves_pet(tmin, tmax, calcs.day_of_year(df['date']), np.array([38.5, -20.0]))
+    assert pet.shape == (2, 800)
+    np.testing.assert_allclose(pet[1], calcs.hargreaves_pet(tmin[1], tmax[1], calcs.day_of_year(df['date']), -20.0))
+
+    df_long = pd.concat([pd.DataFrame({'date': df['date'], 'asset_name': 'pml', 'value': df['ET'], 'band': 'ET'}),
+                         pd.DataFrame({'date': df['date'], 'asset_name': 'prism', 'value': df['P'], 'band': 'ppt'}),
+                         pd.DataFrame({'date': df['date'], 'asset_name': 'prism', 'value': tmin[0], 'band': 'tmin'}),
+                         pd.DataFrame({'date': df['date'], 'asset_name': 'prism', 'value': tmax[0], 'band': 'tmax'})])
+    assert 'PET' not in calcs.make_wide_df(df_long)
+    df_wide = calcs.make_wide_df(df_long, latitude=38.5)
+    assert list(df_wide.columns) == ['date', 'ET', 'P', 'PET', 'prism_tmin', 'prism_tmax', 'wateryear']
+    np.testing.assert_allclose(df_wide['PET'], pet[0])
+    np.testing.assert_allclose(calcs.calculate_PET(df_long, 38.5)['PET'], pet[0])
+    df_wide, df_total = calcs.wateryear(df_wide)
+    np.testing.assert_allclose(df_total['PET'], df_wide.groupby('wateryear')['PET'].sum())
@@ -0,0 +1,74 @@
+import json
+
+import pandas as pd
+from waterpyk import cli
+
+
+def test_read_sites(tmp_path):
+    gages = tmp_path / 'gages.txt'
+    gages.write_text('# gages\n11475560\n1234567\n')
+    assert [site['site'] for site in cli.read_sites(str(gages))] == ['11475560', '01234567']
+
+    points = tmp_path / 'points.csv'
+    points.write_text('site_name,lat,long\nrivendell,38.5,-122.3\n')
+    site, = cli.read_sites(str(points))
+    assert site['kind'] == 'point' and site['coords'] == [38.5, -122.3] and site['kwargs'] == {'site_name': 'rivendell'}
+
+
+def test_batch_resumes_from_manifest(monkeypatch, tmp_path):
+    calls = []
+
+    def fake_run_site(site, layers, saving_dir, kwargs, verbose=False):
+        calls.append(site['site'])
+        if site['site'] == '00000003' and len(calls) < 4:
+            return {'site': site['site'], 'kind': site['kind'], 'status': 'failed', 'seconds': 0.1, 'error': 'HTTPError'}
+        return {'site': site['site'], 'kind': site['kind'], 'status': 'done', 'smax': 100.0 + len(calls),
+                'maxdmax': 50.0, 'MAP': 900, 'seconds': 0.1, 'saving_path': None, 'error': None}
+    monkeypatch.setattr(cli, '_run_site', fake_run_site)
+    sites_file = tmp_path / 'gages.txt'
+    sites_file.write_text('00000001\n00000002\n00000003\n')
+    argv = ['batch', str(sites_file), '--saving-dir', str(tmp_path), '--workers', '0', '--no-prefetch', '--set', 'snow_correction=false']
+
+    assert cli.main(argv) == 1
+    assert calls == ['00000001', '00000002', '00000003']
+    manifest = [json.loads(line) for line in (tmp_path / cli.MANIFEST_NAME).read_text().splitlines()]
+    assert [row['status'] for row in manifest] == ['done', 'done', 'failed']
+
+    # Done and failed sites are skipped, failed sites only run again with --retry-failed
+    assert cli.main(argv) == 1
+    assert len(calls) == 3
+    assert cli.main(argv + ['--retry-failed']) == 0
+    assert calls[3:] == ['00000003']
+    summary = pd.read_csv(tmp_path / cli.SUMMARY_NAME, dtype={'site': str})
+    assert list(summary['status']) == ['done'] * 3
+    assert list(summary['smax']) == [101.0, 102.0, 104.0]
+
+
+def test_batch_prefetches_the_next_group(monkeypatch, tmp_path):
+    prefetched = []
+
+    def fake_prefetch(sites, kwargs):
+        prefetched.append([site['site'] for site in sites])
+        if len(prefetched) == 2:
+            raise ConnectionError('USGS is down')
+    monkeypatch.setattr(cli, '_prefetch', fake_prefetch)
+    monkeypatch.setattr(cli, '_run_site', lambda site, layers, saving_dir, kwargs, verbose=False: {
+        'site': site['site'], 'kind': site['kind'], 'status': 'done', 'seconds': 0.1, 'error': None})
+    sites = [{'site': f'0000000{i}', 'kind': 'watershed', 'coords': [f'0000000{i}'], 'kwargs': {}} for i in range(1, 4)]
+
+    # A failed prefetch leaves the downloads to the sites
+    summary = cli.run_batch(sites, saving_dir=str(tmp_path), workers=0)
+    assert prefetched == [['00000001', '00000002'], ['00000003']]
+    assert list(summary['status']) == ['done'] * 3
+
+
+def test_batch_runs_sites_in_worker_processes(tmp_path):
+    sites = [{'site': 'rivendell', 'kind': 'point', 'coords': [38.5, -122.3], 'kwargs': {}},
+             {'site': 'lothlorien', 'kind': 'point', 'coords': [38.6, -122.4], 'kwargs': {}}]
+    summary = cli.run_batch(sites, saving_dir=str(tmp_path), workers=1)
+
+    # Every site gets the row made by _run_site in its worker, whether or not Earth Engine can be reached from here
+    manifest = [json.loads(line) for line in (tmp_path / cli.MANIFEST_NAME).read_text().splitlines()]
+    assert sorted(row['site'] for row in manifest) == ['lothlorien', 'rivendell']
+    assert all(row['seconds'] is not None and 'location' in row['instrumentation']['stages'] for row in manifest)
+    assert set(summary['status']) <= {'done', 'failed'}
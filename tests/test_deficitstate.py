@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from waterpyk import calcs
+from waterpyk.deficitstate import DeficitState
+
+
+def make_days(n_days, n_sites=3, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2001-08-01', periods=n_days, freq='D')
+    P = np.where(rng.random((n_sites, n_days)) < 0.15, rng.gamma(1, 20, (n_sites, n_days)), 0)
+    ET = rng.gamma(2, 1.5, (n_sites, n_days))
+    snow = np.where(rng.random((n_sites, n_days)) < 0.1, 50.0, 0.0)
+    return dates, P, ET, snow
+
+
+def test_daily_updates_match_batch_deficit():
+    dates, P, ET, snow = make_days(500)
+    D, D_wy, smax, maxdmax = calcs.deficit_many(P, ET, calcs.wateryear_of(dates), snow=snow)
+
+    # Start from the first 300 days, then add days one at a time and then in a batch
+    state = DeficitState.from_many(D[:, :300], D_wy[:, :300], dates[:300], sites=['a', 'b', 'c'])
+    for day in range(300, 400):
+        D_day, D_wy_day = state.update(P[:, day], ET[:, day], snow[:, day])
+        np.testing.assert_allclose(D_day, D[:, day], atol=1e-8)
+        np.testing.assert_allclose(D_wy_day, D_wy[:, day], atol=1e-8)
+    D_batch, D_wy_batch = state.update(P[:, 400:], ET[:, 400:], snow[:, 400:], dates=dates[400:])
+    np.testing.assert_allclose(D_batch, D[:, 400:], atol=1e-8)
+    np.testing.assert_allclose(D_wy_batch, D_wy[:, 400:], atol=1e-8)
+    np.testing.assert_allclose(state.smax, smax)
+    np.testing.assert_allclose(state.maxdmax, maxdmax)
+    assert state.date == dates[-1] and state.wateryear == 2003
+
+    # A state with no history starts from 0 like the batch calculation
+    fresh = DeficitState(np.zeros(3), snow_correction=False)
+    D_fresh, _ = fresh.update(P, ET, dates=dates)
+    np.testing.assert_allclose(D_fresh, calcs.clipped_cumsum(ET - P), atol=1e-8)
+
+
+def test_state_round_trips_through_bytes():
+    dates, P, ET, snow = make_days(100, n_sites=10_000, seed=1)
+    D, D_wy, _, _ = calcs.deficit_many(P, ET, calcs.wateryear_of(dates), snow_correction=False)
+    state = DeficitState.from_many(D, D_wy, dates, snow_correction=False, wateryear_start_month=4)
+    data = state.to_bytes(include_sites=False)
+    assert len(data) < 16 * len(state) + 200
+    restored = DeficitState.from_bytes(data)
+    assert restored.date == state.date and restored.wateryear_start_month == 4 and not restored.snow_correction
+    np.testing.assert_allclose(restored.D, state.D, rtol=1e-6)
+    exact = DeficitState.from_bytes(state.to_bytes(dtype='float64'))
+    np.testing.assert_array_equal(exact.maxdmax, state.maxdmax)
+
+    # Missing values leave the deficit unchanged
+    P_day = np.full(len(state), np.nan)
+    D_day, _ = exact.update(P_day, np.ones(len(state)))
+    np.testing.assert_array_equal(D_day, state.D)
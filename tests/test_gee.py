@@ -1,10 +1,21 @@
+import time
+import types
+
 import ee
 import geopandas as gdp
-from waterpyk import gee
+import pandas as pd
+import pytest
+from waterpyk import cache, gee
 
 ee.Initialize()
 
 
+@pytest.fixture(autouse=True)
+def no_default_cache(monkeypatch):
+    # Request counts below assume nothing is cached between tests
+    monkeypatch.setattr(cache, '_default_cache', None)
+
+
 def test_checks_if_gdf_to_feat_returns_feat():
     gdf = gdp.read_file('tests/testing_data/test_json_sanbern.json')
     gee_feat = gee.gdf_to_feat(gdf)
@@ -51,3 +62,296 @@ def test_extract_basic_prism_for_all_reducers():
     df = gee.extract_basic(gee_feature, kind, asset_id, scale, bands, start_date, end_date,
                            relative_date, bands_to_scale, scaling_factor, reducer_type, new_bandnames, interp)
     assert str(df['date'][0]) == '2001-05'
+
+
+############### FAKE EE BACKEND FOR TESTING EXTRACT() WITHOUT GEE ###############
+
+class FakeList:
+    def __init__(self, items):
+        self.items = list(items)
+
+    def map(self, func):
+        return FakeList([func(item) for item in self.items])
+
+
+class FakeImage:
+    """
+    Image whose bands each have a native projection: assets with an odd asset_id length are in projection 'B', others in 'A'.
+    As in GEE, an image is reduced in the projection of its first band, which changes the values of bands in another projection.
+    """
+
+    def __init__(self, asset_id, values=None, projections=None):
+        self.asset_id = asset_id
+        self.values = values
+        self.projections = projections or {band: 'AB'[len(asset_id) % 2] for band in values or {}}
+
+    def select(self, bands):
+        return FakeImage(self.asset_id, {band: float(len(self.asset_id) + i) for i, band in enumerate(bands)})
+
+    def bandNames(self):
+        return FakeList(self.values)
+
+    def _reduce(self, site):
+        # Each site (geometry) gets different values
+        projection = next(iter(self.projections.values()), None)
+        return {key: value + 100 * site + (0.5 if self.projections[key] != projection else 0)
+                for key, value in self.values.items()}
+
+    def reduceRegion(self, reducer, geometry, scale, maxPixels):
+        return self._reduce(geometry)
+
+    def reduceRegions(self, collection, reducer, scale):
+        # Same values as reduceRegion, but features come back in reverse order
+        features = []
+        for feature in reversed(collection):
+            values = self._reduce(feature.geometry)
+            if reducer.outputs is None and len(values) == 1:
+                # As in GEE, the output of a one-band image is named after the reducer
+                values = {reducer.name: value for value in values.values()}
+            features.append({'properties': {**feature.properties, **values}})
+        return {'features': features}
+
+    def get(self, prop):
+        return 1104537600000  # 2005-01-01
+
+
+class FakeReducer:
+    def __init__(self, name, outputs=None):
+        self.name = name
+        self.outputs = outputs
+
+    def forEach(self, names):
+        return FakeReducer(self.name, names.items)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeCollection:
+    """Daily ImageCollection starting on 2000-01-01 where each value is the number of days since then."""
+
+    def __init__(self, fake_ee, start=None, end=None, bands=None):
+        self.fake_ee = fake_ee
+        self.dates = pd.date_range(start or '2000-01-01', pd.to_datetime(end or '2010-01-01') - pd.Timedelta(days=1), freq='D')
+        self.bands = bands
+
+    def filterDate(self, start, end):
+        return FakeCollection(self.fake_ee, max(pd.to_datetime(start), self.dates[0]), min(pd.to_datetime(end), self.dates[-1] + pd.Timedelta(days=1)), self.bands)
+
+    def select(self, bands):
+        return FakeCollection(self.fake_ee, self.dates[0], self.dates[-1] + pd.Timedelta(days=1), bands)
+
+    def toBands(self):
+        offset = (self.dates - pd.Timestamp('2000-01-01')).days
+        return FakeImage('collection', {date.strftime('%Y_%m_%d') + '_' + band: float(days)
+                                        for date, days in zip(self.dates, offset) for band in self.bands})
+
+    def aggregate_array(self, prop):
+        return FakeComputed(self.fake_ee, [int(date.value // 10**6) for date in self.dates])
+
+
+class FakeComputed:
+    def __init__(self, fake_ee, value):
+        self.fake_ee = fake_ee
+        self.value = value
+
+    def getInfo(self):
+        self.fake_ee.n_requests += 1
+        return self.value
+
+
+class FakeImageConstructor:
+    def __call__(self, asset_id):
+        return FakeImage(asset_id)
+
+    def cat(self, images):
+        values, projections = {}, {}
+        for i, image in enumerate(images):
+            values.update({f'r{i}_{band}': value for band, value in image.values.items()})
+            projections.update({f'r{i}_{band}': projection for band, projection in image.projections.items()})
+        return FakeImage('stacked', values, projections)
+
+
+class FakeEE:
+    """Minimal ee module. Every getInfo() is counted as one request to GEE and takes latency seconds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.n_requests = 0
+        self.Reducer = types.SimpleNamespace(first=lambda: FakeReducer('first'), mean=lambda: FakeReducer('mean'))
+        self.Image = FakeImageConstructor()
+        self.Feature = lambda geometry, properties: types.SimpleNamespace(geometry=geometry, properties=properties)
+        self.FeatureCollection = list
+        self.failures = 0
+
+    def ImageCollection(self, asset_id):
+        return FakeCollection(self)
+
+    def Dictionary(self, values):
+        return FakeDictionary(self, values)
+
+
+class FakeDictionary:
+    def __init__(self, fake_ee, values):
+        self.fake_ee = fake_ee
+        self.values = values
+
+    def resolve(self):
+        return {key: value.resolve() if hasattr(value, 'resolve') else value
+                for key, value in self.values.items()}
+
+    def getInfo(self):
+        self.fake_ee.n_requests += 1
+        time.sleep(self.fake_ee.latency)
+        if self.fake_ee.failures > 0:
+            self.fake_ee.failures -= 1
+            raise RuntimeError('fake GEE error')
+        return self.resolve()
+
+
+class FakeFeature:
+    def __init__(self, site=0):
+        self.site = site
+
+    def geometry(self):
+        return self.site
+
+
+def fake_layers(n):
+    return pd.DataFrame({'name': ['asset' + str(i) for i in range(n)],
+                         'asset_id': ['users/fake/' + 'x' * i for i in range(n)],
+                         'start_date': None, 'end_date': None, 'relative_date': 'image',
+                         'scale': 500, 'bands': 'elevation', 'bands_to_scale': None,
+                         'new_bandnames': None, 'scaling_factor': 1})
+
+
+def test_extract_concurrent_is_faster_and_keeps_order(monkeypatch):
+    latency = 0.1
+    n_layers = 8
+    monkeypatch.setattr(gee, 'ee', FakeEE(latency))
+    kwargs = {'combine_ET_bands': False}
+
+    t1 = time.time()
+    _, df_serial = gee.extract(fake_layers(n_layers), FakeFeature(), 'watershed', stack_requests=False, **kwargs)
+    t_serial = time.time() - t1
+
+    t1 = time.time()
+    _, df_parallel = gee.extract(fake_layers(n_layers), FakeFeature(), 'watershed', max_workers=n_layers, stack_requests=False, **kwargs)
+    t_parallel = time.time() - t1
+
+    assert list(df_parallel['asset_name']) == ['asset' + str(i) for i in range(n_layers)]
+    pd.testing.assert_frame_equal(df_serial, df_parallel)
+    assert t_serial / t_parallel > n_layers / 2, "concurrent extraction did not scale with max_workers"
+
+
+def test_extract_stacks_assets_with_same_scale_into_one_request(monkeypatch):
+    fake_ee = FakeEE(latency=0)
+    monkeypatch.setattr(gee, 'ee', fake_ee)
+    kwargs = {'combine_ET_bands': False}
+    layers = fake_layers(6)
+    layers.loc[5, 'asset_id'] = layers.loc[4, 'asset_id']  # same asset requested twice
+    _, df_single = gee.extract(layers, FakeFeature(), 'watershed', stack_requests=False, **kwargs)
+    assert fake_ee.n_requests == 6
+
+    fake_ee.n_requests = 0
+    _, df_stacked = gee.extract(layers, FakeFeature(), 'watershed', **kwargs)
+    assert fake_ee.n_requests == 1
+    pd.testing.assert_frame_equal(df_single, df_stacked)
+
+    fake_ee.n_requests = 0
+    layers.loc[[0, 2], 'scale'] = 30
+    gee.extract(layers, FakeFeature(), 'watershed', **kwargs)
+    assert fake_ee.n_requests == 2
+    assert gee.plan_requests(layers) == [(30, [0, 2]), (500, [1, 3, 4, 5])]
+
+
+def test_stacked_assets_keep_their_own_projection(monkeypatch):
+    fake_ee = FakeEE(latency=0)
+    monkeypatch.setattr(gee, 'ee', fake_ee)
+    kwargs = {'combine_ET_bands': False}
+    layers = fake_layers(2)
+    images = [fake_ee.Image(asset_id).select(['elevation']) for asset_id in layers['asset_id']]
+    assert images[0].projections != images[1].projections
+    # Reducing both assets as one image changes the values of the second one
+    assert fake_ee.Image.cat(images).reduceRegion('mean', 0, 500, 1e12)['r1_elevation'] != images[1].reduceRegion('mean', 0, 500, 1e12)['elevation']
+
+    _, df_single = gee.extract(layers, FakeFeature(), 'watershed', stack_requests=False, **kwargs)
+    fake_ee.n_requests = 0
+    _, df_stacked = gee.extract(layers, FakeFeature(), 'watershed', **kwargs)
+    assert fake_ee.n_requests == 1
+    pd.testing.assert_frame_equal(df_single, df_stacked)
+    (_, df_regions), = gee.extract_many(layers, [FakeFeature()], 'watershed', **kwargs)
+    pd.testing.assert_frame_equal(df_single, df_regions)
+
+
+def test_extract_many_batches_sites_into_reduce_regions(monkeypatch):
+    fake_ee = FakeEE(latency=0)
+    monkeypatch.setattr(gee, 'ee', fake_ee)
+    kwargs = {'combine_ET_bands': False}
+    layers = fake_layers(3)
+    _, df_single = gee.extract(layers, FakeFeature(), 'watershed', **kwargs)
+
+    fake_ee.n_requests = 0
+    results = gee.extract_many(layers, [FakeFeature(site) for site in range(5)], 'watershed', batch_size=2, **kwargs)
+    assert fake_ee.n_requests == 3  # 1 stacked request x 3 batches of sites
+    assert len(results) == 5
+    for site, (df_long, df_image) in enumerate(results):
+        expected = df_single.copy()
+        expected['value'] = expected['value'] + 100 * site
+        pd.testing.assert_frame_equal(df_image, expected)
+
+    # A stack of one asset with one band (such as the only asset missing from the cache) keeps its band name
+    results = gee.extract_many(layers.iloc[:1], [FakeFeature(site) for site in range(2)], 'watershed', **kwargs)
+    assert [list(df_image['band']) for df_long, df_image in results] == [['elevation'], ['elevation']]
+    assert list(results[1][1]['value']) == [df_single['value'].iloc[0] + 100]
+
+
+def test_extract_basic_chunked_windows_match_single_request(monkeypatch):
+    fake_ee = FakeEE(latency=0)
+    monkeypatch.setattr(gee, 'ee', fake_ee)
+    monkeypatch.setattr(gee.time, 'sleep', lambda seconds: None)
+    args = (FakeFeature(), 'watershed', 'fake/collection', 500, ['ET'], '2003-10-01', '2006-10-01')
+    df_single = gee.extract_basic(*args)
+    assert fake_ee.n_requests == 1
+
+    fake_ee.n_requests = 0
+    fake_ee.failures = 1  # the first window fails once and is retried on its own
+    df_wateryear = gee.extract_basic(*args, chunk_by='wateryear', max_workers=3)
+    assert fake_ee.n_requests == 3 + 1
+    pd.testing.assert_frame_equal(df_single, df_wateryear)
+
+    assert len(gee.time_windows('2003-10-01', '2006-10-01', 'wateryear')) == 3
+    windows = gee.time_windows('2003-10-01', '2006-10-01', 'wateryear', wateryear_start_month=4)
+    assert [str(start.date()) for start, end in windows] == ['2003-10-01', '2004-04-01', '2005-04-01', '2006-04-01']
+    df_april = gee.extract_basic(*args, chunk_by='wateryear', wateryear_start_month=4)
+    pd.testing.assert_frame_equal(df_single, df_april)
+
+    fake_ee.n_requests = 0
+    df_images = gee.extract_basic(*args, chunk_by=400)
+    assert fake_ee.n_requests == 1 + 3  # image dates + 3 windows of up to 400 days
+    pd.testing.assert_frame_equal(df_single, df_images)
+
+
+def test_extract_reuses_cached_assets(monkeypatch, tmp_path):
+    fake_ee = FakeEE(latency=0)
+    monkeypatch.setattr(gee, 'ee', fake_ee)
+    extraction_cache = cache.ExtractionCache(tmp_path)
+    kwargs = {'combine_ET_bands': False, 'cache': extraction_cache}
+    _, df_first = gee.extract(fake_layers(3), FakeFeature(), 'watershed', **kwargs)
+    assert fake_ee.n_requests == 1
+    assert len(extraction_cache) == 3
+
+    fake_ee.n_requests = 0
+    _, df_cached = gee.extract(fake_layers(4), FakeFeature(), 'watershed', stack_size=2, **kwargs)
+    assert fake_ee.n_requests == 1  # only the stack holding the new asset
+    pd.testing.assert_frame_equal(df_first, df_cached.iloc[:3])
+
+    fake_ee.n_requests = 0
+    gee.extract(fake_layers(3), FakeFeature(site=1), 'watershed', **kwargs)
+    assert fake_ee.n_requests == 1  # different geometry
+
+    fake_ee.n_requests = 0
+    results = gee.extract_many(fake_layers(3), [FakeFeature(site) for site in range(4)], 'watershed', **kwargs)
+    assert fake_ee.n_requests == 1  # sites 2 and 3 only
+    for site, (df_long, df_image) in enumerate(results):
+        assert list(df_image['value']) == list(df_first['value'] + 100 * site)
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def test_import_has_no_side_effects(tmp_path):
+    # Fresh interpreter in an empty folder, so earlier imports in this test session do not count
+    code = ('import sys\n'
+            'from waterpyk import calcs, gee, main, watershed\n'
+            'print(sorted(module for module in ["ee", "geopandas", "matplotlib", "seaborn", "scipy", "rasterio", "fiona"] if module in sys.modules))')
+    result = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env={**os.environ, 'PYTHONPATH': str(ROOT)},
+                            capture_output=True, text=True, check=True)
+    assert result.stdout == '[]\n', 'importing waterpyk printed output or imported slow modules: ' + result.stdout
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from waterpyk import instrument
+
+
+def test_stages_and_counts():
+    instrument.count(rows=5)  # nothing is recorded outside of recording()
+    with instrument.recording() as outer:
+        instrument.count(cache_hits=1)
+        with instrument.recording() as site:
+            with instrument.stage('gee:pml'):
+                instrument.count(remote_calls=1, bytes=2000)
+                with instrument.stage('make_wide_df'):
+                    instrument.count(rows=10)
+            with instrument.stage('gee:pml'):
+                instrument.count(remote_calls=2)
+
+    stages = site.to_dict()['stages']
+    assert stages['gee:pml']['count'] == 2 and stages['gee:pml']['remote_calls'] == 3 and stages['gee:pml']['rows'] == 0
+    assert stages['make_wide_df']['rows'] == 10
+    assert stages['gee:pml']['seconds'] >= stages['make_wide_df']['seconds']
+    # The outer recording gets everything of the inner one
+    assert outer.totals() == {'remote_calls': 3, 'bytes': 2000, 'rows': 10, 'cache_hits': 1, 'cache_misses': 0}
+    assert outer.to_dict()['stages'][instrument.OTHER]['cache_hits'] == 1
+
+
+def test_wrap_records_in_threads():
+    def request(i):
+        instrument.count(remote_calls=1, rows=i)
+
+    with instrument.recording() as recorder:
+        with instrument.stage('gee:prism'):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                list(pool.map(instrument.wrap(request), range(10)))
+    assert recorder.to_dict()['stages']['gee:prism']['remote_calls'] == 10
+    assert recorder.to_dict()['stages']['gee:prism']['rows'] == 45
+
+
+def test_aggregate():
+    sites = []
+    for rows in [100, 200]:
+        with instrument.recording() as recorder:
+            with instrument.stage('deficit'):
+                instrument.count(rows=rows)
+        sites.append(recorder.to_dict())
+    sites[1]['stages']['nwis'] = {'seconds': 1e6, 'count': 1, 'remote_calls': 1, 'bytes': 0, 'rows': 0, 'cache_hits': 0, 'cache_misses': 1}
+    sites[1]['seconds'] += 1e6
+
+    df = instrument.aggregate(sites + [None])
+    assert list(df['stage']) == ['nwis', 'deficit']
+    assert list(df['sites']) == [1, 2]
+    assert df.set_index('stage').loc['deficit', 'rows'] == 300
+    assert df['share'].iloc[0] == pytest.approx(1, abs=1e-3)
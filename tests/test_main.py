@@ -1,4 +1,8 @@
-from waterpyk import main
+import types
+
+import numpy as np
+import pandas as pd
+from waterpyk import cache, main
 
 
 def test_point():
@@ -7,4 +11,173 @@ def test_point():
     assert point.site_name == ''
     assert point.description == ''
     
-    
\ No newline at end of file
+    
+
+def synthetic_long(end_date, seed=0):
+    """Daily ET (pml), ppt (prism) and snow (modis_snow) from 2003-10-01 to end_date."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2003-10-01', '2007-09-30', freq='D')
+    n = len(dates)
+    parts = []
+    for asset, band, values in [('pml', 'ET', rng.gamma(2, 1.5, n)),
+                                ('prism', 'ppt', np.where(rng.random(n) < .15, rng.gamma(1, 20, n), 0)),
+                                ('modis_snow', 'snow', np.where(rng.random(n) < .1, 50, 0.0))]:
+        parts.append(pd.DataFrame({'date': dates, 'asset_name': asset, 'value': values, 'band': band}))
+    df = pd.concat(parts, ignore_index=True)
+    return df[df['date'] < end_date].reset_index(drop=True)
+
+
+def test_extend_requests_only_the_tail(monkeypatch, tmp_path, offline_ee):
+    monkeypatch.setattr(main.ee, 'Feature', lambda geometry: geometry)
+    monkeypatch.setattr(main.ee.Geometry, 'Point', lambda x, y: (x, y))
+    df_image = pd.DataFrame({'asset_name': ['srtm'], 'value': [1200.0], 'date': ['2000-02-11'], 'band': ['elevation']})
+    layers = pd.DataFrame({'name': ['pml', 'prism', 'modis_snow'], 'asset_id': ['pml', 'prism', 'modis_snow'],
+                           'start_date': '2003-10-01', 'end_date': '2007-10-01', 'relative_date': None})
+    requested = []
+
+    def fake_extract(layers, gee_feature, kind, **kwargs):
+        requested.extend(zip(layers['start_date'], layers['end_date']))
+        df = synthetic_long(layers['end_date'].max())
+        return df[df['date'] >= layers['start_date'].min()], pd.DataFrame()
+    monkeypatch.setattr(main.gee, 'extract', fake_extract)
+
+    point = main.StudyArea.from_extracted([38.5, -122.3], synthetic_long('2005-06-15'), df_image,
+                                          saving_dir=str(tmp_path))
+    saved = main.StudyArea([38.5, -122.3], layers, saving_dir=str(tmp_path))
+    assert requested == [('2005-05-13', '2007-10-01')] * 3
+
+    full = main.StudyArea.from_extracted([38.5, -122.3], synthetic_long('2007-10-01'), df_image,
+                                         saving_dir=str(tmp_path / 'full'))
+    for name in ['D', 'D_wy']:
+        np.testing.assert_allclose(saved.deficit_timeseries[name], full.deficit_timeseries[name])
+    np.testing.assert_allclose(saved.wateryear_totals['P'], full.wateryear_totals['P'])
+    np.testing.assert_allclose(saved.wateryear_totals['ET_summer'], full.wateryear_totals['ET_summer'])
+    assert saved.smax == full.smax and saved.MAP == full.MAP
+    stages = saved.instrumentation['stages']
+    assert {'location', 'load', 'make_wide_df', 'deficit', 'wateryear', 'save'} <= set(stages)
+    assert all(stages[name]['rows'] > 0 for name in ['load', 'make_wide_df', 'deficit', 'wateryear', 'save'])
+
+    requested.clear()
+    assert not saved.extend(layers)
+    assert requested == []
+
+
+def test_extend_moves_forward_once_new_images_are_published(monkeypatch, tmp_path, offline_ee):
+    monkeypatch.setattr(main.ee, 'Feature', lambda geometry: types.SimpleNamespace(geometry=lambda: geometry))
+    monkeypatch.setattr(main.ee.Geometry, 'Point', lambda x, y: (x, y))
+    monkeypatch.setattr(main.gee, 'get_reducer', lambda kind, reducer_type=None: 'first')
+    df_image = pd.DataFrame({'asset_name': ['srtm'], 'value': [1200.0], 'date': ['2000-02-11'], 'band': ['elevation']})
+    layers = pd.DataFrame({'name': ['pml', 'prism', 'modis_snow'], 'asset_id': ['pml', 'prism', 'modis_snow'],
+                           'start_date': '2003-10-01', 'end_date': '2007-10-01', 'relative_date': None, 'scale': 500,
+                           'bands': ['ET', 'ppt', 'snow'], 'bands_to_scale': None, 'new_bandnames': None, 'scaling_factor': 1})
+    published = {'until': '2005-06-15'}
+    monkeypatch.setattr(main.gee, 'today', lambda: pd.Timestamp(published['until']))
+    requests = []
+
+    def fake_request(gee_feature, reducer_type, scale, specs):
+        # toBands() output of the images published so far
+        requests.append(len(specs))
+        df = synthetic_long(published['until'])
+        results = []
+        for spec in specs:
+            df_asset = df[(df['asset_name'] == spec['asset_id']) & (df['date'] >= pd.to_datetime(spec['start_date'])) &
+                          (df['date'] < pd.to_datetime(spec['end_date']))]
+            results.append(({f'{date:%Y_%m_%d}_{band}': value for date, value, band in zip(df_asset['date'], df_asset['value'], df_asset['band'])}, None))
+        return results
+    monkeypatch.setattr(main.gee, '_request_stacked', fake_request)
+    kwargs = {'saving_dir': str(tmp_path), 'cache': cache.ExtractionCache(str(tmp_path / 'cache')), 'combine_ET_bands': False}
+
+    main.StudyArea.from_extracted([38.5, -122.3], synthetic_long(published['until']), df_image, **kwargs)
+    saved = main.StudyArea([38.5, -122.3], layers, **kwargs)
+    assert saved.deficit_timerange[1] == pd.Timestamp('2005-06-14')
+    assert len(kwargs['cache']) == 0  # the tail did not reach 2007-10-01
+
+    published['until'] = '2006-02-01'
+    saved = main.StudyArea([38.5, -122.3], layers, **kwargs)
+    assert requests == [3, 3]
+    assert saved.deficit_timerange[1] == pd.Timestamp('2006-01-31')
+
+
+def test_extend_keeps_composites_that_end_before_the_end_date(monkeypatch, tmp_path, offline_ee):
+    monkeypatch.setattr(main.ee, 'Feature', lambda geometry: geometry)
+    monkeypatch.setattr(main.ee.Geometry, 'Point', lambda x, y: (x, y))
+    layers = pd.DataFrame({'name': ['pml', 'prism', 'modis_snow'], 'asset_id': ['pml', 'prism', 'modis_snow'],
+                           'start_date': '2003-10-01', 'end_date': '2006-10-01', 'relative_date': None})
+    requested = []
+
+    def fake_extract(layers, gee_feature, kind, **kwargs):
+        # pml is an 8-day composite, so its last image starts days before the end date
+        requested.extend(zip(layers['start_date'], layers['end_date']))
+        df = synthetic_long(layers['end_date'].max())
+        df = df[(df['asset_name'] != 'pml') | ((df['date'] - pd.Timestamp('2003-10-01')).dt.days % 8 == 0)]
+        return df[df['date'] >= layers['start_date'].min()].reset_index(drop=True), pd.DataFrame()
+    monkeypatch.setattr(main.gee, 'extract', fake_extract)
+
+    extracted = main.StudyArea([38.5, -122.3], layers, saving_dir=str(tmp_path))
+    assert extracted.metadata['timeseries_end']['pml'] < pd.Timestamp('2006-09-30')
+    assert requested == [('2003-10-01', '2006-10-01')] * 3
+
+    requested.clear()
+    saved = main.StudyArea([38.5, -122.3], layers, saving_dir=str(tmp_path))
+    assert requested == []
+    assert saved.metadata['timeseries_requested_end'] == {'pml': '2006-10-01', 'prism': '2006-10-01', 'modis_snow': '2006-10-01'}
+
+    saved.extend(layers, end_date='2007-10-01')
+    assert requested == [('2006-08-22', '2007-10-01')] + [('2006-08-29', '2007-10-01')] * 2
+    assert saved.metadata['timeseries_requested_end']['pml'] == '2007-10-01'
+
+
+def test_saved_dataframes_are_loaded_lazily(monkeypatch, tmp_path, offline_ee):
+    monkeypatch.setattr(main.ee, 'Feature', lambda geometry: geometry)
+    monkeypatch.setattr(main.ee.Geometry, 'Point', lambda x, y: (x, y))
+    df_image = pd.DataFrame({'asset_name': ['srtm'], 'value': [1200.0], 'date': ['2000-02-11'], 'band': ['elevation']})
+    extracted = main.StudyArea.from_extracted([38.5, -122.3], synthetic_long('2006-10-01'), df_image,
+                                              saving_dir=str(tmp_path))
+
+    read = []
+    read_saved = main.StudyArea.read_saved
+    monkeypatch.setattr(main.StudyArea, 'read_saved', lambda self, name, columns=None: read.append(name) or read_saved(self, name, columns))
+    saved = main.StudyArea([38.5, -122.3], saving_dir=str(tmp_path))
+    assert (saved.smax, saved.maxdmax, saved.MAP) == (extracted.smax, extracted.maxdmax, extracted.MAP)
+    assert saved.deficit_timerange == extracted.deficit_timerange
+    assert read == []
+
+    pd.testing.assert_frame_equal(saved.wateryear_totals, extracted.wateryear_totals.reset_index(drop=True))
+    saved.wateryear_totals
+    assert read == ['wateryear_totals']
+
+
+def test_daily_df_long_of_older_folders_is_read(monkeypatch, tmp_path, offline_ee):
+    monkeypatch.setattr(main.ee, 'Feature', lambda geometry: geometry)
+    monkeypatch.setattr(main.ee.Geometry, 'Point', lambda x, y: (x, y))
+    df_long = synthetic_long('2006-10-01')
+    extracted = main.StudyArea.from_extracted([38.5, -122.3], df_long, pd.DataFrame(), saving_dir=str(tmp_path))
+    assert extracted.daily_data.values.shape == (1096, 3)
+
+    # Earlier versions saved the daily data in the long format
+    folder = tmp_path / '38.5_-122.3'
+    (folder / 'daily_data.parquet').unlink()
+    df_long.to_csv(folder / 'daily_df_long.csv')
+    saved = main.StudyArea([38.5, -122.3], saving_dir=str(tmp_path))
+    pd.testing.assert_frame_equal(saved.daily_df_long.astype({'asset_name': str, 'band': str}), df_long, check_dtype=False)
+
+    saved._save()
+    assert sorted(path.name for path in folder.glob('daily_*')) == ['daily_data.parquet', 'daily_df_wide.parquet']
+
+
+def test_collection_uses_the_streamflow_of_the_multi_site_request(monkeypatch, tmp_path, offline_ee):
+    gages = ['11475560', '11476600']
+    monkeypatch.setattr(main.watershed, 'extract_metadata', lambda gage: ('Gage ' + gage, ''))
+    monkeypatch.setattr(main.watershed, 'extract_geometry', lambda gage: (gage, None))
+    dates = pd.date_range('2003-10-01', '2006-09-30')
+    streamflow = {gage: pd.DataFrame({'date': dates, 'Q_mm': float(i + 1)}) for i, gage in enumerate(gages)}
+    monkeypatch.setattr(main.watershed, 'extract_streamflow_many', lambda gages, **kwargs: streamflow)
+
+    def download_again(gage, **kwargs):
+        raise AssertionError('the streamflow of ' + gage + ' was downloaded again')
+    monkeypatch.setattr(main.watershed, 'extract_streamflow', download_again)
+    df_image = pd.DataFrame({'asset_name': ['srtm'], 'value': [1200.0], 'date': ['2000-02-11'], 'band': ['elevation']})
+    monkeypatch.setattr(main.gee, 'extract_many', lambda layers, gee_features, kind, **kwargs: [(synthetic_long('2006-10-01'), df_image)] * len(gee_features))
+
+    collection = main.StudyAreaCollection(gages, pd.DataFrame(), saving_dir=str(tmp_path))
+    assert [study_area.daily_df_wide['Q_mm'].iloc[0] for study_area in collection.study_areas] == [1.0, 2.0]
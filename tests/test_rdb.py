@@ -0,0 +1,37 @@
+import io
+
+import numpy as np
+import pandas as pd
+from waterpyk import rdb
+
+
+def section(site, rows, comments=3, ts='149'):
+    lines = [f'# comment for {site}'] * comments
+    lines += [f'agency_cd\tsite_no\tdatetime\t{ts}_00060_00003\t{ts}_00060_00003_cd', '5s\t15s\t20d\t14n\t10s']
+    lines += [f'USGS\t{site}\t{date}\t{value}\t{code}' for date, value, code in rows]
+    return '\n'.join(lines) + '\n'
+
+
+ROWS = [('1985-10-01', '1.5', 'A'), ('1985-10-02', 'Ice', 'A'), ('1985-10-03', '', 'P'), ('1985-10-04', '2.5', 'A:e')]
+
+
+def test_read_rdb_with_qualifiers():
+    df = rdb.read_rdb(section('11475560', ROWS, comments=12).encode('utf-8'))
+    assert list(df.columns) == ['agency_cd', 'site_no', 'datetime', '149_00060_00003', '149_00060_00003_cd', '149_00060_00003_qualifier']
+    assert df['149_00060_00003'].dtype == 'float64'
+    assert pd.api.types.is_datetime64_any_dtype(df['datetime'])
+    assert isinstance(df['site_no'].dtype, pd.CategoricalDtype)
+    np.testing.assert_array_equal(df['149_00060_00003'], [1.5, np.nan, np.nan, 2.5])
+    assert list(df['149_00060_00003_qualifier'].astype(object).fillna('')) == ['', 'Ice', '', '']
+
+
+def test_daily_values_of_several_sites_in_chunks():
+    text = section('11475560', ROWS) + section('11476600', ROWS[:3], ts='150') + section('00000000', [])
+    chunks = list(rdb.iter_daily_values(io.BytesIO(text.encode('utf-8')), chunksize=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 2, 1]
+    df = rdb.read_daily_values(text.encode('utf-8'), chunksize=2)
+    assert list(df.columns) == ['site_no', 'date', 'Q_cfs', 'Q_cfs_cd', 'Q_cfs_qualifier']
+    assert list(df['site_no'].value_counts().sort_index()) == [4, 3]
+    assert isinstance(df['site_no'].dtype, pd.CategoricalDtype)
+    assert list(df['Q_cfs_cd'])[-1] == 'P'
+    assert rdb.read_daily_values(b'# No sites found\n').empty
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from waterpyk.sitedata import SiteData
+
+
+def long_df():
+    dates = pd.date_range('2003-10-01', periods=400, freq='D')
+    rng = np.random.default_rng(0)
+    parts = [pd.DataFrame({'date': dates, 'asset_name': 'pml', 'value': rng.gamma(2, 1.5, 400), 'band': 'ET'}),
+             pd.DataFrame({'date': dates[10:], 'asset_name': 'prism', 'value': rng.gamma(1, 5, 390), 'band': 'ppt'}),
+             pd.DataFrame({'date': dates[:20], 'asset_name': 'modis_snow', 'value': 0.0, 'band': 'snow'})]
+    return pd.concat(parts, ignore_index=True)
+
+
+def test_long_format_round_trip():
+    df = long_df()
+    data = SiteData.from_long(df)
+    assert data.values.shape == (400, 3)
+    assert data.asset_names == ['pml', 'prism', 'modis_snow']
+    df_long = data.to_long()
+    assert isinstance(df_long['asset_name'].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(df_long.astype({'asset_name': str, 'band': str}), df, check_dtype=False)
+    pd.testing.assert_frame_equal(SiteData.from_frame(data.to_frame()).values, data.values)
+    assert data.memory_usage() * 2 < df.memory_usage(deep=True).sum()
+    assert data.end_dates()['modis_snow'] == pd.Timestamp('2003-10-20')
+
+
+def test_update_replaces_each_timeseries_from_its_first_new_date():
+    data = SiteData.from_long(long_df())
+    new = pd.DataFrame({'date': pd.date_range('2004-10-01', periods=30, freq='D'), 'asset_name': 'pml', 'value': -1.0, 'band': 'ET'})
+    updated = data.update(new)
+    et = updated.get('pml', 'ET')
+    assert et.index[-1] == pd.Timestamp('2004-10-30')
+    assert (et[et.index >= '2004-10-01'] == -1).all()
+    pd.testing.assert_series_equal(et[et.index < '2004-10-01'], data.get('pml', 'ET')[:'2004-09-30'], check_freq=False)
+    # The other timeseries keep their dates
+    assert updated.get('prism', 'ppt').index[-1] == data.get('prism', 'ppt').index[-1]
+    assert len(updated.select('prism', 'tmax')) == 0
@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+from waterpyk import storage
+
+
+def make_df():
+    return pd.DataFrame({'date': pd.date_range('2003-10-01', periods=5), 'ET': [1.0, 2.0, 3.0, 4.0, 5.0],
+                         'wateryear': 2004})
+
+
+@pytest.mark.parametrize('name', ['parquet', 'feather', 'csv'])
+def test_storage_round_trip_keeps_types(name, tmp_path):
+    backend = storage.get_storage(name)
+    path = str(tmp_path / 'daily_df_wide')
+    backend.write(make_df().set_index('date', drop=False), path)
+    df = backend.read(path)
+    assert list(df.columns) == ['date', 'ET', 'wateryear']
+    assert pd.api.types.is_datetime64_any_dtype(df['date'])
+    pd.testing.assert_frame_equal(df, make_df(), check_dtype=False)
+    assert list(backend.read(path, columns=['ET']).columns) == ['ET']
+
+
+def test_storage_reads_old_csv_folders(tmp_path):
+    path = str(tmp_path / 'wateryear_totals')
+    df_total = pd.DataFrame({'wateryear': [2004, 2005], 'P': [500.0, 700.0]})
+    df_total.index = df_total['wateryear']
+    df_total.to_csv(path + '.csv')
+
+    backend = storage.find(path)
+    assert isinstance(backend, storage.CSVStorage)
+    assert list(backend.read(path).columns) == ['wateryear', 'P']
+    assert storage.find(str(tmp_path / 'missing')) is None
@@ -1,8 +1,11 @@
+import json
+import types
+
 import geopandas as gpd
 import pandas as pd
 import pytest
 from pandas.testing import assert_frame_equal
-from waterpyk import errors, watershed
+from waterpyk import cache, errors, watershed
 
 # python3 -m pytest tests -v --disable-warnings
 
@@ -100,3 +103,84 @@ def test_checks_if_usgs_api_streamflow_has_changed():
 def test_checks_if_latitude_changed():
     lat = watershed.extract_latitude(11475560)
     assert round(lat, 5) == 39.71395
+
+
+############### TESTING GAGECLIENT ###############
+
+BASIN = {'type': 'FeatureCollection', 'features': [{'type': 'Feature', 'properties': {},
+         'geometry': {'type': 'Polygon', 'coordinates': [[[-123.65, 39.72], [-123.62, 39.72], [-123.62, 39.74],
+                                                          [-123.65, 39.74], [-123.65, 39.72]]]}}]}
+METADATA = {'type': 'FeatureCollection', 'features': [{'type': 'Feature', 'geometry': None,
+            'properties': {'name': 'ELDER C NR BRANSCOMB CA', 'identifier': 'USGS-11475560'}}]}
+RDB = '\n'.join(['# comment'] * 30 + ['agency_cd\tsite_no\tdatetime\t149_00060_00003\t149_00060_00003_cd',
+                                       '5s\t15s\t20d\t14n\t10s',
+                                       'USGS\t11475560\t1985-10-01\t1.5\tA',
+                                       'USGS\t11475560\t1985-10-02\t2.5\tA'])
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content.encode('utf-8')
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        if 'basin' in url:
+            return FakeResponse(json.dumps(BASIN))
+        if 'sites=' in url:
+            return FakeResponse(RDB + '\n' + RDB.replace('11475560', '11476600').replace('1.5', 'Ice'))
+        if 'nwis/dv' in url:
+            return FakeResponse(RDB)
+        return FakeResponse(json.dumps(METADATA))
+
+
+def test_gage_client_downloads_each_resource_once(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(watershed, 'get_session', lambda: session)
+    monkeypatch.setattr(cache, '_default_cache', None)
+    monkeypatch.setattr(watershed, 'ee', types.SimpleNamespace(
+        Feature=lambda geometry: geometry, Geometry=types.SimpleNamespace(Polygon=lambda coords: coords)))
+    watershed._client.cache_clear()
+
+    site_name, description = watershed.extract_metadata(11475560)
+    gee_feature, basin_geometry = watershed.extract_geometry(11475560)
+    df = watershed.extract_streamflow(11475560, flow_start_date='1985-10-01', flow_end_date='1985-10-03')
+    latitude = watershed.extract_latitude('11475560')
+    watershed._client.cache_clear()
+
+    assert site_name == ['Elder C Nr Branscomb Ca']
+    assert len(gee_feature) == 5
+    assert round(latitude, 2) == 39.73
+    assert list(df['Q_cfs']) == [1.5, 2.5]
+    assert df['Q_mm'].iloc[0] == pytest.approx(1.5 * 86400 / 35.31 / watershed.GageClient(11475560, session).drainage_area_m2() * 1000)
+    assert len(session.urls) == 3 + 1  # basin, metadata and streamflow once (+ basin for the new client above)
+    assert len(set(session.urls)) == 3
+
+
+def test_streamflow_of_many_gages_in_one_request(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(watershed, 'get_session', lambda: session)
+    monkeypatch.setattr(cache, '_default_cache', None)
+    watershed._client.cache_clear()
+
+    kwargs = {'flow_start_date': '1985-10-01', 'flow_end_date': '1985-10-03'}
+    streamflow = watershed.extract_streamflow_many([11475560, '11476600', 11477000], **kwargs)
+    df = watershed.extract_streamflow(11476600, **kwargs)
+    watershed._client.cache_clear()
+
+    assert list(streamflow) == ['11475560', '11476600', '11477000']
+    assert list(streamflow['11475560']['Q_cfs']) == [1.5, 2.5]
+    assert streamflow['11477000'].empty and 'Q_mm' in streamflow['11477000']
+    assert df['Q_cfs'].isna().tolist() == [True, False]
+    assert list(df['Q_cfs_qualifier'].astype(object))[0] == 'Ice'
+    assert df['Q_mm'].iloc[1] == pytest.approx(streamflow['11475560']['Q_mm'].iloc[1])  # same (fake) basin
+    # One discharge request for the three gages, and one basin each for the drainage areas
+    assert sum('nwis/dv' in url for url in session.urls) == 1
+    assert len(session.urls) == 1 + 3
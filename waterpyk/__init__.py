@@ -6,10 +6,9 @@ __author__ = """Erica McCormick"""
 __email__ = "erica.elmstead@gmail.com"
 __version__ = "1.1.1"
 
-import sys
 import os
-import pkg_resources
-import pandas as pd
+import sys
+
 
 def load_data(layers):
     """Finds the import data (either all.csv or minimal.csv corresponding to layers input) and loads it.
@@ -20,6 +19,8 @@ def load_data(layers):
     Returns:
         :obj:`df`: dataframe of read csv from layers.
     """
+    import pandas as pd
+    import pkg_resources
     
     file_path = 'layers_data/' + layers + '.csv'
     stream = pkg_resources.resource_stream(__name__, file_path)
@@ -38,19 +39,19 @@ def in_colab_shell():
     else:
         return False
 
-if in_colab_shell():
-    print('\nOutput will be saved at /content/drive/MyDrive' + '\n')
-    default_saving_dir = '/content/drive/MyDrive'
-else:
-    path = os.path.join(os.getcwd(), 'data', 'output')
-    if os.path.exists(path):
-        print('\nOutput will be saved at existing directory' + path + '\n')
-        default_saving_dir = path
-    else:
-        print('\nMaking new directory for output at' + path + '\n')
-        os.mkdir(os.path.join(os.getcwd(), 'data'))
-        os.mkdir(os.path.join(os.getcwd(), 'data', 'output'))
-        default_saving_dir = path
-        
-        
-    
\ No newline at end of file
+def get_default_saving_dir():
+    """Get the default saving directory: /content/drive/MyDrive in Google Colab and data/output in the current working directory otherwise.
+    The directory is not created here, but when data is first saved in it.
+    
+    Returns:
+        str
+    """
+    if in_colab_shell():
+        return '/content/drive/MyDrive'
+    return os.path.join(os.getcwd(), 'data', 'output')
+
+def __getattr__(name):
+    # waterpyk.default_saving_dir is resolved when it is used instead of at import
+    if name == 'default_saving_dir':
+        return get_default_saving_dir()
+    raise AttributeError(f"module 'waterpyk' has no attribute '{name}'")
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urlparse
+
+import pandas as pd
+
+from waterpyk import instrument, watershed
+from waterpyk.cache import resolve as resolve_cache
+
+# Index of each resource in the urls from watershed.extract_urls()
+RESOURCES = {'basin': 0, 'flowlines': 1, 'metadata': 2, 'streamflow': 3}
+
+# HTTP statuses that are worth retrying
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    Limit the requests per second to one host: requests are spaced at least 1 / rate seconds apart.
+
+    Args:
+        rate (float): maximum number of requests per second. None for no limit.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._next = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if self.rate is None:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + 1 / self.rate
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class _TransientError(Exception):
+    pass
+
+
+async def _get(session, url, limiter, retries, backoff):
+    """Get url, retrying connection errors, timeouts and transient statuses with exponential backoff. Returns (text, attempts)."""
+    import aiohttp
+
+    for attempt in range(retries + 1):
+        await limiter.wait()
+        instrument.count(remote_calls=1)
+        try:
+            async with session.get(url) as response:
+                if response.status in TRANSIENT_STATUSES:
+                    # Respect Retry-After (in seconds) if the server sends it
+                    retry_after = response.headers.get('Retry-After', '')
+                    raise _TransientError(f'HTTP {response.status}',
+                                          float(retry_after) if retry_after.isdigit() else None)
+                response.raise_for_status()
+                text = await response.text()
+                instrument.count(bytes=len(text.encode('utf-8')))
+                return text, attempt + 1
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError, _TransientError) as e:
+            if attempt == retries:
+                raise
+            wait = backoff * 2 ** attempt
+            if isinstance(e, _TransientError) and e.args[1] is not None:
+                wait = max(wait, e.args[1])
+            await asyncio.sleep(wait)
+
+
+async def fetch_gages_async(gages, resources=('basin', 'metadata', 'streamflow'), concurrency=32, rate_limit=10,
+                            retries=4, backoff=0.5, timeout=60, cache=None, on_result=None, **kwargs):
+    """
+    Coroutine version of fetch_gages(), for code that already runs an event loop.
+    """
+    import aiohttp
+
+    cache = resolve_cache(cache)
+    jobs = []
+    for gage in gages:
+        urls = watershed.extract_urls(gage, **kwargs)
+        for resource in resources:
+            jobs.append((watershed.format_gage(gage), resource, urls[RESOURCES[resource]]))
+
+    limiters = {}
+    for gage, resource, url in jobs:
+        host = urlparse(url).netloc
+        if host not in limiters:
+            rate = rate_limit.get(host) if isinstance(rate_limit, dict) else rate_limit
+            limiters[host] = RateLimiter(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    rows = []
+
+    async def run(gage, resource, url, session):
+        row = {'gage': gage, 'resource': resource, 'url': url, 'status': None, 'attempts': 0,
+               'bytes': 0, 'seconds': 0.0, 'error': None}
+        t1 = time.perf_counter()
+        if cache is not None and watershed.usgs_cache_key(cache, url) in cache:
+            row['status'] = 'cached'
+        else:
+            async with semaphore:
+                try:
+                    text, row['attempts'] = await _get(session, url, limiters[urlparse(url).netloc], retries, backoff)
+                except Exception as e:
+                    row['status'] = 'failed'
+                    row['error'] = str(e) or type(e).__name__
+                else:
+                    row['status'] = 'ok'
+                    row['bytes'] = len(text.encode('utf-8'))
+                    # Store each result as soon as it arrives (off the event loop), so an interrupted run keeps what it got
+                    if cache is not None and watershed.is_cacheable(url):
+                        await asyncio.get_running_loop().run_in_executor(None, lambda: cache.put(
+                            watershed.usgs_cache_key(cache, url), text, source='usgs', url=url, gage=gage, resource=resource))
+                    watershed.get_client(gage).add_response(url, text.encode('utf-8'))
+        row['seconds'] = time.perf_counter() - t1
+        rows.append(row)
+        if on_result is not None:
+            on_result(row)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        await asyncio.gather(*[run(gage, resource, url, session) for gage, resource, url in jobs])
+
+    order = {(gage, resource): i for i, (gage, resource, url) in enumerate(jobs)}
+    rows.sort(key=lambda row: order[(row['gage'], row['resource'])])
+    return pd.DataFrame(rows, columns=['gage', 'resource', 'url', 'status', 'attempts', 'bytes', 'seconds', 'error'])
+
+
+def fetch_gages(gages, resources=('basin', 'metadata', 'streamflow'), concurrency=32, rate_limit=10,
+                retries=4, backoff=0.5, timeout=60, cache=None, on_result=None, **kwargs):
+    """
+    Download the USGS data of many gages at once with asyncio (needs aiohttp).
+    Results are stored in the persistent cache as they arrive and kept in memory by watershed.get_client(),
+    so StudyAreas made afterwards for these gages do not download them again.
+    A gage that fails does not stop the others: its error is reported in the returned dataframe.
+
+    Args:
+        gages (list of str or int): USGS gage IDs.
+        resources (list of str, optional): (default ('basin', 'metadata', 'streamflow')) resources to get for each gage, from 'basin', 'flowlines', 'metadata' and 'streamflow'.
+        concurrency (int, optional): (default 32) maximum number of requests at the same time.
+        rate_limit (float or dict, optional): (default 10) maximum requests per second to each host, or a dict of {host: requests per second}. None for no limit.
+        retries (int, optional): (default 4) number of times a request is retried after a connection error, timeout or transient HTTP status (408, 429, 5xx).
+        backoff (float, optional): (default 0.5) seconds before the first retry, doubled for each further retry. A longer Retry-After from the server is respected.
+        timeout (float, optional): (default 60) timeout in seconds for each request.
+        cache (:obj:`ExtractionCache` or bool, optional): (default None) cache to store results in, see cache.resolve(). Resources already in it are not downloaded again.
+        on_result (function, optional): (default None) called with the row (dict) of each resource as it finishes, for example to report progress.
+        **flow_start_date (str, optional): default: '1980-10-01'
+        **flow_end_date (str, optional): default: '2021-10-01'
+
+    Returns:
+        :obj:`df`: one row per gage and resource with columns gage, resource, url, status ('ok', 'cached' or 'failed'), attempts, bytes, seconds and error.
+    """
+    coroutine = fetch_gages_async(gages, resources, concurrency, rate_limit, retries, backoff, timeout, cache, on_result, **kwargs)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # An event loop is already running (such as in Jupyter), so run in another thread
+    result = {}
+
+    def run():
+        try:
+            result['value'] = asyncio.run(coroutine)
+        except BaseException as e:
+            result['error'] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
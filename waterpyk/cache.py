@@ -0,0 +1,184 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import pandas as pd
+
+from waterpyk import get_default_saving_dir, instrument
+
+# Sentinel for a default cache that has not been made yet
+_NOT_SET = object()
+_default_cache = _NOT_SET
+
+
+class ExtractionCache:
+    """
+    Persistent cache for the raw GEE output of single-asset extractions.
+    Each entry is stored once, in a gzipped json file named after the hash of everything that determines the output
+    (asset_id, bands, dates, scale, reducer and geometry), so it is reused by any StudyArea or layers table that asks for the same thing.
+    When the cache is larger than max_bytes, the least recently used entries are removed.
+
+    Args:
+        directory (str): folder for the cache files. Created if it does not exist.
+        max_bytes (int, optional): maximum total size of the cache files. Default 1 GB.
+    """
+
+    def __init__(self, directory, max_bytes=1e9):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # total size in bytes, counted on first use and then kept up to date
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(**parts):
+        """
+        Get the cache key (a sha256 hex digest) for the parts that determine an extraction, such as asset_id, bands, start_date, end_date, scale, reducer and geometry.
+        """
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.directory, key + '.json.gz')
+
+    def get(self, key):
+        """
+        Get the value stored for key, or None if it is not in the cache.
+        """
+        path = self._file(key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, EOFError, OSError, ValueError):
+            instrument.count(cache_misses=1)
+            return None
+        instrument.count(cache_hits=1)
+        # Mark as recently used for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry['value']
+
+    def put(self, key, value, **metadata):
+        """
+        Store a json-serializable value for key. Metadata (such as asset_id and dates) is stored alongside it for info().
+        """
+        path = self._file(key)
+        temp_path = path + '.' + uuid.uuid4().hex + '.tmp'
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            json.dump({'metadata': metadata, 'value': value}, f, default=str)
+        size = os.path.getsize(temp_path)
+        with self._lock:
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temp_path, path)
+            if self._size is not None:
+                self._size += size - replaced
+        if self.size() > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json.gz'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((name, stat.st_size, stat.st_mtime))
+        return entries
+
+    def size(self):
+        """
+        Total size of the cache files in bytes.
+        """
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for name, size, mtime in self._entries())
+            return self._size
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is no larger than max_bytes.
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for name, size, mtime in entries)
+            for name, size, mtime in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._size = total
+
+    def info(self):
+        """
+        Get a dataframe with one row per cache entry: key, size_bytes, last_used and the stored metadata (asset_id, bands, dates, scale).
+        """
+        rows = []
+        for name, size, mtime in self._entries():
+            try:
+                with gzip.open(os.path.join(self.directory, name), 'rt', encoding='utf-8') as f:
+                    metadata = json.load(f)['metadata']
+            except (EOFError, OSError, ValueError):
+                metadata = {}
+            rows.append({'key': name[:-len('.json.gz')], 'size_bytes': size,
+                         'last_used': pd.to_datetime(mtime, unit='s'), **metadata})
+        return pd.DataFrame(rows)
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+            self._size = 0
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __repr__(self):
+        return f"ExtractionCache('{self.directory}', {len(self)} entries, {self.size()} bytes)"
+
+
+def get_default_cache():
+    """
+    Get the cache used by gee extractions when no cache is given. Defaults to an ExtractionCache in the 'cache' folder of the default saving directory.
+
+    Returns:
+        :obj:`ExtractionCache` or None if caching was turned off with set_default_cache(None).
+    """
+    global _default_cache
+    if _default_cache is _NOT_SET:
+        _default_cache = ExtractionCache(os.path.join(get_default_saving_dir(), 'cache'))
+    return _default_cache
+
+
+def set_default_cache(cache):
+    """
+    Set the cache used by gee extractions when no cache is given.
+
+    Args:
+        cache (:obj:`ExtractionCache`, str or None): a cache, a folder to make a cache in, or None to turn off caching by default.
+    """
+    global _default_cache
+    if isinstance(cache, str):
+        cache = ExtractionCache(cache)
+    _default_cache = cache
+
+
+def resolve(cache):
+    """Turn the cache argument of the extraction functions into a cache: None gives the default cache and False gives no cache."""
+    if cache is None:
+        return get_default_cache()
+    if cache is False:
+        return None
+    return cache
@@ -1,28 +1,73 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import pandas as pd
 import numpy as np
-import datetime
 import waterpyk.errors as err
+from waterpyk.sitedata import SiteData
 
-def interp_daily(df):
+def _interp_columns(values, method = 'linear'):
+    """Fill NaNs in each column of a 2-D (days x bands) array from the nearest valid rows above and below."""
+    n_rows, n_cols = values.shape
+    rows = np.arange(n_rows)[:, None]
+    cols = np.arange(n_cols)[None, :]
+    valid = ~np.isnan(values)
+    # Index of the last valid row at or before each row (-1 if none) and the first at or after it (n_rows if none)
+    prev_row = np.maximum.accumulate(np.where(valid, rows, -1), axis=0)
+    next_row = np.minimum.accumulate(np.where(valid, rows, n_rows)[::-1], axis=0)[::-1]
+    has_prev = prev_row >= 0
+    has_next = next_row < n_rows
+    prev_value = values[np.clip(prev_row, 0, n_rows - 1), cols]
+    next_value = values[np.clip(next_row, 0, n_rows - 1), cols]
+
+    if method == 'linear':
+        span = np.where(next_row > prev_row, next_row - prev_row, 1)
+        out = prev_value + (next_value - prev_value) * (rows - prev_row) / span
+    elif method == 'nearest':
+        out = np.where((rows - prev_row) <= (next_row - rows), prev_value, next_value)
+    elif method == 'step':
+        out = prev_value.copy()
+    else:
+        raise ValueError(f"method must be 'linear', 'nearest' or 'step'. Got {method}.")
+    # After the last observation, carry it forward; before the first, leave NaN
+    out = np.where(has_next, out, prev_value)
+    out[~has_prev] = np.nan
+    return out
+
+
+def interp_daily(df, method = 'linear'):
     """Interpolate all data to daily.
+    All bands are placed on one daily date axis (from the first to the last date, inclusive) and interpolated together.
         
         Args:
             :obj:`df`: initial long-form dataframe for a single asset (may contain multiple bands) with column 'value' for interpolating
+            method (str, optional): 'linear' (default), 'nearest' (value of the closest observation; ties use the earlier one), or 'step' (value of the previous observation).
         
         Returns:
            :obj:`df`: dataframe with 'value' column containing daily interpolated daily 
     """
-    df_interp = pd.DataFrame()
-    temp = pd.DataFrame()
-    diff_days = (df.date.max() - df.date.min()).days
-    temp['date'] = [df.date.min() + datetime.timedelta(days=x) for x in range(0, diff_days)]
-    for i in df.band.unique():
-        df_temp = df[df['band']==i]
-        df_temp = df_temp.merge(temp, how = 'right', on = 'date')
-        df_temp['value'] = df_temp['value'].interpolate(method = "linear")
-        df_temp['band'] = i
-        df_interp = pd.concat([df_interp,df_temp])
-    return df_interp
+    df = df.drop_duplicates(subset = ['date', 'band'], keep = 'first')
+    start = df.date.min()
+    n_days = (df.date.max() - start).days + 1
+    bands = df.band.unique()
+    dates = pd.date_range(start, periods = n_days, freq = 'D')
+
+    # Position of each row in the output, which is ordered band by band and then by date
+    position = pd.Index(bands).get_indexer(df['band']) * n_days + (df['date'] - start).dt.days.to_numpy()
+    grid = np.full(n_days * len(bands), np.nan)
+    grid[position] = df['value'].to_numpy(dtype = float)
+    values = _interp_columns(grid.reshape(len(bands), n_days).T, method)
+
+    df_interp = pd.DataFrame({
+        'date': np.tile(dates, len(bands)),
+        'band': np.repeat(bands, n_days),
+        'value': values.T.ravel()})
+    # Other columns (such as value_raw) are only kept on the original observation dates
+    for col in df.columns:
+        if col not in df_interp:
+            df_interp[col] = pd.Series(df[col].to_numpy(), index = position).reindex(np.arange(len(df_interp))).to_numpy()
+    return df_interp[list(df.columns)]
+
 
 def combine_bands(df, bands_to_combine, band_name_final):
     """
@@ -55,59 +100,209 @@ def combine_bands(df, bands_to_combine, band_name_final):
 
 
 
+def select(df_long, asset_name, band):
+    """Get the rows of one asset and band from a long-form dataframe or a SiteData (without converting the whole SiteData to long form).
+
+        Args:
+            df_long (:obj:`df` or :obj:`SiteData`): long-form dataframe with columns date, asset_name, value and band, or SiteData.
+            asset_name (str): asset name
+            band (str): band name
+
+        Returns:
+            :obj:`df`: long-form dataframe with columns date, asset_name, value and band.
+    """
+    if isinstance(df_long, SiteData):
+        return df_long.select(asset_name, band)
+    df = df_long[df_long['asset_name'] == asset_name]
+    return df[df['band'] == band]
+
+
+def to_days(dates):
+    """Day number of each date (days since 1970-01-01). Series placed on this aligned daily axis are combined by array position instead of merged on dates.
+
+        Args:
+            dates (array): dates as datetime64, Timestamps or 'YYYY-MM-DD' strings
+
+        Returns:
+            array: int64 day numbers
+    """
+    return np.asarray(dates, dtype = 'datetime64[D]').astype(np.int64)
+
+
+def from_days(days):
+    """Dates (datetime64[ns]) of day numbers from to_days()."""
+    return np.asarray(days, dtype = np.int64).astype('datetime64[D]').astype('datetime64[ns]')
+
+
+def day_positions(days, target_days):
+    """Row of each of target_days in days, or -1 if days does not have it. This is the row index of a left join on dates, found by array indexing on the daily axis.
+
+        Args:
+            days (array): day numbers (from to_days()) of the series to take values from. If a day is repeated, its first row is used.
+            target_days (array): day numbers to get the rows for.
+
+        Returns:
+            array: int rows, -1 where missing. Use take() to get values with NaN where missing.
+    """
+    days = np.asarray(days, dtype = np.int64)
+    target_days = np.asarray(target_days, dtype = np.int64)
+    if len(days) == 0 or len(target_days) == 0:
+        return np.full(len(target_days), -1, dtype = np.intp)
+    start = min(days.min(), target_days.min())
+    lookup = np.full(max(days.max(), target_days.max()) - start + 1, -1, dtype = np.intp)
+    # Assign in reverse so the first row of a repeated day is kept
+    lookup[days[::-1] - start] = np.arange(len(days))[::-1]
+    return lookup[target_days - start]
+
+
+def take(values, rows):
+    """Values at rows (from day_positions()), with missing values (NaN) where rows is -1."""
+    return pd.api.extensions.take(values, rows, allow_fill = True)
+
+
+def month_of(days):
+    """Month (1 to 12) of dates or day numbers from to_days()."""
+    return np.asarray(days, dtype = 'datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12 + 1
+
+
+def day_of_year(dates):
+    """Day of the year (1 to 366) of dates or day numbers from to_days()."""
+    days = np.asarray(dates, dtype = 'datetime64[D]')
+    return (days - days.astype('datetime64[Y]')).astype(np.int64) + 1
+
+
+def wateryear_of(days, start_month = 10):
+    """Wateryear of dates or day numbers from to_days(). A wateryear is named after the year it ends.
+
+        Args:
+            days (array): dates or day numbers
+            start_month (int, optional): (default 10) first month of the wateryear, such as 10 (October to September) or 4 for Southern Hemisphere sites (April to March). 1 gives calendar years.
+
+        Returns:
+            array: int wateryears
+    """
+    days = np.asarray(days, dtype = 'datetime64[D]')
+    year = days.astype('datetime64[Y]').astype(np.int64) + 1970
+    if start_month == 1:
+        return year
+    return year + (month_of(days) >= start_month)
+
+
+def wateryear_start(wateryear, start_month = 10):
+    """First day (Timestamp) of a wateryear, see wateryear_of()."""
+    if start_month == 1:
+        return pd.Timestamp(int(wateryear), 1, 1)
+    return pd.Timestamp(int(wateryear) - 1, start_month, 1)
+
+
+def column_name(asset_name, band, column_names = '{asset_name}_{band}'):
+    """Name of the wide-form column of an asset and band.
+
+        Args:
+            asset_name (str): asset name
+            band (str): band name
+            column_names (str or function, optional): (default '{asset_name}_{band}') format string with {asset_name} and {band}, or a function of (asset_name, band) that returns the name.
+
+        Returns:
+            str
+    """
+    if callable(column_names):
+        return column_names(asset_name, band)
+    return column_names.format(asset_name = asset_name, band = band)
+
+
 def make_wide_df(df_long, **kwargs):
     """
-    Uses ET and P asset and band names (designated in **kwargs) to return a wide-form dataframe with columns:
-    date, ET, Ei, P, and P-Ei (where Ei is the interception band from PML and is only extracted if it exists). merge_wide_streamflow() can then be used to merge with streamflow df. 
+    Pivot the daily data to a wide-form dataframe with one column per asset and band, in one pass.
+    The ET and P bands (designated in **kwargs) are named ET and P, the interception band of the ET asset (if it exists) is named Ei,
+    and every other band is named with column_names (such as prism_tmin or modis_snow_snow). Derived columns (by default P_min_Ei = P - Ei)
+    are then added if the columns they use exist. Rows are the days from the first to the last day that have both ET and P. merge() can then be used to merge with streamflow df.
     
     Args:
-        df_long: dataframe such as that produced by extract_assets_at_site() where columns contain asset_name, band, and value.
+        df_long: dataframe such as that produced by extract_assets_at_site() where columns contain asset_name, band, and value, or SiteData.
         **et_asset (str, optional): asset to be used for creation of ET column (default 'pml').
         **et_band (str, optional): band name to be used for creation of ET column (default 'ET').
+        **ei_band (str, optional): band name of the ET asset to be used for creation of Ei column (default 'Ei').
         **ppt_asset (str, optional): asset name for precipitation column (default 'prism').
         **ppt_band (str, optional): band name for precipitation colum (default 'ppt')
+        **pivot_all (bool, optional): (default True) add a column for every other asset and band. If False, only ET, P, Ei and the derived columns are made.
+        **column_names (str or function, optional): (default '{asset_name}_{band}') names of the other columns, see column_name().
+        **derived_columns (dict, optional): (default {'P_min_Ei': 'P - Ei'}) columns to add, as {name: expression}, where expression is a string for DataFrame.eval() or a function of the wide dataframe. Skipped if a column it uses does not exist.
+        **wateryear_start_month (int, optional): (default 10) first month of the wateryear, see wateryear_of().
+        **latitude (float, optional): (default None) latitude of the site [decimal degrees]. If given and the tmin and tmax bands of ppt_asset exist, a PET column is added (see hargreaves_pet()).
+        **tmin_band (str, optional): (default 'tmin') band of ppt_asset with the daily minimum temperature for PET.
+        **tmax_band (str, optional): (default 'tmax') band of ppt_asset with the daily maximum temperature for PET.
         
     Returns:
-        :obj:`df`: wide-form dataframe with columns for date, ET, Ei, P, and P-Ei (where Ei is the interception band from PML and is only included if it exists.)
+        :obj:`df`: wide-form dataframe with columns for date, ET, P, the derived columns (such as P_min_Ei), Ei, PET, the other bands if pivot_all = True, and wateryear.
     """
 
     default_kwargs = {
         'et_asset': 'pml',
         'et_band': 'ET',
+        'ei_band': 'Ei',
         'ppt_asset': 'prism',
         'ppt_band': 'ppt',
+        'pivot_all': True,
+        'column_names': '{asset_name}_{band}',
+        'derived_columns': {'P_min_Ei': 'P - Ei'},
+        'wateryear_start_month': 10,
+        'latitude': None,
+        'tmin_band': 'tmin',
+        'tmax_band': 'tmax',
     }
     kwargs = {**default_kwargs, **kwargs} 
-        
-    # Isolate ET dataset
-    et_df = df_long[df_long['asset_name'] == kwargs['et_asset']]
-    et_df = et_df[et_df['band'] == kwargs['et_band']]
-    et_df['ET'] = et_df['value']
-    
-    # Isolate P dataset
-    ppt_df = df_long[df_long['asset_name'] == kwargs['ppt_asset']]
-    ppt_df = ppt_df[ppt_df['band'] == kwargs['ppt_band']]
-    ppt_df['P'] = ppt_df['value']
-    
-    # Merge P + Ei (interception) if Ei band exists
-    if 'Ei' in et_df.band.unique():
-        ei_df = et_df[et_df['band'] == 'Ei']
-        ei_df['Ei'] = ei_df['value']
-        ppt_df = ppt_df.merge(ei_df[['date','Ei']], how = 'left', on = 'date')
-        ppt_df['P_min_Ei'] = ppt_df['P'] - ppt_df['Ei']
-    
-        # Merge ET and P
-        df_wide = et_df.merge(ppt_df, how = 'inner', on = 'date')[['date', 'ET', 'P', 'P_min_Ei', 'Ei']]
-    
-    else:
-        # Merge ET and P
-        df_wide = et_df.merge(ppt_df, how = 'inner', on = 'date')[['date', 'ET', 'P']]
-        
+
+    # Pivot once: one float column per asset and band
+    data = SiteData.from_long(df_long)
+
+    # Name the columns: ET, P and Ei first, then the other bands
+    names = {(kwargs['et_asset'], kwargs['et_band']): 'ET',
+             (kwargs['ppt_asset'], kwargs['ppt_band']): 'P',
+             (kwargs['et_asset'], kwargs['ei_band']): 'Ei'}
+    if kwargs['pivot_all']:
+        for asset_name, band in data.values.columns:
+            if (asset_name, band) not in names:
+                names[(asset_name, band)] = column_name(asset_name, band, kwargs['column_names'])
+    columns = [column for column in names if column in data]
+
+    # Keep the days with both ET and P
+    index = data.values.index
+    rows = np.zeros(len(index), dtype = bool)
+    if all(column in data for column in list(names)[:2]):
+        et = data.get(*list(names)[0])
+        ppt = data.get(*list(names)[1])
+        if len(et) > 0 and len(ppt) > 0:
+            rows = (index >= max(et.index[0], ppt.index[0])) & (index <= min(et.index[-1], ppt.index[-1]))
+    df_wide = pd.DataFrame(data.values.to_numpy()[rows][:, [data.values.columns.get_loc(column) for column in columns]],
+                           columns = [names[column] for column in columns])
+    for name in ['ET', 'P']:
+        if name not in df_wide:
+            df_wide[name] = np.nan
+    df_wide.insert(0, 'date', index[rows].astype('datetime64[ns]'))
+
+    # Add derived columns (such as P - Ei) after P
+    position = 3
+    for name, expression in kwargs['derived_columns'].items():
+        try:
+            values = df_wide.eval(expression) if isinstance(expression, str) else expression(df_wide)
+        except (KeyError, NameError):
+            continue
+        if name in df_wide:
+            df_wide[name] = values
+        else:
+            df_wide.insert(position, name, values)
+            position += 1
+
+    # Add PET after Ei
+    temperatures = [(kwargs['ppt_asset'], kwargs['tmin_band']), (kwargs['ppt_asset'], kwargs['tmax_band'])]
+    if kwargs['latitude'] is not None and all(column in data for column in temperatures):
+        tmin, tmax = data.values[temperatures].to_numpy()[rows].T
+        position = df_wide.columns.get_loc('Ei') + 1 if 'Ei' in df_wide else position
+        df_wide.insert(position, 'PET', hargreaves_pet(tmin, tmax, day_of_year(df_wide['date']), kwargs['latitude']))
+
     # Add wateryear column
-    df_wide = df_wide.set_index(pd.to_datetime(df_wide['date']))
-    df_wide['wateryear'] = np.where(~df_wide.index.month.isin([10,11,12]),df_wide.index.year,df_wide.index.year+1)
-    df_wide = df_wide.reset_index(drop=True)
-    
+    df_wide['wateryear'] = wateryear_of(df_wide['date'], kwargs['wateryear_start_month'])
     return df_wide
 
 
@@ -123,10 +318,6 @@ def merge(df_wide, df_merge, merge_with, column_names = None):
     Returns:
         :obj:`df`: merged dataframes.
     """
-    # Make sure they are both datetime format
-    df_wide['date'] = pd.to_datetime(df_wide['date'])
-    df_merge['date'] = pd.to_datetime(df_merge['date'])
-
     if column_names is None: 
         if merge_with == 'streamflow':
             column_names = ['date','Q_mm']
@@ -136,52 +327,162 @@ def merge(df_wide, df_merge, merge_with, column_names = None):
             print('merge() works for deficit or streamflow dataframes only.')
     elif 'date' in column_names: pass
     else: column_names = column_names + ['date']
-    df_wide = df_wide.merge(df_merge[column_names], how = 'left', on = 'date')
+
+    # Left join by position on the daily axis: days of df_wide that df_merge does not have get NaN
+    rows = day_positions(to_days(df_merge['date']), to_days(df_wide['date']))
+    df_wide = df_wide.copy()
+    for col in column_names:
+        if col != 'date':
+            df_wide[col] = take(df_merge[col].array, rows)
     return df_wide
 
 
-def wateryear(df_wide):
+def wateryear(df_wide, **kwargs):
     """Create total and cumulative wateryear dataframes for all variables (ie columns) given in df_wide.
+    All sums, cumulative sums, maxima and seasonal sums are computed together in one pass over the columns, grouped by wateryear.
+    Missing values (NaN) are skipped, as in pandas groupby.
     
     Args:
         df_wide (:obj:`df`): wide-form dataframe with 'date' column and other columns with variable names (i.e. ET, P, Q_mm, etc.) This dataframe can also have D, D_wy, Q_mm, etc merged into it.
+        **cumulative_columns (list of str, optional): (default ['ET', 'P', 'Ei', 'P_min_Ei', 'PET', 'Q_mm']) columns to total for each wateryear and to add as ORIGINALNAME_cumulative.
+        **max_columns (list of str, optional): (default ['D_wy']) columns to get the wateryear maximum of, as ORIGINALNAME_max.
+        **seasons (dict, optional): (default {'summer': [6, 7, 8, 9]}) seasons as {name: list of months}. The seasonal_columns are totalled over the days of each season in each wateryear, as ORIGINALNAME_SEASONNAME (such as ET_summer).
+        **seasonal_columns (list of str, optional): (default ['ET']) columns to get seasonal totals of.
+        **wateryear_start_month (int, optional): (default 10) first month of the wateryear. Only used if df_wide has no wateryear column.
     
     Returns:
-        :obj:`df`, :obj:`df`: 2 datafrmes: (1) the  original wide-form dataframe with added columns (in the naming form of ORIGINALNAME_cumulative) with cumulative wateryear values. For example, if 'P' was in original dataframe, then 'P_cumulative' now exists. If 'Q_mm' was in dataframe, then 'Q_mm_cumulative' now exists. (2) dataframe with one row for each wateryear with columns such as wateryear, ET, P, D_wy_max, ET_summer, Q_mm, etc, which represent the total (or maximum, for D_wy_max) wateryear sum.
+        :obj:`df`, :obj:`df`: 2 datafrmes: (1) the  original wide-form dataframe with added columns (in the naming form of ORIGINALNAME_cumulative) with cumulative wateryear values. For example, if 'P' was in original dataframe, then 'P_cumulative' now exists. If 'Q_mm' was in dataframe, then 'Q_mm_cumulative' now exists. dV (P - ET - Q_mm cumulative) is added if P, ET and Q_mm exist. (2) dataframe with one row for each wateryear with columns such as wateryear, ET, P, D_wy_max, ET_summer, Q_mm, etc, which represent the total (or maximum, for D_wy_max) wateryear sum.
     """
-     # Create wateryear total dataframe and fill in wateryear and Dwy_max if exists
-    df_total = pd.DataFrame()
-    df_total['wateryear'] = df_wide.groupby(['wateryear'])['wateryear'].first()
-    if 'D_wy' in df_wide:
-        df_total['D_wy_max'] = df_wide.groupby(['wateryear'])['D_wy'].max()
-        
-    # Add summer ET to total wateryear df
-    df_summer = df_wide.copy()
-    df_summer = df_summer.set_index(df_summer['date'])
-    df_summer['season'] = np.where(~df_summer.index.month.isin([6,7,8,9]),'summer','other')
-    df_summer = df_summer[df_summer['season'] == 'summer']
-    df_total['ET_summer'] = df_summer.groupby(['wateryear'])['ET'].sum()
-
-    # Add wateryear cumulative to df_wide
-    cols = ['ET', 'P', 'Ei', 'P_min_Ei', 'Q_mm']
-    for col in cols:
-        if col in df_wide:
-            df_wide[col + '_cumulative'] = df_wide.groupby(['wateryear'])[col].cumsum()
-            df_total[col] = df_wide.groupby(['wateryear'])[col].sum()
-
-    # Calculate dV if all data is present
-    if 'P' and 'ET' and 'Q_mm' in df_wide:
+    default_kwargs = {
+        'cumulative_columns': ['ET', 'P', 'Ei', 'P_min_Ei', 'PET', 'Q_mm'],
+        'max_columns': ['D_wy'],
+        'seasons': {'summer': [6, 7, 8, 9]},
+        'seasonal_columns': ['ET'],
+        'wateryear_start_month': 10,
+    }
+    kwargs = {**default_kwargs, **kwargs}
+    df_wide = df_wide.copy()
+    if 'wateryear' not in df_wide:
+        df_wide['wateryear'] = wateryear_of(df_wide['date'], kwargs['wateryear_start_month'])
+
+    # Order the days by wateryear (stable, so days stay in date order) and find where each wateryear starts
+    wateryears, codes = np.unique(df_wide['wateryear'].to_numpy(), return_inverse = True)
+    order = np.argsort(codes, kind = 'stable')
+    starts = segment_starts(codes[order])
+    cumulative_columns = [col for col in kwargs['cumulative_columns'] if col in df_wide]
+    max_columns = [col for col in kwargs['max_columns'] if col in df_wide]
+    seasonal_columns = [col for col in kwargs['seasonal_columns'] if col in df_wide]
+    values = df_wide[list(dict.fromkeys(cumulative_columns + max_columns + seasonal_columns))].to_numpy(dtype = float)[order]
+    position = {col: i for i, col in enumerate(dict.fromkeys(cumulative_columns + max_columns + seasonal_columns))}
+    filled = np.nan_to_num(values)
+
+    df_total = {'wateryear': wateryears}
+    cumulative = {}
+    if len(wateryears) > 0:
+        # Maxima of each wateryear (NaN only if the whole wateryear is NaN)
+        for col in max_columns:
+            df_total[col + '_max'] = np.fmax.reduceat(values[:, position[col]], starts)
+
+        # Seasonal totals
+        months = month_of(df_wide['date'].to_numpy()[order])
+        for season, season_months in kwargs['seasons'].items():
+            in_season = np.isin(months, season_months)
+            for col in seasonal_columns:
+                df_total[col + '_' + season] = np.add.reduceat(np.where(in_season, filled[:, position[col]], 0), starts)
+
+        # Totals and cumulative sums within each wateryear: the running sum minus the running sum before the wateryear started
+        columns = [position[col] for col in cumulative_columns]
+        running = np.cumsum(filled[:, columns], axis = 0)
+        before = np.vstack([np.zeros((1, len(columns))), running[starts[1:] - 1]])
+        lengths = np.diff(np.r_[starts, len(order)])
+        within = running - np.repeat(before, lengths, axis = 0)
+        within[np.isnan(values[:, columns])] = np.nan
+        totals = running[np.r_[starts[1:], len(order)] - 1] - before
+        unordered = np.empty_like(within)
+        unordered[order] = within
+        for i, col in enumerate(cumulative_columns):
+            cumulative[col + '_cumulative'] = unordered[:, i]
+            df_total[col] = totals[:, i]
+    else:
+        for col in max_columns:
+            df_total[col + '_max'] = []
+        for season in kwargs['seasons']:
+            for col in seasonal_columns:
+                df_total[col + '_' + season] = []
+        for col in cumulative_columns:
+            cumulative[col + '_cumulative'] = []
+            df_total[col] = []
+    df_total = pd.DataFrame(df_total, index = pd.Index(wateryears, name = 'wateryear'))
+
+    # Add wateryear cumulative to df_wide, and dV if all data is present
+    df_wide = pd.concat([df_wide, pd.DataFrame(cumulative, index = df_wide.index)], axis = 1)
+    if all(col in df_wide for col in ['P_cumulative', 'ET_cumulative', 'Q_mm_cumulative']):
         df_wide['dV'] = df_wide['P_cumulative'] - df_wide['ET_cumulative'] - df_wide['Q_mm_cumulative'] 
         
     return df_wide, df_total
     
 
+def segment_starts(labels):
+    """Get the index of the first element of each run of equal values (for example, each wateryear).
+    
+    Args:
+        labels (array): 1-D array of labels (such as the 'wateryear' column), in date order.
+    
+    Returns:
+        array: integer positions where a new run of labels begins. The first position is always 0.
+    """
+    labels = np.asarray(labels)
+    if labels.size == 0:
+        return np.zeros(0, dtype=np.intp)
+    return np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+
+
+def clipped_cumsum(A, starts = None, carry = None):
+    """
+    Vectorized deficit kernel: D(t) = max(D(t-1) + A(t), 0), computed without a python loop over days.
+    Within each segment the running sum S(t) is clipped at zero using S(t) - min(S(0..t)), which is the closed form of the recursion.
+    Each segment starts from D = 0 on its first day (as in the original deficit loop), unless carry is given for the first segment.
+    Results match the row-by-row loop up to floating point round-off.
+
+    Args:
+        A (array): 1-D array (days) or 2-D array (sites x days) of ET - P.
+        starts (array, optional): positions where D is reset to 0, such as from segment_starts(wateryear). Default None (only reset on the first day).
+        carry (float or array, optional): deficit on the day before the first day (one value per site). If given, the first segment continues from carry instead of being reset to 0. Default None.
+
+    Returns:
+        array: deficit with the same shape as A.
+    """
+    A = np.asarray(A, dtype=float)
+    squeeze = A.ndim == 1
+    A = np.atleast_2d(A)
+    out = np.empty_like(A)
+    if starts is None:
+        starts = [0]
+    bounds = list(starts) + [A.shape[1]]
+    if bounds[0] != 0:
+        bounds = [0] + bounds
+    for k, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if end <= start:
+            continue
+        seg = A[:, start:end].copy()
+        if k == 0 and carry is not None:
+            seg[:, 0] += np.broadcast_to(np.asarray(carry, dtype=float), (A.shape[0],))
+            np.cumsum(seg, axis=1, out=seg)
+            floor = np.minimum(np.minimum.accumulate(seg, axis=1), 0)
+        else:
+            seg[:, 0] = 0
+            np.cumsum(seg, axis=1, out=seg)
+            floor = np.minimum.accumulate(seg, axis=1)
+        out[:, start:end] = seg - floor
+    return out[0] if squeeze else out
+
+
 def deficit(df_long, df_wide = None, **kwargs):
     """
     Calculate D(t) after McCormick et al., 2021 and Dralle et al., 2020.
 
     Args:
-        df_long (:obj:`df`): original long-style dataframe with snow, P, and ET data at a minimum
+        df_long (:obj:`df`): original long-style dataframe (or SiteData) with snow, P, and ET data at a minimum
         df_wide (:obj:`df`): dataframe created from make_wide_df(). (default = None, in which case new df_wide is created from df_long using default args). This dataframe must have ET, P, and wateryear columns.
         **interp: (bool, optional): default: True. Currently no option to change to False.
         **combine_ET_bands (bool, optional): (default True) add ET bands to make one ET band.
@@ -195,6 +496,7 @@ def deficit(df_long, df_wide = None, **kwargs):
         **snow_correction (bool, optional): (default True) use snow correction factor when calculating deficit
         **snow_correction (bool, optional): (default True) use snow correction factor when calculating deficit
         **snow_frac (int, optional): (default 10) set all ET when snow is greater than this (%) to 0 if snow_correction = True
+        **carry (tuple, optional): (default None) (D, D_wy, wateryear) on the day before the first day of df_wide, to continue an existing deficit timeseries instead of starting from 0. D_wy is only continued if the first day is in the same wateryear.
 
     Returns:
         :obj:`df`: dataframe with root-zone water storage deficit data where deficit is column 'D' and wateryear deficit is 'D_wy'.
@@ -209,12 +511,13 @@ def deficit(df_long, df_wide = None, **kwargs):
             'snow_band':'snow',
             'snow_correction': True,
             'snow_frac': 10,
+            'carry': None,
         }
     kwargs = {**default_kwargs, **kwargs} 
     
     # Make deficit dataframe if none given (just normal wide dataframe but only keep relevant data)
     if df_wide is None:
-        df_deficit = make_wide_df(df_long, pivot_all = False, **kwargs)
+        df_deficit = make_wide_df(df_long, **{**kwargs, 'pivot_all': False})
     else: df_deficit = df_wide.copy()
     
     # Check to make sure everything we need is here
@@ -223,143 +526,324 @@ def deficit(df_long, df_wide = None, **kwargs):
         if col not in df_deficit:
             raise err.MissingBandsError(col + ' missing. Deficit cannot be calculated. Check assets specified in layers.')
     
-    df_deficit = df_deficit[necessary_columns]
+    df_deficit = df_deficit[necessary_columns].copy()
 
     # If using snow_correction, add snow to df_wide
     if kwargs['snow_correction'] == True:
         try:  
-            snow_df = df_long[df_long['asset_name'] == kwargs['snow_asset']]
-            snow_df = snow_df[snow_df['band'] == kwargs['snow_band']]
-            snow_df['Snow'] = snow_df['value']
-            # Merge snow together and filter ET by snow fraction
-            df_deficit = df_deficit.merge(snow_df, how = 'inner', on = 'date')
+            snow_df = select(df_long, kwargs['snow_asset'], kwargs['snow_band'])
+            if len(snow_df) == 0:
+                raise ValueError('no snow data')
+            # Place snow on the days of df_deficit and filter ET by snow fraction. Days without snow data are not corrected.
+            rows = day_positions(to_days(snow_df['date']), to_days(df_deficit['date']))
+            df_deficit['Snow'] = take(snow_df['value'].to_numpy(dtype = float), rows)
             df_deficit.loc[df_deficit['Snow'] > kwargs['snow_frac'], 'ET'] = 0
         except:
             raise err.MissingBandsError("Snow correction can't be applied. Either no snow data presented or snow_band or asset wrong. Given snow_band: {}, snow_asset: {}".format(kwargs['snow_band'], kwargs['snow_asset']))
    
-    # Calculate A and D
+    # Calculate A, D and wateryear deficit (D(t)_wy), which resets at the start of each wateryear
     df_deficit['A'] = df_deficit['ET'] - df_deficit['P']
-    df_deficit['D'] = 0
-    for _i in range(df_deficit.shape[0]-1):
-        df_deficit.loc[_i+1, 'D'] = max((df_deficit.loc[_i+1, 'A'] + df_deficit.loc[_i, 'D']), 0)
-    
-    # Calculate wateryear deficit (D(t)_wy)) and merge columns with df_deficit
-    df_deficit_wy = pd.DataFrame()
-    for wy in df_deficit.wateryear.unique():
-        temp = df_deficit[df_deficit['wateryear'] == wy][['date','ET','P']]
-        temp['A'] = temp['ET'] - temp['P']
-        temp['D_wy'] = 0
-        temp = temp.reset_index()
-        for _i in range(temp.shape[0]-1):
-            temp.loc[_i+1, 'D_wy'] = max((temp.loc[_i+1, 'A'] + temp.loc[_i, 'D_wy']), 0)
-        df_deficit_wy = pd.concat([df_deficit_wy, temp])
-    df_deficit_wy = df_deficit_wy[['date','D_wy']]
-    df_deficit = df_deficit.merge(df_deficit_wy, how = 'left', on = 'date')
-    #self.deficit_timeseries = df_deficit
-    #self.smax = round(df_deficit.D.max())
-    #self.maxdmax = round(df_deficit.D_wy.max())
+    A = df_deficit['A'].to_numpy(dtype=float)
+    wateryears = df_deficit['wateryear'].to_numpy()
+    if kwargs['carry'] is None:
+        carry_D, carry_D_wy = None, None
+    else:
+        carry_D, carry_D_wy, carry_wateryear = kwargs['carry']
+        if len(wateryears) == 0 or wateryears[0] != carry_wateryear:
+            carry_D_wy = None
+    df_deficit['D'] = clipped_cumsum(A, carry = carry_D)
+    df_deficit['D_wy'] = clipped_cumsum(A, segment_starts(wateryears), carry = carry_D_wy)
     return df_deficit
 
 
-def deficit_bursts(df):
+def deficit_many(P, ET, wateryear, snow = None, snow_correction = True, snow_frac = 10, chunk_size = 256, max_workers = None, return_timeseries = True):
+    """
+    Calculate D(t), D_wy(t), Smax and max(Dmax) for many sites at once from aligned sites x days arrays.
+    Sites are processed in chunks of chunk_size rows on a thread pool, so temporary memory is bounded by the chunk size
+    (set return_timeseries = False to also skip allocating the full D and D_wy arrays).
+
+    Args:
+        P (array): 2-D array (sites x days) of daily precipitation [mm].
+        ET (array): 2-D array (sites x days) of daily evapotranspiration [mm], same shape as P.
+        wateryear (array): 1-D array (days) with the wateryear of each day. Deficit D_wy is reset at the first day of each wateryear.
+        snow (array, optional): 2-D array (sites x days) of snow cover [%]. Required if snow_correction = True.
+        snow_correction (bool, optional): (default True) set ET to 0 on days when snow is greater than snow_frac.
+        snow_frac (int, optional): (default 10) snow cover (%) above which ET is set to 0 if snow_correction = True.
+        chunk_size (int, optional): (default 256) number of sites computed together in each task.
+        max_workers (int, optional): (default None, which uses all cores) number of threads.
+        return_timeseries (bool, optional): (default True) return the full D and D_wy arrays. If False, only Smax and max(Dmax) are kept and D, D_wy are returned as None.
+
+    Returns:
+        array, array, array, array: D and D_wy (sites x days, or None), Smax (sites) and max(Dmax) (sites), both in mm and not rounded.
+    """
+    P = np.atleast_2d(np.asarray(P, dtype=float))
+    ET = np.atleast_2d(np.asarray(ET, dtype=float))
+    wateryear = np.asarray(wateryear)
+    if P.shape != ET.shape or P.shape[1] != wateryear.shape[0]:
+        raise ValueError(f'P {P.shape} and ET {ET.shape} must be the same shape (sites x days) and match wateryear ({wateryear.shape[0]} days).')
+    if snow_correction:
+        if snow is None:
+            raise err.MissingBandsError("Snow correction can't be applied because no snow array was given. Set snow_correction = False to skip it.")
+        snow = np.atleast_2d(np.asarray(snow, dtype=float))
+        if snow.shape != P.shape:
+            raise ValueError(f'snow {snow.shape} must be the same shape as P and ET {P.shape}.')
+
+    n_sites = P.shape[0]
+    starts = segment_starts(wateryear)
+    smax = np.empty(n_sites)
+    maxdmax = np.empty(n_sites)
+    if return_timeseries:
+        D = np.empty_like(P)
+        D_wy = np.empty_like(P)
+    else:
+        D = D_wy = None
+
+    def run_chunk(rows):
+        et = ET[rows]
+        if snow_correction:
+            et = np.where(snow[rows] > snow_frac, 0, et)
+        A = et - P[rows]
+        D_chunk = clipped_cumsum(A)
+        D_wy_chunk = clipped_cumsum(A, starts)
+        smax[rows] = np.fmax.reduce(D_chunk, axis=1)
+        maxdmax[rows] = np.fmax.reduce(D_wy_chunk, axis=1)
+        if return_timeseries:
+            D[rows] = D_chunk
+            D_wy[rows] = D_wy_chunk
+
+    chunks = [slice(i, min(i + chunk_size, n_sites)) for i in range(0, n_sites, chunk_size)]
+    with ThreadPoolExecutor(max_workers = max_workers or os.cpu_count()) as executor:
+        # list() so that any exception raised in a chunk is re-raised here
+        list(executor.map(run_chunk, chunks))
+    return D, D_wy, smax, maxdmax
+
+
+def _bursts(values, groups = None, min_duration = 1):
+    """
+    Find the runs of positive values in one pass. A run ends at a day that is not positive (including NaN) and at a change of group (site).
+
+    Returns:
+        dict of arrays with one entry per run: start, end and max_row (row numbers), duration, max and ongoing.
     """
-    Still under development!! Get a dataframe with the length and maximum deficit of each "burst" (i.e. deficits that are continuously above zero).
+    positive = np.nan_to_num(values) > 0
+    rows = np.flatnonzero(positive)
+    # A run starts at a positive day that does not follow a positive day of the same group
+    new_run = np.ones(len(rows), dtype = bool)
+    new_run[1:] = np.diff(rows) != 1
+    if groups is not None:
+        new_run[1:] |= groups[rows[1:]] != groups[rows[:-1]]
+    first = np.flatnonzero(new_run)
+    last = np.r_[first[1:], len(rows)] - 1
+    run_id = np.cumsum(new_run) - 1
+
+    run_values = values[rows]
+    maxima = np.maximum.reduceat(run_values, first) if len(rows) else np.zeros(0)
+    # Day of the (first) maximum of each run
+    hits = np.flatnonzero(run_values == maxima[run_id])
+    max_rows = rows[hits[np.unique(run_id[hits], return_index = True)[1]]]
+
+    start, end = rows[first], rows[last]
+    duration = end - start + 1
+    # Runs still in deficit on the last day of their group's data have not ended yet
+    ongoing = end == len(values) - 1
+    if groups is not None:
+        ongoing |= groups[np.minimum(end + 1, len(values) - 1)] != groups[end]
+    keep = duration >= min_duration
+    return {'start': start[keep], 'end': end[keep], 'max_row': max_rows[keep], 'duration': duration[keep],
+            'max': maxima[keep], 'ongoing': ongoing[keep]}
+
+
+def _burst_frame(runs, dates, start_month):
+    """Dataframe of the runs of _bursts(), with dates[i] the date of row i."""
+    start = dates[runs['start']]
+    end = dates[runs['end']]
+    return pd.DataFrame({
+        'start': start,
+        'end': end,
+        'duration': runs['duration'],
+        'max_D': runs['max'],
+        'max_date': dates[runs['max_row']],
+        'start_wateryear': wateryear_of(start, start_month),
+        'end_wateryear': wateryear_of(end, start_month),
+        'ongoing': runs['ongoing']})
+
+
+def deficit_bursts(df, **kwargs):
+    """
+    Get a dataframe with the length and maximum deficit of each "burst" (i.e. deficits that are continuously above zero).
+    A burst is a run of days with D > 0: it starts on its first day with a deficit and ends on its last day before D returns to 0.
+    All bursts (of all sites, if by is given) are found in one pass over the data.
 
     Args:
-        df (:obj:`df`): dataframe with columns for date and D (for deficit), at minimum.
+        df (:obj:`df`): dataframe with columns for date and D (for deficit), at minimum, in date order (per site), such as deficit_timeseries.
+        **column (str, optional): (default 'D') deficit column, such as 'D' or 'D_wy'.
+        **by (str, optional): (default None) column with the site of each row, for a dataframe of many sites. Bursts never cross from one site to the next.
+        **min_duration (int, optional): (default 1) minimum number of days of a burst.
+        **wateryear_start_month (int, optional): (default 10) first month of the wateryear, see wateryear_of().
 
     Returns: 
-        :obj:`df`: dataframe with columns for start and end dates, and max_D [mm], duration [days] and start and end wateryear of each burst.
-    """
-    # get all places where deficit = 0
-    df_zero = df[df.D == 0]
-
-    # get the start and end dates of the bursts and add in an artificial 'burst' starting on the first date of the year and ending at the start of the next burst
-    start_of_bursts = []
-    end_of_bursts = []
-    max_D = []
-
-    # For all the dates where the deficit = 0, find the time between the dates and the maximum value between the dates
-    for j in range(len(df_zero['date'])-1):
-        if (df_zero['date'][j+1] > df_zero['date'][j]):
-            mask2 = (pd.to_datetime(df['date']) >= df_zero['date'][j]) & (pd.to_datetime(df['date']) <= df_zero['date'][j+1])
-            bursts = pd.DataFrame()
-            bursts = df.loc[mask2]
-            if (len(bursts['D'])>2):
-                start_of_bursts.append(bursts['date'][0])
-                end_of_bursts.append(bursts['date'][-1])
-                max_D.append(bursts['D'].max())
-            else: continue
-        else: continue
-        
-    # Save in df
-    burstdf = pd.DataFrame()
-    burstdf['start'] = start_of_bursts
-    burstdf['end'] = end_of_bursts
-    burstdf['max_D'] = max_D
-  
-    # Clean up and add more columns
-    burstdf['start'] = pd.to_datetime(burstdf['start'])
-    burstdf['end'] = pd.to_datetime(burstdf['end'])
-    burstdf['duration'] = (burstdf['end'] - burstdf['start']).dt.days.astype('int16')
-    burstdf = burstdf.set_index(burstdf['start'])
-    burstdf['start_wateryear'] = np.where(~burstdf.index.month.isin([10,11,12]),burstdf.index.year,burstdf.index.year+1)
-    burstdf = burstdf.reset_index(drop=True)
-    burstdf = burstdf.set_index(burstdf['end'])
-    burstdf['end_wateryear'] = np.where(~burstdf.index.month.isin([10,11,12]),burstdf.index.year,burstdf.index.year+1)
-    burstdf = burstdf.reset_index(drop=True)
+        :obj:`df`: dataframe with one row per burst and columns (by,) start, end, duration [days], max_D (maximum of column) [mm], max_date (first date of max_D), start_wateryear, end_wateryear and ongoing (True if the burst lasts until the end of the data, so it may not have ended).
+    """
+    default_kwargs = {
+        'column': 'D',
+        'by': None,
+        'min_duration': 1,
+        'wateryear_start_month': 10,
+    }
+    kwargs = {**default_kwargs, **kwargs}
+    dates = df['date']
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates)
+    groups = None
+    if kwargs['by'] is not None:
+        groups = pd.factorize(df[kwargs['by']])[0]
+    runs = _bursts(df[kwargs['column']].to_numpy(dtype = float), groups, kwargs['min_duration'])
+    burstdf = _burst_frame(runs, dates.to_numpy(), kwargs['wateryear_start_month'])
+    if kwargs['by'] is not None:
+        burstdf.insert(0, kwargs['by'], df[kwargs['by']].to_numpy()[runs['start']])
+    return burstdf
+
+
+def deficit_bursts_many(D, dates, sites = None, min_duration = 1, wateryear_start_month = 10):
+    """
+    Get the deficit bursts of many sites at once from the sites x days D (or D_wy) array of deficit_many(). See deficit_bursts().
+
+    Args:
+        D (array): 2-D array (sites x days) of deficit [mm].
+        dates (array): 1-D array (days) of dates.
+        sites (list, optional): (default None, which numbers the sites from 0) name of each site (row of D).
+        min_duration (int, optional): (default 1) minimum number of days of a burst.
+        wateryear_start_month (int, optional): (default 10) first month of the wateryear.
 
+    Returns:
+        :obj:`df`: dataframe with one row per burst and columns site, start, end, duration, max_D, max_date, start_wateryear, end_wateryear and ongoing.
+    """
+    D = np.atleast_2d(np.asarray(D, dtype = float))
+    dates = np.asarray(pd.to_datetime(dates))
+    if D.shape[1] != len(dates):
+        raise ValueError(f'D {D.shape} must have one column (sites x days) for each of the {len(dates)} dates.')
+    sites = np.arange(D.shape[0]) if sites is None else np.asarray(sites)
+    # Rows of all sites one after another: row i is site i // days, day i % days
+    n_days = D.shape[1]
+    groups = np.repeat(np.arange(D.shape[0]), n_days)
+    runs = _bursts(D.ravel(), groups, min_duration)
+    burstdf = _burst_frame({**runs, 'start': runs['start'] % n_days, 'end': runs['end'] % n_days, 'max_row': runs['max_row'] % n_days},
+                           dates, wateryear_start_month)
+    burstdf.insert(0, 'site', sites[runs['start'] // n_days])
     return burstdf
 
 
-"""
-def getRA(site_lat_decimal):
-  ## J (julian day)
-  J = (np.linspace(1,365,365))
-  ## Gsc (solar constant)  [MJ m-2 day -1] 
-  Gsc = 0.0820
-  ## inverse relative distance Earth-Sun
-  dr = 1+0.033*np.cos(((2*np.pi)/365)*J) 
-  ## delta = solar declination [rad]
-  delta = 0.409*np.sin(((2*np.pi)/365)*J-1.39)  
-  ## psi [rad] = convert decimal latitude to radians
-  psi = (np.pi/180)*(32.3863) 
-  ## omega_s (ws)= solar time angle at beginning of period [rad]
-  omega_s = np.arccos(-np.tan(psi)*np.tan(delta)) 
-  ## [ws * sin(psi) * sin(delta) + cos(psi) * cos(delta) * sin(ws)]
-  angles = omega_s * np.sin(psi) * np.sin(delta) + np.cos(psi) * np.cos(delta) * np.sin(omega_s)
-  RA = ((24*60)/np.pi) * Gsc * dr * angles
-
-  df = pd.DataFrame()
-  df['RA'] = RA
-  df['J'] = J
-  df['J']= df['J'].astype(int)
-  return df
-
-
-def calculate_PET(daily_data_df, latitude):#gage, p, tmin = 'tmin', tmax = 'tmax', tmean = 'tmean'):
-    if 'tmax' and 'tmin' not in daily_data_df['band'].unique():
-        sys.exit("'PET cannot be calsculated because PRISM temperature was not extracted.'")  
-    else:
-        # Get temperatures from prism
-        prism_df = daily_data_df[daily_data_df['asset_name'] == 'prism']
-        pet_df = pd.DataFrame()
-        pet_df['tmax'] = prism_df[prism_df['band'] == 'tmax']['value'].values
-        pet_df['tmin'] = prism_df[prism_df['band'] == 'tmin']['value'].values
-        pet_df['date'] = pd.to_datetime(prism_df[prism_df['band'] == 'tmin']['date']).values
-
-        # get RA (extraterrestrial radiation) with julian day column
-        RA_df = getRA(latitude)
-        pet_df['J'] = pd.to_datetime(pet_df['date']).dt.strftime('%j')
-        pet_df['J'] = pet_df['J'].astype(int)
-        
-        # merge prism df with RA
-        pet_df = pet_df.merge(RA_df, how='left', on=['J'])
+# Solar constant [MJ m-2 min-1]
+SOLAR_CONSTANT = 0.0820
 
-        # calculate PET (Hargreave and Semani 1985)
-        # Ep = 0.0023 · (Tmean + 17.8)·(Tmax - Tmin)^0.5 · 0.408 · Rext
-        Krs = 0.0023 # Erica changed this from 0.00023 on Oct 15, 2021
-        pet_df['PET'] = Krs * pet_df['RA'] * np.sqrt(pet_df['tmax'] - pet_df['tmin']) * (((pet_df['tmin']+pet_df['tmax'])/2) + 17.8)
-    
-        return pet_df
-"""      
\ No newline at end of file
+# Latitude step [degrees] of the extraterrestrial radiation table
+RA_RESOLUTION = 0.1
+
+
+def _radiation(day_of_year, latitude):
+    """Daily extraterrestrial radiation [MJ m-2 day-1] (FAO-56 eq. 21) for day of year and latitude [degrees] arrays (broadcast together)."""
+    J = np.asarray(day_of_year, dtype = float)
+    psi = np.radians(latitude)
+    # Inverse relative distance Earth-Sun and solar declination [rad]
+    dr = 1 + 0.033 * np.cos(2 * np.pi / 365 * J)
+    delta = 0.409 * np.sin(2 * np.pi / 365 * J - 1.39)
+    # Sunset hour angle [rad]: clipped for polar day (pi, sun never sets) and polar night (0, sun never rises)
+    omega_s = np.arccos(np.clip(-np.tan(psi) * np.tan(delta), -1, 1))
+    angles = omega_s * np.sin(psi) * np.sin(delta) + np.cos(psi) * np.cos(delta) * np.sin(omega_s)
+    return np.maximum(24 * 60 / np.pi * SOLAR_CONSTANT * dr * angles, 0)
+
+
+@lru_cache(maxsize = 4)
+def radiation_table(resolution = RA_RESOLUTION):
+    """
+    Get the extraterrestrial radiation of every day of the year (1 to 366) and latitude from -90 to 90 degrees in steps of resolution. Made once and cached.
+
+    Returns:
+        array, array: latitudes [degrees] and the radiation table (366 days x latitudes) [MJ m-2 day-1]
+    """
+    latitudes = np.linspace(-90, 90, int(round(180 / resolution)) + 1)
+    table = _radiation(np.arange(1, 367)[:, None], latitudes[None, :])
+    table.setflags(write = False)
+    return latitudes, table
+
+
+def extraterrestrial_radiation(day_of_year, latitude, resolution = RA_RESOLUTION):
+    """
+    Get the daily extraterrestrial radiation (RA) by linear interpolation between the latitudes of radiation_table().
+    Arguments are broadcast together, so a (days,) day_of_year with a (sites, 1) latitude gives a (sites x days) array.
+
+    Args:
+        day_of_year (array): day of the year, 1 to 366.
+        latitude (float or array): latitude [decimal degrees].
+        resolution (float, optional): (default 0.1) latitude step of the table [degrees].
+
+    Returns:
+        array: RA [MJ m-2 day-1]
+    """
+    latitudes, table = radiation_table(resolution)
+    position = (np.clip(np.asarray(latitude, dtype = float), -90, 90) + 90) / resolution
+    lower = np.minimum(np.floor(position).astype(int), len(latitudes) - 2)
+    weight = position - lower
+    row = np.asarray(day_of_year, dtype = int) - 1
+    return table[row, lower] * (1 - weight) + table[row, lower + 1] * weight
+
+
+def hargreaves_pet(tmin, tmax, day_of_year, latitude):
+    """
+    Calculate daily potential evapotranspiration (Hargreaves and Samani, 1985):
+    PET = 0.0023 * 0.408 * RA * (Tmean + 17.8) * (Tmax - Tmin)^0.5, where 0.408 converts RA from MJ m-2 day-1 to mm day-1 of evaporation.
+    Arrays are broadcast together: for many sites, give (sites x days) temperatures, a (days,) day_of_year and a (sites,) latitude.
+
+    Args:
+        tmin (array): daily minimum temperature [C].
+        tmax (array): daily maximum temperature [C].
+        day_of_year (array): day of the year (1 to 366) of each day.
+        latitude (float or array): latitude of the site(s) [decimal degrees].
+
+    Returns:
+        array: PET [mm]. NaN where a temperature is missing.
+    """
+    tmin = np.asarray(tmin, dtype = float)
+    tmax = np.asarray(tmax, dtype = float)
+    latitude = np.asarray(latitude, dtype = float)
+    if tmin.ndim == 2 and latitude.ndim == 1:
+        latitude = latitude[:, None]
+    RA = extraterrestrial_radiation(day_of_year, latitude)
+    return 0.0023 * 0.408 * RA * np.sqrt(np.maximum(tmax - tmin, 0)) * ((tmin + tmax) / 2 + 17.8)
+
+
+def calculate_PET(df_long, latitude, **kwargs):
+    """
+    Calculate daily PET (see hargreaves_pet()) from the daily PRISM tmin and tmax of a site.
+
+    Args:
+        df_long (:obj:`df` or :obj:`SiteData`): long-form daily data, with columns date, asset_name, value and band, or SiteData.
+        latitude (float): latitude of the site [decimal degrees].
+        **ppt_asset (str, optional): (default 'prism') asset with the temperature bands.
+        **tmin_band (str, optional): (default 'tmin')
+        **tmax_band (str, optional): (default 'tmax')
+
+    Returns:
+        :obj:`df`: dataframe with columns date, tmin, tmax, RA and PET, for the days with both temperatures.
+
+    Raises:
+        MissingBandsError: if tmin or tmax was not extracted.
+    """
+    default_kwargs = {
+        'ppt_asset': 'prism',
+        'tmin_band': 'tmin',
+        'tmax_band': 'tmax',
+    }
+    kwargs = {**default_kwargs, **kwargs}
+    data = SiteData.from_long(df_long)
+    columns = [(kwargs['ppt_asset'], kwargs['tmin_band']), (kwargs['ppt_asset'], kwargs['tmax_band'])]
+    if not all(column in data for column in columns):
+        raise err.MissingBandsError(f"PET cannot be calculated because {kwargs['ppt_asset']} {kwargs['tmin_band']} and {kwargs['tmax_band']} were not extracted.")
+    temperatures = data.values[columns].dropna()
+    pet_df = pd.DataFrame({'date': temperatures.index.astype('datetime64[ns]'),
+                           'tmin': temperatures.iloc[:, 0].to_numpy(),
+                           'tmax': temperatures.iloc[:, 1].to_numpy()})
+    J = day_of_year(pet_df['date'])
+    pet_df['RA'] = extraterrestrial_radiation(J, latitude)
+    pet_df['PET'] = hargreaves_pet(pet_df['tmin'], pet_df['tmax'], J, latitude)
+    return pet_df
@@ -0,0 +1,368 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from waterpyk import get_default_saving_dir, instrument
+
+# Column names recognized in site lists
+GAGE_COLUMNS = ['gage', 'gage_id', 'site_no']
+LAT_COLUMNS = ['lat', 'latitude']
+LONG_COLUMNS = ['long', 'lon', 'lng', 'longitude']
+NAME_COLUMNS = ['site_name', 'name']
+
+# File extensions read as shapes with geopandas
+SHAPE_EXTENSIONS = ('.shp', '.geojson', '.json', '.gpkg', '.zip')
+
+MANIFEST_NAME = 'batch_manifest.jsonl'
+SUMMARY_NAME = 'batch_summary.csv'
+INSTRUMENTATION_NAME = 'batch_instrumentation.csv'
+SUMMARY_COLUMNS = ['site', 'kind', 'status', 'smax', 'maxdmax', 'MAP', 'seconds', 'saving_path', 'error']
+
+
+def _is_number(value):
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _find_column(columns, names):
+    for name in names:
+        if name in columns:
+            return name
+    return None
+
+
+def read_sites(path, name_column=None):
+    """
+    Read a list of sites for a batch run. Each site is a dict with site (the id used in the manifest), kind, coords (as StudyArea takes them) and kwargs (such as site_name).
+
+    Args:
+        path (str): one of:
+            a text or csv file with one USGS gage ID per line, or with a gage (or site_no) column;
+            a text or csv file with 'lat, long' on each line, or with lat and long columns (and optionally site_name);
+            a shapefile, geojson or geopackage with one shape per row.
+        name_column (str, optional): (default None) column with the site names of shapes. Shapes are named shape_0, shape_1, etc otherwise.
+
+    Returns:
+        list of dict
+    """
+    if path.lower().endswith(SHAPE_EXTENSIONS):
+        import geopandas as gpd  # slow to import, so only imported when needed
+        from waterpyk.main import StudyAreaCollection
+        shapes = gpd.read_file(path)
+        return [{'site': kwargs['site_name'], 'kind': 'shape', 'coords': coords, 'kwargs': kwargs}
+                for coords, kwargs in StudyAreaCollection._site_coords(shapes, name_column)]
+
+    df = pd.read_csv(path, header=None, dtype=str, comment='#', sep=r'[,;\s]+', engine='python', skip_blank_lines=True)
+    df = df.dropna(how='all', axis=1)
+    if len(df) > 0 and not all(_is_number(value) for value in df.iloc[0]):
+        df.columns = [str(column).strip().lower() for column in df.iloc[0]]
+        df = df.iloc[1:]
+    elif len(df.columns) == 1:
+        df.columns = ['gage']
+    elif len(df.columns) == 2:
+        df.columns = ['lat', 'long']
+    else:
+        raise ValueError(f'Could not tell the sites in {path}: give one gage ID or one lat, long pair per line, or a header row.')
+
+    gage_column = _find_column(df.columns, GAGE_COLUMNS)
+    lat_column = _find_column(df.columns, LAT_COLUMNS)
+    long_column = _find_column(df.columns, LONG_COLUMNS)
+    name_column = name_column or _find_column(df.columns, NAME_COLUMNS)
+    sites = []
+    if gage_column is not None:
+        from waterpyk.watershed import format_gage
+        for gage in df[gage_column].dropna():
+            gage = format_gage(gage.strip())
+            sites.append({'site': gage, 'kind': 'watershed', 'coords': [gage], 'kwargs': {}})
+    elif lat_column is not None and long_column is not None:
+        for row in df.to_dict('records'):
+            lat, long = float(row[lat_column]), float(row[long_column])
+            kwargs = {'site_name': str(row[name_column])} if name_column is not None and not pd.isnull(row[name_column]) else {}
+            sites.append({'site': str(lat) + '_' + str(long), 'kind': 'point', 'coords': [lat, long], 'kwargs': kwargs})
+    else:
+        raise ValueError(f'{path} needs a gage column or lat and long columns. Got {list(df.columns)}.')
+    return sites
+
+
+def read_manifest(path):
+    """
+    Read the manifest of a batch run: one json line per finished site, where the last line of a site is its current status.
+
+    Returns:
+        dict: {site: row}
+    """
+    rows = {}
+    if not os.path.exists(path):
+        return rows
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # A line cut off by a crash
+                continue
+            rows[row['site']] = row
+    return rows
+
+
+def _run_site(site, layers, saving_dir, kwargs, verbose=False):
+    """Make the StudyArea of one site (in a worker process) and get its row for the manifest, with the instrumentation of its stages."""
+    from waterpyk.main import StudyArea
+    row = {'site': site['site'], 'kind': site['kind'], 'status': 'failed', 'smax': None, 'maxdmax': None, 'MAP': None,
+           'seconds': None, 'saving_path': None, 'error': None}
+    t1 = time.perf_counter()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    # Recorded here too so the stages of failed sites are kept
+    with instrument.recording() as recorder:
+        try:
+            with output:
+                study_area = StudyArea(site['coords'], layers, saving_dir, **{**kwargs, **site['kwargs']})
+            row.update({'status': 'done', 'smax': study_area.smax, 'maxdmax': study_area.maxdmax, 'MAP': study_area.MAP,
+                        'saving_path': study_area.saving_path})
+        except Exception as e:
+            row['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+    row['seconds'] = round(time.perf_counter() - t1, 3)
+    row['instrumentation'] = recorder.to_dict()
+    return row
+
+
+def _prefetch(sites, kwargs):
+    """Download the USGS data of the gages among sites into the persistent cache, so workers read it from there."""
+    gages = [site['coords'][0] for site in sites if site['kind'] == 'watershed']
+    if len(gages) == 0 or kwargs.get('cache') is False:
+        return None
+    from waterpyk import bulk
+    flow_kwargs = {key: kwargs[key] for key in ['flow_start_date', 'flow_end_date', 'cache'] if key in kwargs}
+    return bulk.fetch_gages(gages, **flow_kwargs)
+
+
+def run_batch(sites, layers=None, saving_dir=None, workers=None, manifest=None, retry_failed=False,
+              prefetch=True, verbose=False, **kwargs):
+    """
+    Make the StudyArea of every site in a process pool, recording each finished site in a manifest so a rerun skips the sites that are done.
+    While the workers process one group of sites, the USGS data (basin, metadata and streamflow) of the next group of gages is downloaded
+    into the persistent cache with bulk.fetch_gages().
+    The instrumentation of each site is kept in the manifest, and the stages of the sites run this time are added up
+    with instrument.aggregate(), printed, and saved in saving_dir/batch_instrumentation.csv.
+
+    Args:
+        sites (list of dict): sites from read_sites().
+        layers (str or :obj:`df`, optional): see StudyArea.
+        saving_dir (str, optional): see StudyArea.
+        workers (int, optional): (default None, which uses the number of cores) number of worker processes. 0 runs the sites one at a time in this process.
+        manifest (str, optional): (default saving_dir/batch_manifest.jsonl) path of the manifest.
+        retry_failed (bool, optional): (default False) also run the sites that failed before.
+        prefetch (bool, optional): (default True) download the USGS data of the next gages while the workers run (needs aiohttp).
+        verbose (bool, optional): (default False) show the output of each StudyArea.
+        **kwargs: see StudyArea.get_data()
+
+    Returns:
+        :obj:`df`: summary with one row per site: site, kind, status ('done', 'failed' or 'pending'), smax, maxdmax, MAP, seconds, saving_path and error.
+    """
+    saving_dir = saving_dir or get_default_saving_dir()
+    os.makedirs(saving_dir, exist_ok=True)
+    manifest = manifest or os.path.join(saving_dir, MANIFEST_NAME)
+    workers = os.cpu_count() if workers is None else workers
+
+    finished = read_manifest(manifest)
+    skip = {'done', 'failed'} if not retry_failed else {'done'}
+    pending = [site for site in sites if finished.get(site['site'], {}).get('status') not in skip]
+    print(f'{len(sites)} sites: {len(sites) - len(pending)} already in the manifest, {len(pending)} to run with {workers or 1} worker(s).')
+
+    group_size = max(workers, 1) * 2
+    groups = [pending[i:i + group_size] for i in range(0, len(pending), group_size)]
+    counts = {'done': 0, 'failed': 0}
+    records = []
+    t1 = time.perf_counter()
+
+    def record(row):
+        with open(manifest, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(row, default=str) + '\n')
+        finished[row['site']] = row
+        records.append(row.get('instrumentation'))
+        counts[row['status']] += 1
+        n = counts['done'] + counts['failed']
+        elapsed = time.perf_counter() - t1
+        rate = n / elapsed * 3600 if elapsed > 0 else 0
+        remaining = (len(pending) - n) * elapsed / n
+        print(f"[{n}/{len(pending)}] {row['site']}: {row['status']} in {row['seconds']} s"
+              f" | {rate:.0f} sites/hour, about {remaining / 60:.1f} min left" + (f" | {row['error']}" if row['error'] else ''))
+
+    prefetcher = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    prefetches = {}
+
+    def start_prefetch(k):
+        if prefetcher is not None and k < len(groups):
+            prefetches[k] = prefetcher.submit(_prefetch, groups[k], kwargs)
+
+    def finish_prefetch(k):
+        if k not in prefetches:
+            return
+        try:
+            prefetches.pop(k).result()
+        except ImportError:
+            print('Prefetching is off because aiohttp is not installed.')
+            for future in prefetches.values():
+                future.cancel()
+            prefetches.clear()
+        except Exception as e:
+            # Workers download whatever the prefetch did not get
+            print(f'Prefetch failed: {e}')
+
+    try:
+        start_prefetch(0)
+        if workers == 0:
+            for k, group in enumerate(groups):
+                finish_prefetch(k)
+                start_prefetch(k + 1)
+                for site in group:
+                    record(_run_site(site, layers, saving_dir, kwargs, verbose))
+        else:
+            # Spawn (not fork) the workers, as the prefetch thread may be running
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                running = {}
+                k = 0
+                while k < len(groups) or running:
+                    # Keep the pool busy: submit the next group once fewer sites than workers are waiting
+                    if k < len(groups) and len(running) <= workers:
+                        finish_prefetch(k)
+                        start_prefetch(k + 1)
+                        for site in groups[k]:
+                            running[pool.submit(_run_site, site, layers, saving_dir, kwargs, verbose)] = site
+                        k += 1
+                        continue
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        site = running.pop(future)
+                        try:
+                            row = future.result()
+                        except Exception as e:
+                            # The worker process died
+                            row = {'site': site['site'], 'kind': site['kind'], 'status': 'failed', 'seconds': None,
+                                   'error': str(e) or type(e).__name__}
+                        record(row)
+    finally:
+        if prefetcher is not None:
+            for future in prefetches.values():
+                future.cancel()
+            prefetcher.shutdown(wait=False)
+
+    elapsed = time.perf_counter() - t1
+    n = counts['done'] + counts['failed']
+    if n > 0:
+        print(f"\nRan {n} sites in {elapsed:.1f} s ({n / elapsed * 3600:.0f} sites/hour, {elapsed / n:.2f} s per site):"
+              f" {counts['done']} done, {counts['failed']} failed.")
+        report_stages(records, os.path.join(saving_dir, INSTRUMENTATION_NAME))
+    return summary(sites, finished)
+
+
+def report_stages(records, path=None, top=8):
+    """
+    Add up the instrumentation of many sites stage by stage (see instrument.aggregate()), print the slowest stages and save the table.
+
+    Args:
+        records (list of dict): instrumentation of each site, such as the 'instrumentation' of the manifest rows.
+        path (str, optional): (default None) csv file for the table. None does not save it.
+        top (int, optional): (default 8) number of stages printed.
+
+    Returns:
+        :obj:`df`: see instrument.aggregate().
+    """
+    df_stages = instrument.aggregate(records)
+    if len(df_stages) == 0:
+        return df_stages
+    if path is not None:
+        df_stages.to_csv(path, index=False)
+    columns = ['stage', 'sites', 'seconds', 'share', 'remote_calls', 'bytes', 'rows', 'cache_hits', 'cache_misses']
+    print('\nSlowest stages:\n' + df_stages[columns].head(top).to_string(index=False, float_format=lambda x: f'{x:.3g}'))
+    return df_stages
+
+
+def summary(sites, finished):
+    """
+    Get the summary table of a batch run from its sites and manifest rows (see read_manifest()).
+
+    Returns:
+        :obj:`df`: one row per site with columns site, kind, status, smax, maxdmax, MAP, seconds, saving_path and error.
+    """
+    rows = [{**{column: None for column in SUMMARY_COLUMNS}, 'site': site['site'], 'kind': site['kind'], 'status': 'pending',
+             **finished.get(site['site'], {})} for site in sites]
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+
+def _value(text):
+    """Parse the value of --set KEY=VALUE as json (numbers, true, false, null, lists), or keep it as a string."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def make_parser():
+    """Get the argument parser of the waterpyk command."""
+    parser = argparse.ArgumentParser(prog='waterpyk', description='Extract and analyze hydrological timeseries with waterpyk.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    batch = commands.add_parser('batch', help='Make the StudyArea of many sites, resuming where an earlier run stopped.',
+                                description='Make the StudyArea of many sites in parallel. Finished sites are recorded in a manifest, '
+                                            'so running the same command again skips them.')
+    batch.add_argument('sites', help='file with one USGS gage ID or "lat, long" per line (or a csv with a gage column or lat and long columns), '
+                                     'or a shapefile, geojson or geopackage with one shape per row.')
+    batch.add_argument('--layers', default='minimal', help="'minimal', 'all' or a csv of layers (default 'minimal').")
+    batch.add_argument('--saving-dir', default=None, help='folder for the site folders, manifest and summary (default data/output).')
+    batch.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of cores). 0 runs sites one at a time.')
+    batch.add_argument('--manifest', default=None, help=f'manifest file (default SAVING_DIR/{MANIFEST_NAME}).')
+    batch.add_argument('--summary', default=None, help=f'csv file for the summary table (default SAVING_DIR/{SUMMARY_NAME}).')
+    batch.add_argument('--name-column', default=None, help='column with site names in the sites file.')
+    batch.add_argument('--retry-failed', action='store_true', help='run the sites that failed in an earlier run again.')
+    batch.add_argument('--no-prefetch', dest='prefetch', action='store_false', help='do not download USGS data ahead of the workers.')
+    batch.add_argument('--verbose', action='store_true', help='show the output of each site.')
+    batch.add_argument('--set', dest='settings', action='append', default=[], metavar='KEY=VALUE',
+                       help='setting passed to StudyArea, such as --set snow_correction=false or --set flow_end_date=2022-10-01. Can be repeated.')
+    return parser
+
+
+def batch(args):
+    """Run the batch command from parsed arguments. Returns the exit code: 1 if any site failed."""
+    settings = {}
+    for setting in args.settings:
+        key, sep, value = setting.partition('=')
+        if not sep:
+            raise SystemExit(f'--set needs KEY=VALUE, got {setting}.')
+        settings[key.strip()] = _value(value.strip())
+    layers = args.layers
+    if layers not in ['minimal', 'all']:
+        layers = pd.read_csv(layers)
+    saving_dir = args.saving_dir or get_default_saving_dir()
+
+    sites = read_sites(args.sites, args.name_column)
+    df_summary = run_batch(sites, layers, saving_dir, workers=args.workers, manifest=args.manifest,
+                           retry_failed=args.retry_failed, prefetch=args.prefetch, verbose=args.verbose, **settings)
+    summary_path = args.summary or os.path.join(saving_dir, SUMMARY_NAME)
+    df_summary.to_csv(summary_path, index=False)
+    with pd.option_context('display.max_rows', 20, 'display.width', 120):
+        print('\n' + df_summary[['site', 'status', 'smax', 'maxdmax', 'MAP']].to_string(index=False, max_rows=20))
+    print('\nSummary saved at:\n\t' + os.path.abspath(summary_path))
+    return int((df_summary['status'] == 'failed').any())
+
+
+def main(argv=None):
+    """Entry point of the waterpyk command."""
+    args = make_parser().parse_args(argv)
+    if args.command == 'batch':
+        return batch(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
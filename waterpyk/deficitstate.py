@@ -0,0 +1,207 @@
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+import waterpyk.errors as err
+from waterpyk import calcs
+
+# Start of the bytes of to_bytes(), with the format version
+MAGIC = b'WPDS'
+VERSION = 1
+
+
+class DeficitState:
+    """
+    Current deficit of one or many sites, advanced day by day as new P, ET and snow data arrives, without recomputing the whole history.
+    For each site it holds D, D_wy, the running Smax (max D) and max(Dmax) (max D_wy). The date, wateryear and snow correction
+    settings are shared by all sites. Each update costs O(1) per site and day, and continuing a state gives the same D and D_wy
+    as calcs.deficit() over the whole record.
+
+    Args:
+        D (float or array, optional): (default 0) deficit of each site on date [mm].
+        D_wy (float or array, optional): (default 0) wateryear deficit of each site on date [mm].
+        smax (float or array, optional): (default None, which uses D) largest D so far [mm].
+        maxdmax (float or array, optional): (default None, which uses D_wy) largest D_wy so far [mm].
+        date (str or Timestamp, optional): (default None) last day included in the state. None if no day has been added yet.
+        sites (list, optional): (default None) name of each site.
+        snow_correction (bool, optional): (default True) set ET to 0 on days when snow is greater than snow_frac.
+        snow_frac (float, optional): (default 10) snow cover (%) above which ET is set to 0 if snow_correction = True.
+        wateryear_start_month (int, optional): (default 10) first month of the wateryear, see calcs.wateryear_of().
+    """
+
+    def __init__(self, D=0, D_wy=0, smax=None, maxdmax=None, date=None, sites=None,
+                 snow_correction=True, snow_frac=10, wateryear_start_month=10):
+        n_sites = len(sites) if sites is not None else np.size(D)
+        self.D = np.broadcast_to(np.asarray(D, dtype=float), (n_sites,)).copy()
+        self.D_wy = np.broadcast_to(np.asarray(D_wy, dtype=float), (n_sites,)).copy()
+        self.smax = self.D.copy() if smax is None else np.broadcast_to(np.asarray(smax, dtype=float), (n_sites,)).copy()
+        self.maxdmax = self.D_wy.copy() if maxdmax is None else np.broadcast_to(np.asarray(maxdmax, dtype=float), (n_sites,)).copy()
+        self.date = None if date is None else pd.Timestamp(date).normalize()
+        self.sites = None if sites is None else list(sites)
+        self.snow_correction = snow_correction
+        self.snow_frac = snow_frac
+        self.wateryear_start_month = wateryear_start_month
+
+    @classmethod
+    def from_deficit(cls, df_deficit, **kwargs):
+        """
+        Make the state of one site from the end of its deficit timeseries (such as StudyArea.deficit_timeseries or calcs.deficit()).
+
+        Args:
+            df_deficit (:obj:`df`): dataframe with date, D and D_wy columns.
+            **kwargs: snow_correction, snow_frac and wateryear_start_month, see DeficitState.
+
+        Returns:
+            :obj:`DeficitState`
+        """
+        last = df_deficit.iloc[-1]
+        return cls(last['D'], last['D_wy'], np.nanmax(df_deficit['D']), np.nanmax(df_deficit['D_wy']),
+                   date=last['date'], **kwargs)
+
+    @classmethod
+    def from_many(cls, D, D_wy, dates, sites=None, **kwargs):
+        """
+        Make the state of many sites from the D and D_wy arrays (sites x days) of calcs.deficit_many().
+
+        Args:
+            D (array): 2-D array (sites x days) of deficit [mm].
+            D_wy (array): 2-D array (sites x days) of wateryear deficit [mm].
+            dates (array): 1-D array (days) of dates.
+            sites (list, optional): (default None) name of each site.
+            **kwargs: snow_correction, snow_frac and wateryear_start_month, see DeficitState.
+
+        Returns:
+            :obj:`DeficitState`
+        """
+        D = np.atleast_2d(D)
+        D_wy = np.atleast_2d(D_wy)
+        return cls(D[:, -1], D_wy[:, -1], np.fmax.reduce(D, axis=1), np.fmax.reduce(D_wy, axis=1),
+                   date=pd.to_datetime(dates[-1]), sites=sites, **kwargs)
+
+    @property
+    def wateryear(self):
+        """Wateryear of date (None if no day has been added yet)."""
+        if self.date is None:
+            return None
+        return int(calcs.wateryear_of([self.date], self.wateryear_start_month)[0])
+
+    def update(self, P, ET, snow=None, dates=None):
+        """
+        Add new days of data to the state of all sites and get their deficit.
+        Give one value per site for one day, or a (sites x days) array for several days at once.
+        The first day of a state without history and the first day of each wateryear start from 0 (D_wy), as in calcs.deficit().
+        Days where P or ET is missing leave the deficit unchanged, and days where snow is missing are not snow corrected.
+
+        Args:
+            P (float or array): daily precipitation [mm], one value per site (sites) or (sites x days).
+            ET (float or array): daily evapotranspiration [mm], same shape as P.
+            snow (float or array, optional): daily snow cover [%], same shape as P. Required if snow_correction = True.
+            dates (str or list, optional): (default None, which uses the days after date) date of each new day. Must be after date.
+                Days left out between date and the first new day are taken to have no change in deficit (but D_wy is still reset if they start a wateryear).
+
+        Returns:
+            array, array: D and D_wy of the new days, the same shape as P.
+        """
+        one_day = np.ndim(P) <= 1
+        P = np.asarray(P, dtype=float).reshape(len(self), -1)
+        ET = np.asarray(ET, dtype=float).reshape(P.shape)
+        n_days = P.shape[1]
+        if self.snow_correction:
+            if snow is None:
+                raise err.MissingBandsError("Snow correction can't be applied because no snow was given. Set snow_correction = False to skip it.")
+            snow = np.asarray(snow, dtype=float).reshape(P.shape)
+            ET = np.where(snow > self.snow_frac, 0, ET)
+
+        if dates is None:
+            if self.date is None:
+                raise err.NoDateSpecifiedError('The state has no date yet, so dates must be given.')
+            dates = self.date + pd.to_timedelta(np.arange(1, n_days + 1), unit='D')
+        dates = pd.DatetimeIndex(pd.to_datetime(np.atleast_1d(dates))).normalize()
+        if len(dates) != n_days:
+            raise ValueError(f'Got {len(dates)} dates for {n_days} days of data.')
+        if self.date is not None and dates[0] <= self.date:
+            raise ValueError(f'New days must be after the last day of the state ({self.date.date()}), got {dates[0].date()}.')
+        if (np.diff(dates.asi8) <= 0).any():
+            raise ValueError('dates must be in increasing order.')
+
+        # Continue both deficits from the carried state: D always, D_wy only within the same wateryear
+        A = np.nan_to_num(ET - P)
+        wateryears = calcs.wateryear_of(dates, self.wateryear_start_month)
+        starts = calcs.segment_starts(wateryears)
+        has_history = self.date is not None
+        D = calcs.clipped_cumsum(A, carry=self.D if has_history else None)
+        continues_wateryear = has_history and wateryears[0] == self.wateryear
+        D_wy = calcs.clipped_cumsum(A, starts, carry=self.D_wy if continues_wateryear else None)
+
+        self.D = D[:, -1].copy()
+        self.D_wy = D_wy[:, -1].copy()
+        self.smax = np.fmax(self.smax, np.fmax.reduce(D, axis=1))
+        self.maxdmax = np.fmax(self.maxdmax, np.fmax.reduce(D_wy, axis=1))
+        self.date = dates[-1]
+        if one_day and n_days == 1:
+            return D[:, 0], D_wy[:, 0]
+        return D, D_wy
+
+    def to_frame(self):
+        """
+        Get a dataframe with one row per site and columns site, D, D_wy, smax and maxdmax.
+        """
+        return pd.DataFrame({'site': self.sites if self.sites is not None else np.arange(len(self)),
+                             'D': self.D, 'D_wy': self.D_wy, 'smax': self.smax, 'maxdmax': self.maxdmax})
+
+    def to_bytes(self, dtype='float32', include_sites=True):
+        """
+        Serialize the state: a short header (date, settings and site names) and then D, D_wy, smax and maxdmax of each site,
+        which take 16 bytes per site as float32 (rounding to about 0.1 um for deficits below 1000 mm) or 32 bytes as float64.
+
+        Args:
+            dtype (str, optional): (default 'float32') 'float32' or 'float64'.
+            include_sites (bool, optional): (default True) store the site names in the header.
+
+        Returns:
+            bytes
+        """
+        if dtype not in ('float32', 'float64'):
+            raise ValueError(f"dtype must be 'float32' or 'float64', got {dtype}.")
+        header = {
+            'n_sites': len(self),
+            'dtype': dtype,
+            'date': None if self.date is None else str(self.date.date()),
+            'snow_correction': bool(self.snow_correction),
+            'snow_frac': self.snow_frac,
+            'wateryear_start_month': self.wateryear_start_month,
+            'sites': self.sites if include_sites else None,
+        }
+        header = json.dumps(header, separators=(',', ':'), default=str).encode('utf-8')
+        values = np.stack([self.D, self.D_wy, self.smax, self.maxdmax]).astype(np.dtype(dtype).newbyteorder('<'))
+        return MAGIC + struct.pack('<BI', VERSION, len(header)) + header + values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Read a state from the bytes of to_bytes().
+
+        Returns:
+            :obj:`DeficitState`
+        """
+        data = bytes(data)
+        if data[:4] != MAGIC:
+            raise ValueError('Not a serialized DeficitState.')
+        version, header_size = struct.unpack_from('<BI', data, 4)
+        if version != VERSION:
+            raise ValueError(f'Unsupported DeficitState version {version}.')
+        start = 4 + struct.calcsize('<BI')
+        header = json.loads(data[start:start + header_size].decode('utf-8'))
+        values = np.frombuffer(data, dtype=np.dtype(header['dtype']).newbyteorder('<'),
+                               offset=start + header_size).reshape(4, header['n_sites']).astype(float)
+        return cls(*values, date=header['date'], sites=header['sites'], snow_correction=header['snow_correction'],
+                   snow_frac=header['snow_frac'], wateryear_start_month=header['wateryear_start_month'])
+
+    def __len__(self):
+        return len(self.D)
+
+    def __repr__(self):
+        date = 'no data' if self.date is None else str(self.date.date())
+        return f'DeficitState({len(self)} sites, {date})'
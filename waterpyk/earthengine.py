@@ -0,0 +1,37 @@
+import threading
+
+_lock = threading.Lock()
+_initialized = False
+
+
+def initialize(**kwargs):
+    """
+    Import and initialize the Earth Engine API, once. Called automatically the first time waterpyk uses Earth Engine,
+    so importing waterpyk does not need Earth Engine credentials. Call it yourself to initialize with other arguments (such as project).
+
+    Args:
+        **kwargs: passed to ee.Initialize()
+
+    Returns:
+        the ee module
+    """
+    global _initialized
+    import ee as ee_module
+    with _lock:
+        if not _initialized:
+            ee_module.Initialize(**kwargs)
+            _initialized = True
+    return ee_module
+
+
+class _LazyEE:
+    """Stand-in for the ee module that initializes Earth Engine on first use."""
+
+    def __getattr__(self, name):
+        return getattr(initialize(), name)
+
+    def __repr__(self):
+        return '<ee module, initialized on first use>'
+
+
+ee = _LazyEE()
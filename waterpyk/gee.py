@@ -1,16 +1,23 @@
+import hashlib
 import json
+import time
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 
-import ee
-import geopandas as gpd
 import numpy as np
 import pandas as pd
 
 from waterpyk import errors as err
-from waterpyk import load_data
-from waterpyk.calcs import combine_bands, interp_daily
+from waterpyk import instrument, load_data
+from waterpyk.cache import resolve as resolve_cache
+from waterpyk.calcs import combine_bands, interp_daily, wateryear_of, wateryear_start
+from waterpyk.earthengine import ee
 
-ee.Initialize()
+# Property used to match reduceRegions output features to sites
+SITE_PROPERTY = 'waterpyk_site'
+
+# Part of every cache key, increased when cached results made by earlier versions can be wrong
+CACHE_VERSION = 3
 
 
 def gdf_to_feat(gdf, target_epsg='4326'):
@@ -41,7 +48,7 @@ def gdf_to_feat(gdf, target_epsg='4326'):
     return gee_feat
 
 
-def extract_basic(gee_feature, kind, asset_id, scale, bands, start_date=None, end_date=None, relative_date=None, bands_to_scale=None, scaling_factor=1, reducer_type=None, new_bandnames=None, interp=True):
+def extract_basic(gee_feature, kind, asset_id, scale, bands, start_date=None, end_date=None, relative_date=None, bands_to_scale=None, scaling_factor=1, reducer_type=None, new_bandnames=None, interp=True, interp_method='linear', chunk_by=None, max_workers=None, retries=3, cache=None, wateryear_start_month=10):
     """
     Extract data from a single asset. For timeseries, specify start_date  and end_date for an asset_id.
     For an image or to get an image from an imagecollection (ie one date), specify relative_date as either 'first', 'most_recent', or 'image'.
@@ -60,10 +67,34 @@ def extract_basic(gee_feature, kind, asset_id, scale, bands, start_date=None, en
         bands_to_scale (list of str, optional): (default = None) bands for which each value will be multiplied by scaling_factor.
         scaling_factor (float, optional): (default = 1) scaling factor to apply to all values in bands_to_scale
         reducer_type (:obj:`gee reducer function`, optional): reducer_type defaults to first() for points and mean() for watersheds. See available gee ReduceRegion options online for other possible inputs.
+        interp (bool, optional): (default = True) interpolate timeseries to daily.
+        interp_method (str, optional): (default = 'linear') 'linear', 'nearest' or 'step'. See calcs.interp_daily().
+        chunk_by (str or int, optional): (default = None) split a timeseries into windows that are requested separately: 'wateryear' for one request per wateryear, or an int N for one request per N images. None requests the whole date range at once.
+        max_workers (int, optional): (default = None) number of windows to request at the same time if chunk_by is given.
+        retries (int, optional): (default = 3) number of times a failed window is requested again if chunk_by is given.
+        cache (:obj:`ExtractionCache` or bool, optional): (default = None) cache for the raw GEE output. None uses cache.get_default_cache() and False turns off caching.
+        wateryear_start_month (int, optional): (default = 10) first month of the wateryear windows if chunk_by = 'wateryear', see calcs.wateryear_of().
 
     Returns:
         :obj:`df`: dataframe of all extracted data
     """
+    reducer_type = get_reducer(kind, reducer_type)
+    spec = {'asset_id': asset_id, 'bands': bands, 'start_date': start_date,
+            'end_date': end_date, 'relative_date': relative_date}
+    if chunk_by is not None and relative_date is None:
+        reducer_dict, time_start = request_windows(
+            gee_feature, reducer_type, scale, spec, chunk_by, max_workers, retries, cache, wateryear_start_month)
+    else:
+        reducer_dict, time_start = request_stacked(
+            gee_feature, reducer_type, scale, [spec], cache)[0]
+    return reduced_to_df(reducer_dict, time_start, bands, bands_to_scale=bands_to_scale, scaling_factor=scaling_factor,
+                         new_bandnames=new_bandnames, interp=interp, interp_method=interp_method)
+
+
+def get_reducer(kind, reducer_type=None):
+    """
+    Get the default GEE reducer for a kind of site if reducer_type is None: first() for points and mean() otherwise.
+    """
     # Set reducer type based on kind (watershed or point)
     if reducer_type is None:
         if kind == 'point':
@@ -74,10 +105,17 @@ def extract_basic(gee_feature, kind, asset_id, scale, bands, start_date=None, en
             reducer_type = ee.Reducer.mean()  # type:ignore
         else:
             reducer_type = ee.Reducer.mean()  # type:ignore
-    else:
-        pass
+    return reducer_type
+
+
+def build_asset(asset_id, bands, start_date=None, end_date=None, relative_date=None):
+    """
+    Get the GEE image to reduce for an asset. ImageCollection timeseries are filtered between start_date and end_date and converted to one multi-band image with toBands().
+    See extract_basic() for args.
 
-    # Get asset
+    Returns:
+        :obj:`ee.Image`
+    """
     if relative_date == 'image':
         asset = ee.Image(asset_id).select(bands)
     elif relative_date is None:
@@ -91,11 +129,283 @@ def extract_basic(gee_feature, kind, asset_id, scale, bands, start_date=None, en
     else:
         raise err.NoDateSpecifiedError(
             "Specify start and end date or set relative_date argument to be 'most_recent' or 'first'. relative_date was: {}".format(relative_date))
+    return asset
+
+
+def request_stacked(gee_feature, reducer_type, scale, specs, cache=None):
+    """
+    Reduce one or more assets over gee_feature with a single getInfo() round-trip.
+    Each asset gets its own reduceRegion call, so it is reduced in its native projection and gives the same values as when it is requested alone
+    (stacking assets into one image with ee.Image.cat() would reduce all of them in the projection of the first band).
+    Assets already in the cache are not requested again. Timeseries that end after today, or whose images do not reach their end date yet,
+    are not cached, so they are requested again once new images are published.
+
+    Args:
+        gee_feature (:obj:`gee feature`): GEE feature for region geometry
+        reducer_type (:obj:`gee reducer function`): reducer for reduceRegion
+        scale (int): scale in meters for GEE reducer function
+        specs (list of dict): one dict per asset with keys asset_id, bands, start_date, end_date and relative_date (see build_asset()).
+        cache (:obj:`ExtractionCache` or bool, optional): defaults to None, which uses cache.get_default_cache(). False turns off caching.
+
+    Returns:
+        list of (dict, int): for each spec, the reduceRegion output for its bands (with the original band names) and its system:time_start in ms (None for timeseries).
+    """
+    cache = resolve_cache(cache)
+    if cache is None:
+        return _request_stacked(gee_feature, reducer_type, scale, specs)
+    geometry_id = _serialize(gee_feature.geometry())
+    keys = [_cache_key(cache, spec, scale, reducer_type, geometry_id) for spec in specs]
+    results = [_cache_get(cache, key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if len(missing) > 0:
+        fetched = _request_stacked(gee_feature, reducer_type, scale, [specs[i] for i in missing])
+        for i, result in zip(missing, fetched):
+            _cache_put(cache, keys[i], result, specs[i], scale)
+            results[i] = result
+    return results
+
+
+def _request_stacked(gee_feature, reducer_type, scale, specs):
+    """request_stacked() without the cache."""
+    images, time_starts = _stack(specs)
+    reduced = ee.Dictionary({'r{}'.format(i): image.reduceRegion(reducer=reducer_type, geometry=gee_feature.geometry(),
+                                                                   scale=scale, maxPixels=1e12)
+                             for i, image in enumerate(images)})
+    info = _get_info(ee.Dictionary({'reduced': reduced, 'time_start': time_starts}))
+    return _split_stacked(info['reduced'], info['time_start'], len(specs))
+
+
+def request_stacked_regions(gee_features, reducer_type, scale, specs, cache=None):
+    """
+    Like request_stacked(), but for many sites at once: each asset is reduced over an ee.FeatureCollection of the sites with reduceRegions, all in one round-trip.
+    Sites that have every asset in the cache are not requested again.
+
+    Args:
+        gee_features (list of :obj:`gee feature`): GEE features for the site geometries
+        reducer_type (:obj:`gee reducer function`): reducer for reduceRegions
+        scale (int): scale in meters for GEE reducer function
+        specs (list of dict): see request_stacked()
+        cache (:obj:`ExtractionCache` or bool, optional): see request_stacked()
+
+    Returns:
+        list of list of (dict, int): for each site (in the order of gee_features), the output of request_stacked() for that site.
+    """
+    cache = resolve_cache(cache)
+    if cache is None:
+        return _request_stacked_regions(gee_features, reducer_type, scale, specs)
+    keys = []
+    for feature in gee_features:
+        geometry_id = _serialize(feature.geometry())
+        keys.append([_cache_key(cache, spec, scale, reducer_type, geometry_id) for spec in specs])
+    results = [[_cache_get(cache, key) for key in site_keys] for site_keys in keys]
+
+    # Request every spec missing for any site, for all sites missing something
+    sites = [site for site, site_results in enumerate(results) if None in site_results]
+    missing = [i for i in range(len(specs)) if any(results[site][i] is None for site in sites)]
+    if len(sites) > 0:
+        fetched = _request_stacked_regions([gee_features[site] for site in sites], reducer_type, scale,
+                                           [specs[i] for i in missing])
+        for site, site_fetched in zip(sites, fetched):
+            for i, result in zip(missing, site_fetched):
+                _cache_put(cache, keys[site][i], result, specs[i], scale)
+                results[site][i] = result
+    return results
+
+
+def _request_stacked_regions(gee_features, reducer_type, scale, specs):
+    """request_stacked_regions() without the cache."""
+    images, time_starts = _stack(specs)
+    collection = ee.FeatureCollection([ee.Feature(feature.geometry(), {SITE_PROPERTY: i})
+                                       for i, feature in enumerate(gee_features)])
+    # forEach names the outputs after the bands: reduceRegions names the output of a one-band image after the reducer (such as 'mean')
+    reduced = ee.Dictionary({'r{}'.format(i): image.reduceRegions(collection=collection, reducer=reducer_type.forEach(image.bandNames()),
+                                                                    scale=scale)
+                             for i, image in enumerate(images)})
+    info = _get_info(ee.Dictionary({'reduced': reduced, 'time_start': time_starts}))
+
+    # reduceRegions output features are not guaranteed to keep the input order
+    by_site = [{} for feature in gee_features]
+    for name, reduced_asset in info['reduced'].items():
+        for feature in reduced_asset['features']:
+            properties = dict(feature['properties'])
+            by_site[properties.pop(SITE_PROPERTY)][name] = properties
+    return [_split_stacked(reduced_site, info['time_start'], len(specs)) for reduced_site in by_site]
+
+
+def _get_info(ee_object):
+    """getInfo() of an ee object, counted as a remote call (with the size of the result as json) for instrument."""
+    info = ee_object.getInfo()
+    instrument.count(remote_calls=1, bytes=len(json.dumps(info)))
+    return info
 
-    # Perform reduceRegion
-    reducer_dict = asset.reduceRegion(reducer=reducer_type, geometry=gee_feature.geometry(
-    ), scale=scale, maxPixels=1e12).getInfo()
 
+def _serialize(ee_object):
+    """Client-side description of an ee object (such as a geometry or reducer) for cache keys."""
+    if hasattr(ee_object, 'serialize'):
+        return hashlib.sha256(ee_object.serialize().encode('utf-8')).hexdigest()
+    return str(ee_object)
+
+
+def today():
+    """Today's date (at midnight): images after it cannot have been published yet."""
+    return pd.Timestamp.now().normalize()
+
+
+def _cache_key(cache, spec, scale, reducer_type, geometry_id):
+    """
+    Cache key for one asset spec, or None if it should not be cached: 'most_recent' images and timeseries ending after today
+    change when new images are published.
+    """
+    if spec['relative_date'] == 'most_recent':
+        return None
+    if spec['end_date'] is not None and pd.to_datetime(spec['end_date']) > today():
+        return None
+    def date(value):
+        return None if value is None else pd.to_datetime(value).isoformat()
+    return cache.key(asset_id=spec['asset_id'], bands=list(spec['bands']), start_date=date(spec['start_date']),
+                     end_date=date(spec['end_date']), relative_date=spec['relative_date'], scale=float(scale),
+                     reducer=_serialize(reducer_type), geometry=geometry_id, version=CACHE_VERSION)
+
+
+def _cache_get(cache, key):
+    if key is None:
+        return None
+    result = cache.get(key)
+    if result is not None:
+        result = (result[0], result[1])
+    return result
+
+
+def _image_dates(reducer_dict):
+    """Sorted unique dates of the toBands() names (such as 2003_01_01_ET) of a timeseries reduction, as in reduced_to_df()."""
+    dates = {'-'.join(key.replace('-', '_').split('_')[:3]) for key in reducer_dict}
+    return pd.DatetimeIndex(sorted(pd.to_datetime(list(dates), errors='coerce').dropna()))
+
+
+def _is_complete(result, spec):
+    """
+    Whether a timeseries reduction reaches the end of its date range: its last image is less than the usual time between its images before end_date.
+    A timeseries whose last images are not published yet (or with no images at all) is not complete.
+    """
+    if spec['relative_date'] is not None:
+        return True
+    dates = _image_dates(result[0] or {})
+    if len(dates) == 0:
+        return False
+    step = pd.Series(dates).diff().median() if len(dates) > 1 else pd.Timedelta(0)
+    return dates[-1] + max(step, pd.Timedelta(days=1)) >= pd.to_datetime(spec['end_date'])
+
+
+def _cache_put(cache, key, result, spec, scale):
+    if key is not None and _is_complete(result, spec):
+        cache.put(key, list(result), asset_id=spec['asset_id'], bands=','.join(spec['bands']),
+                  start_date=spec['start_date'], end_date=spec['end_date'],
+                  relative_date=spec['relative_date'], scale=scale)
+
+
+def _stack(specs):
+    """Build the image of each spec and an ee.Dictionary of the time_starts needed to date single images."""
+    images = [build_asset(**spec) for spec in specs]
+    # system:time_start is only needed to date single images (not toBands() timeseries)
+    time_starts = ee.Dictionary({'t{}'.format(i): image.get('system:time_start')
+                                 for i, (image, spec) in enumerate(zip(images, specs)) if spec['relative_date'] is not None})
+    return images, time_starts
+
+
+def _split_stacked(reduced, time_starts, n_specs):
+    """Split the output of a stacked request ({'r0': reducer_dict, ...}) back into (reducer_dict, time_start) for each spec."""
+    return [(reduced.get('r{}'.format(i)) or {}, time_starts.get('t{}'.format(i)))
+            for i in range(n_specs)]
+
+
+def time_windows(start_date, end_date, chunk_by, asset_id=None, wateryear_start_month=10):
+    """
+    Split the date range of a timeseries into windows for separate requests.
+
+    Args:
+        start_date (str): start of the date range (inclusive)
+        end_date (str): end of the date range (exclusive, as in ee.ImageCollection.filterDate)
+        chunk_by (str or int): 'wateryear' for windows starting on the first day of each wateryear, or an int N for windows of N images.
+        asset_id (str, optional): GEE ImageCollection. Required if chunk_by is an int, because the image dates are needed (one extra request).
+        wateryear_start_month (int, optional): (default 10) first month of the wateryear windows, see calcs.wateryear_of().
+
+    Returns:
+        list of (:obj:`Timestamp`, :obj:`Timestamp`): start (inclusive) and end (exclusive) of each window.
+    """
+    start_date = pd.to_datetime(start_date)
+    end_date = pd.to_datetime(end_date)
+    if chunk_by == 'wateryear':
+        first_wateryear, last_wateryear = wateryear_of([start_date, end_date], wateryear_start_month)
+        bounds = [wateryear_start(wateryear, wateryear_start_month) for wateryear in range(first_wateryear + 1, last_wateryear + 1)]
+    elif isinstance(chunk_by, (int, np.integer)) and chunk_by > 0:
+        times = _get_info(ee.ImageCollection(asset_id).filterDate(start_date, end_date).aggregate_array('system:time_start'))
+        bounds = list(pd.to_datetime(sorted(times), unit='ms')[chunk_by::chunk_by])
+    else:
+        raise ValueError(f"chunk_by must be 'wateryear' or a positive int. Got {chunk_by}.")
+    bounds = [start_date] + [bound for bound in bounds if start_date < bound < end_date] + [end_date]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _with_retries(func, retries, *args):
+    """Call func(*args), calling it again (with exponential backoff) up to retries times if it raises."""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print('\tRequest failed ({}). Retrying in {} s.'.format(e, 2 ** attempt))
+            time.sleep(2 ** attempt)
+
+
+def request_windows(gee_feature, reducer_type, scale, spec, chunk_by, max_workers=None, retries=3, cache=None, wateryear_start_month=10):
+    """
+    Reduce a timeseries asset window by window (see time_windows()) instead of in one toBands() image over the whole date range.
+    Windows are requested in parallel (if max_workers > 1) and each failed window is retried on its own.
+    Each window is cached separately, so windows that were already extracted are not requested again.
+
+    Args:
+        gee_feature (:obj:`gee feature`): GEE feature for region geometry
+        reducer_type (:obj:`gee reducer function`): reducer for reduceRegion
+        scale (int): scale in meters for GEE reducer function
+        spec (dict): asset spec with keys asset_id, bands, start_date, end_date and relative_date (None).
+        chunk_by (str or int): see time_windows()
+        max_workers (int, optional): number of windows to request at the same time.
+        retries (int, optional): number of times a failed window is requested again.
+        cache (:obj:`ExtractionCache` or bool, optional): see request_stacked()
+        wateryear_start_month (int, optional): see time_windows()
+
+    Returns:
+        (dict, None): the reduceRegion output of all windows merged in date order, as returned by request_stacked() for the whole date range.
+    """
+    windows = time_windows(spec['start_date'], spec['end_date'], chunk_by, spec['asset_id'], wateryear_start_month)
+    cache = resolve_cache(cache)
+    if cache is None:
+        cache = False
+    print('\tRequesting {} in {} windows'.format(spec['asset_id'], len(windows)))
+
+    def run_window(window):
+        window_spec = {**spec, 'start_date': window[0], 'end_date': window[1]}
+        return _with_retries(request_stacked, retries, gee_feature, reducer_type, scale, [window_spec], cache)[0][0]
+
+    reducer_dict = {}
+    for window_dict in _map(run_window, windows, max_workers):
+        reducer_dict.update(window_dict)
+    return reducer_dict, None
+
+
+def reduced_to_df(reducer_dict, time_start, bands, bands_to_scale=None, scaling_factor=1, new_bandnames=None, interp=True, interp_method='linear'):
+    """
+    Make a long-form dataframe from the reduceRegion output of one asset, then interpolate, rename and scale it as described in extract_basic().
+
+    Args:
+        reducer_dict (dict): reduceRegion output with band names as keys (for timeseries, toBands() names such as 2003_01_01_ET).
+        time_start (int): system:time_start of the image in ms. Only used for single images.
+        **kwargs: see extract_basic()
+
+    Returns:
+        :obj:`df`: dataframe of all extracted data
+    """
     if len(reducer_dict) > len(bands):
         # Make df from reducer output and clean up
         df = pd.DataFrame(list(reducer_dict.items()),
@@ -116,7 +426,7 @@ def extract_basic(gee_feature, kind, asset_id, scale, bands, start_date=None, en
         )[0]]['date'][len(df.band.unique())]
         date_range = date1-date0
         if interp == True:
-            df = interp_daily(df)
+            df = interp_daily(df, method=interp_method)
             print('\tOriginal timestep of ' + str(date_range.days) +
                   ' day(s) was interpolated to daily.')
         else:
@@ -128,8 +438,7 @@ def extract_basic(gee_feature, kind, asset_id, scale, bands, start_date=None, en
                           columns=['variable', 'value'])
         df['band'] = df['variable']
         df['value_raw'] = df['value']
-        df['date'] = pd.to_datetime(
-            asset.get('system:time_start').getInfo(), unit='ms')
+        df['date'] = pd.to_datetime(time_start, unit='ms')
         old_bandnames = bands  # save for renaming bands
 
     if new_bandnames is not None:
@@ -150,69 +459,228 @@ def extract_basic(gee_feature, kind, asset_id, scale, bands, start_date=None, en
     return df
 
 
-def extract(layers, gee_feature, kind, reducer_type=None, **kwargs):
+def plan_requests(layers, stack_size=None):
     """
-    Extract data at site for several assets at once. Uses extract_basic().
+    Group the rows of a layers table into as few GEE requests as possible.
+    Rows with the same scale share one request (the geometry and reducer are shared by all rows of an extraction). Each row is still
+    reduced on its own, in the native projection of its asset, so stacking never changes the values (see request_stacked()).
+    Rows asking for exactly the same asset, bands and dates share one entry in the request.
 
     Args:
-        layers (str or :obj:`df`, optional): If str, specify 'minimal' or 'all' to extract default set of assets. If df, columns that must be present include: asset_id, start_date, end_date, relative_date, scale, bands, bands_to_scale, new_bandnames, scaling factor. These are the same parameters required for extract_basic(). 
-        gee_feature (:obj:`gee feature`): GEE feature for region geometry
-        kind (str): 'point' or 'watershed'
-        reducer_type (:obj:`GEE reducer function`): defaults to None, in which case GEE reduceRegion reducer function is first() and mean() for points and watersheds, respectively. See GEE documentation for more available types.
-        **interp (bool, optional): (default: True), currently no option to change to False.
-        **combine_ET_bands (bool, optional): (default True) add ET bands to make one ET band.
-        **bands_to_combine (list of str, optional): (default [Es, Ec]) ET bands to combine
-        **band_names_combined (str, optional): (default 'ET') name of combined ET band
+        layers (:obj:`df`): layers table (see extract()) with bands already split into lists.
+        stack_size (int, optional): maximum number of assets in one request. Default None (no limit).
 
     Returns:
-        :obj:`df`, :obj:`df`: 2 long-style pandas dataframes, the first containing all of the daily data and the second containing all of the non-daily data (i.e. extractions from images or from single-timestep ImageCollections).
+        list of (int, list of int): for each request, its scale and the positions of the layers rows in it (in their original order).
     """
+    groups = {}
+    for position, row in enumerate(layers.itertuples()):
+        groups.setdefault(row.scale, []).append(position)
+    plan = []
+    for scale, positions in groups.items():
+        step = len(positions) if stack_size is None else stack_size
+        for i in range(0, len(positions), step):
+            plan.append((scale, positions[i:i + step]))
+    return plan
+
+
+def _process_bandnames(row):
+    """Turn the bands and new_bandnames strings of a layers row into lists."""
+    # Make list of strings from string
+    bands = [i.split(',') for i in [row.bands]][0]
+    bands = [i.replace(" ", "") for i in bands]  # Remove any spaces
+    if row.new_bandnames is not None:
+        # Make list of strings from string
+        new_bandnames = [i.split(',') for i in [row.new_bandnames]][0]
+        new_bandnames = [i.replace(" ", "")
+                         for i in new_bandnames]  # Remove any spaces
+        message = '\tBands {} renamed to {}.'.format(
+            row.bands, row.new_bandnames)
+        print(message)
+    else:
+        new_bandnames = None
+    return bands, new_bandnames
+
+
+def _prepare_layers(layers):
+    """Load and clean the layers table. Returns the cleaned table, its rows, their (bands, new_bandnames) and one asset spec per row."""
     # Read in existing csv for typical inputs
-    if layers == 'all' or layers == 'minimal':
+    if isinstance(layers, str) and layers in ['all', 'minimal']:
         print('Getting layers from load_data()...')
         layers = load_data(layers)
 
     # Otherewise take in dataframe as layers and continue cleaning
     layers = layers.replace({np.nan: None})
 
-    # Turn df entries into suitable formats
-    def process_bandnames(row):
-        # Make list of strings from string
-        bands = [i.split(',') for i in [row.bands]][0]
-        bands = [i.replace(" ", "") for i in bands]  # Remove any spaces
-        if row.new_bandnames is not None:
-            # Make list of strings from string
-            new_bandnames = [i.split(',') for i in [row.new_bandnames]][0]
-            new_bandnames = [i.replace(" ", "")
-                             for i in new_bandnames]  # Remove any spaces
-            message = '\tBands {} renamed to {}.'.format(
-                row.bands, row.new_bandnames)
-            print(message)
-        else:
-            new_bandnames = None
-        return bands, new_bandnames
-
-    # Initialize return dfs
-    df = pd.DataFrame(columns=['date'])
-    df_image = pd.DataFrame()
-    for row in layers.itertuples():
-        print('Extracting', row.name)
-        bands, new_bandnames = process_bandnames(row)
-        single_asset = extract_basic(gee_feature, kind, asset_id=row.asset_id, scale=row.scale, bands=bands, start_date=row.start_date, end_date=row.end_date,
-                                     relative_date=row.relative_date, bands_to_scale=row.bands_to_scale, scaling_factor=row.scaling_factor, reducer_type=reducer_type, new_bandnames=new_bandnames)
+    # Turn df entries into suitable formats and make one asset spec per row
+    rows = list(layers.itertuples())
+    row_bands = [_process_bandnames(row) for row in rows]
+    specs = [{'asset_id': row.asset_id, 'bands': bands, 'start_date': row.start_date,
+              'end_date': row.end_date, 'relative_date': row.relative_date}
+             for row, (bands, new_bandnames) in zip(rows, row_bands)]
+    return layers, rows, row_bands, specs
+
+
+def _unique_specs(specs, positions):
+    """Identical specs (same asset, bands and dates) are only requested once. Returns the unique specs and the index of each position's spec in them."""
+    unique = []
+    for position in positions:
+        if specs[position] not in unique:
+            unique.append(specs[position])
+    return unique, [unique.index(specs[position]) for position in positions]
+
+
+def _map(func, items, max_workers):
+    """map() over items, on a thread pool if max_workers > 1. Results are in the order of items."""
+    if max_workers is None or max_workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(instrument.wrap(func), items))
+
+
+def _rows_to_dfs(rows, row_bands, reduced_by_row, **kwargs):
+    """Make the daily and image long dataframes for one site from the (reducer_dict, time_start) of each layers row."""
+    # Make a long dataframe for each row. Results keep the order of the layers rows.
+    results = []
+    for position, row in enumerate(rows):
+        bands, new_bandnames = row_bands[position]
+        reducer_dict, time_start = reduced_by_row[position]
+        single_asset = reduced_to_df(reducer_dict, time_start, bands, bands_to_scale=row.bands_to_scale, scaling_factor=row.scaling_factor,
+                                     new_bandnames=new_bandnames, interp_method=kwargs.get('interp_method', 'linear'))
         single_asset['asset_name'] = row.name
-        single_asset_propogate = single_asset[[
-            'asset_name', 'value', 'date', 'band']]
+        results.append(single_asset[['asset_name', 'value', 'date', 'band']])
 
-        # Append to correct df (daily or single asset)
-        if row.relative_date is None:
-            df = pd.concat([df, single_asset_propogate], ignore_index=True)
-        else:
-            df_image = pd.concat(
-                [df_image, single_asset_propogate], ignore_index=True)
+    # Sort into the correct df (daily or single asset) and build each df once
+    daily = [result for row, result in zip(rows, results) if row.relative_date is None]
+    images = [result for row, result in zip(rows, results) if row.relative_date is not None]
+    if len(daily) > 0:
+        df = pd.concat(daily, ignore_index=True)[['date', 'asset_name', 'value', 'band']]
+    else:
+        df = pd.DataFrame(columns=['date', 'asset_name', 'value', 'band'])
+    if len(images) > 0:
+        df_image = pd.concat(images, ignore_index=True)
+    else:
+        df_image = pd.DataFrame()
 
     # Combine ET bands if specified
     if kwargs['combine_ET_bands']:
         df = combine_bands(
             df, kwargs['bands_to_combine'], kwargs['band_name_final'])
     return df, df_image
+
+
+def extract(layers, gee_feature, kind, reducer_type=None, max_workers=None, stack_requests=True, stack_size=None, chunk_by=None, cache=None, wateryear_start_month=10, **kwargs):
+    """
+    Extract data at site for several assets at once.
+    By default the layers are planned into as few GEE requests as possible (see plan_requests()): assets with the same scale are reduced
+    in a single getInfo() round-trip (each in its own projection) and split back into one long dataframe per asset.
+
+    Args:
+        layers (str or :obj:`df`, optional): If str, specify 'minimal' or 'all' to extract default set of assets. If df, columns that must be present include: asset_id, start_date, end_date, relative_date, scale, bands, bands_to_scale, new_bandnames, scaling factor. These are the same parameters required for extract_basic(). 
+        gee_feature (:obj:`gee feature`): GEE feature for region geometry
+        kind (str): 'point' or 'watershed'
+        reducer_type (:obj:`GEE reducer function`): defaults to None, in which case GEE reduceRegion reducer function is first() and mean() for points and watersheds, respectively. See GEE documentation for more available types.
+        max_workers (int, optional): defaults to None, in which case requests are made one at a time. If greater than 1, up to max_workers GEE requests are made at the same time. The output order is the same either way.
+        stack_requests (bool, optional): defaults to True. If False, every asset is extracted with its own request, as with extract_basic().
+        stack_size (int, optional): defaults to None (no limit). Maximum number of assets stacked into one request.
+        chunk_by (str or int, optional): defaults to None. If given, timeseries are not stacked but requested in windows of one wateryear ('wateryear') or N images (int). See extract_basic().
+        cache (:obj:`ExtractionCache` or bool, optional): defaults to None, which uses cache.get_default_cache(). Assets (or windows) already in the cache are not requested again. False turns off caching.
+        wateryear_start_month (int, optional): defaults to 10. First month of the wateryear windows if chunk_by = 'wateryear', as for the wateryear totals (see calcs.wateryear_of()).
+        **interp (bool, optional): (default: True), currently no option to change to False.
+        **interp_method (str, optional): (default: 'linear') daily interpolation method, 'linear', 'nearest' or 'step'.
+        **combine_ET_bands (bool, optional): (default True) add ET bands to make one ET band.
+        **bands_to_combine (list of str, optional): (default [Es, Ec]) ET bands to combine
+        **band_names_combined (str, optional): (default 'ET') name of combined ET band
+
+    Returns:
+        :obj:`df`, :obj:`df`: 2 long-style pandas dataframes, the first containing all of the daily data and the second containing all of the non-daily data (i.e. extractions from images or from single-timestep ImageCollections).
+    """
+    layers, rows, row_bands, specs = _prepare_layers(layers)
+    reducer_type = get_reducer(kind, reducer_type)
+    cache = resolve_cache(cache)
+    if cache is None:
+        cache = False
+    if stack_requests:
+        plan = plan_requests(layers, stack_size)
+    else:
+        plan = [(row.scale, [position]) for position, row in enumerate(rows)]
+
+    # Timeseries requested in windows each get their own request
+    if chunk_by is not None:
+        windowed = [position for position, row in enumerate(rows) if row.relative_date is None]
+        plan = [(scale, [position for position in positions if position not in windowed]) for scale, positions in plan]
+        plan = [request for request in plan if len(request[1]) > 0] + [(rows[position].scale, [position]) for position in windowed]
+    else:
+        windowed = []
+
+    def run_request(request):
+        scale, positions = request
+        names = [str(rows[position].name) for position in positions]
+        print('Extracting', ', '.join(names))
+        with instrument.stage('gee:' + ','.join(names)):
+            if positions[0] in windowed:
+                reduced = [request_windows(gee_feature, reducer_type, scale, specs[positions[0]], chunk_by, max_workers,
+                                           cache=cache, wateryear_start_month=wateryear_start_month)]
+            else:
+                unique, index = _unique_specs(specs, positions)
+                reduced = request_stacked(gee_feature, reducer_type, scale, unique, cache)
+                reduced = [reduced[i] for i in index]
+            instrument.count(rows=sum(len(reducer_dict or {}) for reducer_dict, time_start in reduced))
+        return reduced
+
+    # Make the requests (in parallel if max_workers > 1)
+    reduced_by_row = {}
+    for (scale, positions), reduced in zip(plan, _map(run_request, plan, max_workers)):
+        reduced_by_row.update(zip(positions, reduced))
+    return _rows_to_dfs(rows, row_bands, reduced_by_row, **kwargs)
+
+
+def extract_many(layers, gee_features, kind, reducer_type=None, batch_size=100, max_workers=None, stack_requests=True, stack_size=None, cache=None, **kwargs):
+    """
+    Extract data for many sites at once. Sites are reduced together with reduceRegions over an ee.FeatureCollection of up to batch_size sites,
+    so the number of GEE requests scales with the number of layers and batches instead of layers x sites.
+
+    Args:
+        layers (str or :obj:`df`): see extract().
+        gee_features (list of :obj:`gee feature`): GEE features for the site geometries. All sites should be the same kind.
+        kind (str): 'point', 'watershed' or 'shape'
+        reducer_type (:obj:`GEE reducer function`): see extract().
+        batch_size (int, optional): (default 100) maximum number of sites in one request.
+        max_workers (int, optional): see extract().
+        stack_requests (bool, optional): see extract().
+        stack_size (int, optional): see extract().
+        cache (:obj:`ExtractionCache` or bool, optional): see extract(). Sites that have every asset of a request in the cache are left out of that request.
+        **kwargs: see extract().
+
+    Returns:
+        list of (:obj:`df`, :obj:`df`): for each site (in the order of gee_features), the daily and non-daily long dataframes as returned by extract().
+    """
+    layers, rows, row_bands, specs = _prepare_layers(layers)
+    reducer_type = get_reducer(kind, reducer_type)
+    cache = resolve_cache(cache)
+    if cache is None:
+        cache = False
+    if stack_requests:
+        plan = plan_requests(layers, stack_size)
+    else:
+        plan = [(row.scale, [position]) for position, row in enumerate(rows)]
+    batches = [list(range(i, min(i + batch_size, len(gee_features))))
+               for i in range(0, len(gee_features), batch_size)]
+
+    def run_request(request):
+        (scale, positions), sites = request
+        names = [str(rows[position].name) for position in positions]
+        print('Extracting', ', '.join(names), 'for sites', sites[0], 'to', sites[-1])
+        with instrument.stage('gee:' + ','.join(names)):
+            unique, index = _unique_specs(specs, positions)
+            reduced = request_stacked_regions([gee_features[site] for site in sites], reducer_type, scale, unique, cache)
+            reduced = [[reduced_site[i] for i in index] for reduced_site in reduced]
+            instrument.count(rows=sum(len(reducer_dict or {}) for reduced_site in reduced for reducer_dict, time_start in reduced_site))
+        return reduced
+
+    requests = [(request, sites) for request in plan for sites in batches]
+    reduced_by_site = [{} for feature in gee_features]
+    for ((scale, positions), sites), reduced in zip(requests, _map(run_request, requests, max_workers)):
+        for site, reduced_site in zip(sites, reduced):
+            reduced_by_site[site].update(zip(positions, reduced_site))
+    return [_rows_to_dfs(rows, row_bands, reduced_by_row, **kwargs) for reduced_by_row in reduced_by_site]
@@ -0,0 +1,177 @@
+import contextlib
+import json
+import threading
+import time
+from contextvars import ContextVar
+
+import pandas as pd
+
+# Counters kept for each stage, besides seconds and count (the number of times the stage ran)
+COUNTERS = ['remote_calls', 'bytes', 'rows', 'cache_hits', 'cache_misses']
+
+# Stage for counts made outside of any stage
+OTHER = 'other'
+
+_recorder = ContextVar('waterpyk_recorder', default=None)
+_stage = ContextVar('waterpyk_stage', default=None)
+
+
+class Recorder:
+    """
+    Wall time and I/O of each stage of a pipeline (such as location, gee requests, nwis, make_wide_df, deficit, wateryear and save):
+    seconds, count (times the stage ran), remote_calls, bytes (received from remote services), rows (processed or returned),
+    cache_hits and cache_misses. Made by recording(). Stage times include the time of stages run inside them, and counts go to the innermost stage.
+
+    Args:
+        parent (:obj:`Recorder`, optional): (default None) recorder that also gets everything recorded here, such as the recorder of a whole batch.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.stages = {}
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds=0.0, count=0, **counters):
+        """Add wall time and counters (see COUNTERS) to a stage."""
+        with self._lock:
+            totals = self.stages.setdefault(stage, {'seconds': 0.0, 'count': 0, **{counter: 0 for counter in COUNTERS}})
+            totals['seconds'] += seconds
+            totals['count'] += count
+            for counter, value in counters.items():
+                totals[counter] += value
+        if self.parent is not None:
+            self.parent.add(stage, seconds, count, **counters)
+
+    def totals(self):
+        """Sum of each counter (see COUNTERS) over all stages, as a dict."""
+        with self._lock:
+            return {counter: sum(totals[counter] for totals in self.stages.values()) for counter in COUNTERS}
+
+    def to_dict(self):
+        """
+        Get everything recorded as a dict: {'seconds': total wall time, 'totals': totals(), 'stages': {stage: {'seconds', 'count', 'remote_calls', ...}}}.
+        """
+        with self._lock:
+            stages = {stage: {**totals, 'seconds': round(totals['seconds'], 6)} for stage, totals in self.stages.items()}
+        return {'seconds': round(self.seconds, 6), 'totals': self.totals(), 'stages': stages}
+
+    def to_json(self, **kwargs):
+        """Get to_dict() as a json string. kwargs are passed to json.dumps()."""
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def report(self):
+        """Get a one-line description, such as '3.21 seconds (location 0.52 s, gee:pml 2.1 s, deficit 0.01 s; 3 remote calls, 1.2 MB, 2 cache hits)'."""
+        with self._lock:
+            stages = ', '.join(f'{stage} {totals["seconds"]:.3g} s' for stage, totals in self.stages.items() if totals['count'] > 0)
+        totals = self.totals()
+        io = f"{totals['remote_calls']} remote calls, {totals['bytes'] / 1e6:.3g} MB, {totals['cache_hits']} cache hits"
+        return f'{round(self.seconds, 3)} seconds ({stages}; {io})' if stages else f'{round(self.seconds, 3)} seconds'
+
+    def __repr__(self):
+        return f'Recorder({self.report()})'
+
+
+@contextlib.contextmanager
+def recording(recorder=None):
+    """
+    Record the stages run inside the with block (in this thread, its asyncio tasks and the thread pools of waterpyk).
+    A recording inside another one also adds everything to the outer one.
+
+    Example:
+        with instrument.recording() as recorder:
+            ...
+        recorder.to_dict()
+
+    Args:
+        recorder (:obj:`Recorder`, optional): (default None, which makes a new one) recorder to continue, such as one site's recorder when its stages are run at different times.
+
+    Yields:
+        :obj:`Recorder`
+    """
+    if recorder is None:
+        recorder = Recorder(parent=_recorder.get())
+    token = _recorder.set(recorder)
+    stage_token = _stage.set(None)
+    t1 = time.perf_counter()
+    try:
+        yield recorder
+    finally:
+        recorder.seconds += time.perf_counter() - t1
+        _stage.reset(stage_token)
+        _recorder.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time the with block as a stage of the current recording. Does nothing if nothing is being recorded.
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        yield
+        return
+    token = _stage.set(name)
+    t1 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+        recorder.add(name, time.perf_counter() - t1, 1)
+
+
+def count(**counters):
+    """
+    Add counters (remote_calls, bytes, rows, cache_hits or cache_misses) to the current stage. Does nothing if nothing is being recorded.
+    """
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.add(_stage.get() or OTHER, **counters)
+
+
+def wrap(func):
+    """
+    Make func record into the current recording and stage when it is called in another thread (such as in a thread pool).
+    """
+    if _recorder.get() is None:
+        return func
+    context = _recorder, _recorder.get(), _stage, _stage.get()
+
+    def run(*args, **kwargs):
+        recorder_var, recorder, stage_var, stage_name = context
+        recorder_token = recorder_var.set(recorder)
+        stage_token = stage_var.set(stage_name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stage_var.reset(stage_token)
+            recorder_var.reset(recorder_token)
+    return run
+
+
+def aggregate(records):
+    """
+    Add up many recordings (such as the instrumentation of every site of a batch) stage by stage.
+
+    Args:
+        records (list of dict): outputs of Recorder.to_dict(). None entries are skipped.
+
+    Returns:
+        :obj:`df`: one row per stage, sorted by time, with columns stage, sites (number of recordings with the stage), seconds,
+        share (of the total recorded time; stages run inside other stages, such as gee requests inside location, are counted in both, so shares can add up to more than 1),
+        count and the COUNTERS.
+    """
+    rows = {}
+    total_seconds = 0.0
+    for record in records:
+        if not record:
+            continue
+        total_seconds += record['seconds']
+        for name, totals in record['stages'].items():
+            row = rows.setdefault(name, {'stage': name, 'sites': 0, 'seconds': 0.0, 'count': 0, **{counter: 0 for counter in COUNTERS}})
+            row['sites'] += 1
+            for key in ['seconds', 'count'] + COUNTERS:
+                row[key] += totals[key]
+    df = pd.DataFrame(list(rows.values()), columns=['stage', 'sites', 'seconds', 'count'] + COUNTERS)
+    df.insert(3, 'share', df['seconds'] / total_seconds if total_seconds > 0 else 0.0)
+    return df.sort_values('seconds', ascending=False, ignore_index=True)
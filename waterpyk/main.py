@@ -1,29 +1,99 @@
+import json
 import os
 import random
 import warnings
-from time import time
 
-import ee
-import geopandas as gpd
 import pandas as pd
 
-from waterpyk import calcs  # Determine default saving behavior
-from waterpyk import (default_saving_dir, gee, in_colab_shell, load_data,
-                      plots, watershed)
-
-ee.Initialize()
+from waterpyk import calcs
+from waterpyk import (gee, get_default_saving_dir, in_colab_shell, instrument,
+                      load_data, storage, watershed)
+from waterpyk.deficitstate import DeficitState
+from waterpyk.earthengine import ee
+from waterpyk.sitedata import SiteData
 
 
 warnings.filterwarnings("ignore")
 
+# Dataframes saved in the site folder, by attribute name
+SAVED_DATAFRAMES = ['daily_data', 'daily_df_wide', 'stats',
+                    'streamflow', 'deficit_timeseries', 'wateryear_totals']
+
+
+def _json_default(value):
+    """Make numpy numbers and timestamps json serializable."""
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def _timed(stage, func, /, *args, **kwargs):
+    """Run func as a stage of the instrument recording, counting the rows of the dataframe it returns (the first one, for a tuple)."""
+    with instrument.stage(stage):
+        result = func(*args, **kwargs)
+        df = result[0] if isinstance(result, tuple) else result
+        instrument.count(rows=len(df))
+    return result
+
+
+class _SavedDataframe:
+    """
+    StudyArea attribute for a saved dataframe that is read from the site folder the first time it is used, and kept after that.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, study_area, owner=None):
+        if study_area is None:
+            return self
+        try:
+            df = self.read(study_area)
+        except (FileNotFoundError, AttributeError):
+            raise AttributeError(f"'StudyArea' has no {self.name}: data was not extracted or saved yet.")
+        study_area.__dict__[self.name] = df
+        return df
+
+    def read(self, study_area):
+        return study_area.read_saved(self.name)
+
+
+class _SavedSiteData(_SavedDataframe):
+    """
+    StudyArea attribute for the saved daily data, read as a SiteData. Folders saved by earlier versions have daily_df_long instead, which is converted.
+    """
+
+    def read(self, study_area):
+        try:
+            return SiteData.from_frame(study_area.read_saved(self.name))
+        except FileNotFoundError:
+            return SiteData.from_long(study_area.read_saved('daily_df_long'))
+
 
 class StudyArea:
 
+    # Saved dataframes are loaded on first use
+    daily_data = _SavedSiteData('daily_data')
+    daily_df_wide = _SavedDataframe('daily_df_wide')
+    stats = _SavedDataframe('stats')
+    streamflow = _SavedDataframe('streamflow')
+    deficit_timeseries = _SavedDataframe('deficit_timeseries')
+    wateryear_totals = _SavedDataframe('wateryear_totals')
+
+    @property
+    def daily_df_long(self):
+        """
+        Daily data in the long format (date, asset_name, value and band columns), made from daily_data each time it is used.
+        """
+        return self.daily_data.to_long()
+
     def get_layers(self, layers):
         """
         Return a df with the layers (ie asset list and metadata) being used.
         """
-        if layers == 'all' or layers == 'minimal':
+        if isinstance(layers, str) and layers in ['all', 'minimal']:
             layers = gee.load_data(layers)
         return layers
 
@@ -64,6 +134,7 @@ class StudyArea:
                 site_name + '. CRS = EPSG:4326.'
             gee_feature = ee.Feature(ee.Geometry.Point(long, lat))
             gp_site = pd.DataFrame({'longitude': [long], 'latitude': [lat]})
+            import geopandas as gpd  # slow to import, so only imported when needed
             gpd_geometry = gpd.points_from_xy(
                 gp_site.longitude, gp_site.latitude, crs="EPSG:4326")
 
@@ -91,15 +162,36 @@ class StudyArea:
 
         return self, gee_feature
 
+    def get_latitude(self):
+        """
+        Get the latitude of the site [decimal degrees] for calculating PET: the latitude of a point, or the centroid of a watershed or shape.
+        """
+        if self.kind == 'point':
+            return float(self.coords[0])
+        if self.kind == 'watershed':
+            return float(watershed.extract_latitude(self.coords[0]))
+        centroids = self.gpd_geometry.to_crs('epsg:6933').centroid.to_crs('epsg:4326')
+        return float(centroids.y.mean())
+
+    def _with_latitude(self, daily_data, kwargs):
+        """Add the latitude of the site to kwargs if it is not given and the temperature bands for PET were extracted."""
+        temperatures = [(kwargs.get('ppt_asset', 'prism'), kwargs.get(band, default)) for band, default in [('tmin_band', 'tmin'), ('tmax_band', 'tmax')]]
+        if kwargs.get('latitude') is None and kwargs.get('calculate_PET', True) and all(column in daily_data for column in temperatures):
+            return {**kwargs, 'latitude': self.get_latitude()}
+        return kwargs
+
     def get_data(self, layers, **kwargs):
         """
         Updates self with attributes containing dataframes for the site.
         If data already exists in saving_dir, data is simply loaded.
         Otherwise, data from layers is extracted from GEE and the USGS.
+        The time and I/O of each stage (location, gee requests, nwis, make_wide_df, deficit, wateryear, save and load) are kept in
+        self.instrumentation as a dict (see instrument.Recorder.to_dict()).
 
         Args:
             layers (str or :obj:`df`, optional): If str, specify 'minimal' or 'all' to extract default set of assets. If df, columns that must be present include: asset_id, start_date, end_date, relative_date, scale, bands, bands_to_scale, new_bandnames, scaling factor. These are the same parameters required for extract_basic(). 
             **interp (bool, optional): (default: True), currently no option to change to False.
+            **interp_method (str, optional): (default: 'linear') daily interpolation method, 'linear', 'nearest' or 'step'.
             **combine_ET_bands (bool, optional): (default True) add ET bands to make one ET band.
             **bands_to_combine (list of str, optional): (default [Es, Ec]) ET bands to combine
             **band_names_combined (str, optional): (default 'ET') name of combined ET band
@@ -107,37 +199,39 @@ class StudyArea:
             **et_band (str, optional): band name to be used for creation of ET column (default 'ET').
             **ppt_asset (str, optional): asset name for precipitation column (default 'prism').
             **ppt_band (str, optional): band name for precipitation colum (default 'ppt')
+            **ei_band (str, optional): band name of the ET asset for the interception (Ei) column (default 'Ei').
+            **pivot_all (bool, optional): (default True) add a column to daily_df_wide for every other asset and band.
+            **column_names (str or function, optional): (default '{asset_name}_{band}') names of the other columns of daily_df_wide, see calcs.column_name().
+            **derived_columns (dict, optional): (default {'P_min_Ei': 'P - Ei'}) columns added to daily_df_wide, see calcs.make_wide_df().
+            **wateryear_start_month (int, optional): (default 10) first month of the wateryear, such as 4 for Southern Hemisphere sites. See calcs.wateryear_of().
+            **seasons (dict, optional): (default {'summer': [6, 7, 8, 9]}) seasons as {name: list of months} for the seasonal wateryear totals (such as ET_summer), see calcs.wateryear().
+            **calculate_PET (bool, optional): (default True) add daily PET (Hargreaves) to daily_df_wide and wateryear_totals when prism tmin and tmax were extracted, see calcs.hargreaves_pet().
+            **latitude (float, optional): (default None, which uses get_latitude()) latitude for PET [decimal degrees].
             **snow_asset (str, optional): defaults to 'modis_snow'
             **snow_band (str, optional): defaults to 'snow'. Note: You will need to change this if you don't specify to change the default name of this asset upon extraction.
             **snow_correction (bool, optional): (default True) use snow correction factor when calculating deficit
             **snow_frac (int, optional): (default 10) set all ET when snow is greater than this (%) to 0 if snow_correction = True
+            **max_workers (int, optional): (default None) number of GEE requests to make at the same time. None makes them one at a time.
+            **stack_requests (bool, optional): (default True) stack assets with the same scale into a single GEE request.
+            **stack_size (int, optional): (default None) maximum number of assets stacked into one request.
+            **chunk_by (str or int, optional): (default None) request timeseries in windows of one wateryear ('wateryear') or N images (int) instead of all at once.
+            **cache (:obj:`ExtractionCache` or bool, optional): (default None) cache for raw GEE output, so assets already extracted for the same geometry and dates are not requested again. None uses cache.get_default_cache() and False turns off caching.
+            **extend_cached (bool, optional): (default True) if data already exists and layers are given, request only the data after the saved end date of each timeseries (see extend()).
+            **storage (str or :obj:`Storage`, optional): (default 'parquet') file format for saving the site data: 'parquet', 'feather' or 'csv'. See the storage module. Use export_csv() to also get csv files.
 
         """
-        if in_colab_shell():
-            path_format = '_'
-        else:
-            path_format = '/'
-
         # If data already exists, just pull it in:
         if os.path.exists(self.saving_path):
             print('\nRetrieving site data from ' +
                   os.path.abspath(self.saving_path))
-            self.daily_df_long = pd.read_csv(
-                self.saving_path + path_format + 'daily_df_long.csv')
-            self.daily_df_wide = pd.read_csv(
-                self.saving_path + path_format + 'daily_df_wide.csv')
-            self.stats = pd.read_csv(
-                self.saving_path + path_format + 'stats.csv')
-            self.streamflow = pd.read_csv(
-                self.saving_path + path_format + 'streamflow.csv')
-            self.deficit_timeseries = pd.read_csv(
-                self.saving_path + path_format + 'deficit_timeseries.csv')
-            self.wateryear_totals = pd.read_csv(
-                self.saving_path + path_format + 'wateryear_totals.csv')
-            self.smax = round(self.deficit_timeseries.D.max())
-            self.maxdmax = round(self.deficit_timeseries.D_wy.max())
-            self.deficit_timerange = (
-                self.deficit_timeseries.date.min(), self.deficit_timeseries.date.max())
+            # Dataframes are only read when they are first used (see _SavedDataframe)
+            for name in SAVED_DATAFRAMES:
+                self.__dict__.pop(name, None)
+            self._read_metadata()
+
+            # Request any data published since the site was saved
+            if layers is not None and kwargs.get('extend_cached', True):
+                self.extend(layers, **kwargs)
 
         # Otherwise, use layers.csv to download new data and save it:
         else:
@@ -151,55 +245,283 @@ class StudyArea:
                 StudyArea.get_location(self, **kwargs)
                 df_long, df_image = gee.extract(
                     layers, self.gee_feature, self.kind, **kwargs)
+            self.process_data(df_long, df_image, layers=layers, **kwargs)
+
+    def process_data(self, df_long, df_image, df_streamflow=None, layers=None, **kwargs):
+        """
+        Calculate the wide, deficit, streamflow and wateryear dataframes from extracted GEE data, save them at saving_path and add them as attributes.
 
-            # Convert dataframe to wide format using **kwargs
-            df_wide = calcs.make_wide_df(df_long, **kwargs)
+        Args:
+            df_long (:obj:`df` or :obj:`SiteData`): daily long-form dataframe, as returned by gee.extract()
+            df_image (:obj:`df`): non-daily long-form dataframe, as returned by gee.extract()
+            df_streamflow (:obj:`df`, optional): (default None) streamflow of a watershed that was already downloaded (for example by watershed.extract_streamflow_many()).
+                None downloads it with watershed.extract_streamflow().
+            layers (str or :obj:`df`, optional): (default None) layers the data was extracted with, so extend() knows the end date requested for each timeseries.
+            **kwargs: see get_data()
+        """
+        # Keep the daily data in the compact form
+        daily_data = SiteData.from_long(df_long)
+
+        # Convert dataframe to wide format using **kwargs (with PET if temperatures were extracted)
+        kwargs = self._with_latitude(daily_data, kwargs)
+        df_wide = _timed('make_wide_df', calcs.make_wide_df, daily_data, **kwargs)
 
-            # If deficit data types are given, merge deficit data
-            df_deficit = calcs.deficit(df_long, df_wide, **kwargs)
-            df_deficit_min = df_deficit.date.min()
-            df_deficit_max = df_deficit.date.max()
-            df_wide = calcs.merge(df_wide, df_deficit, 'deficit')
+        # If deficit data types are given, merge deficit data
+        df_deficit = _timed('deficit', calcs.deficit, daily_data, df_wide, **kwargs)
+        df_wide = calcs.merge(df_wide, df_deficit, 'deficit')
+
+        # If kind = watershed, get and merge streamflow data
+        if self.kind == 'watershed':
+            if df_streamflow is None:
+                df_streamflow = _timed('nwis', watershed.extract_streamflow, self.coords[0], **kwargs)
+            df_wide = calcs.merge(df_wide, df_streamflow, 'streamflow')
+        else:
+            df_streamflow = pd.DataFrame()
 
-            # If kind = watershed, get and merge streamflow data
-            if self.kind == 'watershed':
-                gage = self.coords[0]
-                df_streamflow = watershed.extract_streamflow(gage, **kwargs)
-                df_wide = calcs.merge(df_wide, df_streamflow, 'streamflow')
+        # Create wateryear cumulative and total dataframes
+        df_wide, df_total = _timed('wateryear', calcs.wateryear, df_wide, **kwargs)
+
+        # Add all attributes to self and save them
+        self._set_data(daily_data, df_wide, df_image, df_streamflow, df_deficit, df_total, self._requested_ends(layers))
+        self._save()
+
+    def _requested_ends(self, layers):
+        """
+        End date requested for each timeseries of layers, as kept in the metadata for extend().
+        Dates after today are replaced by today, because the images after it were not published when the data was requested.
+        """
+        if layers is None:
+            return {}
+        ends = {}
+        for row in self.get_layers(layers).to_dict('records'):
+            if pd.isnull(row['relative_date']):
+                ends[str(row['name'])] = str(min(pd.to_datetime(row['end_date']), gee.today()).date())
+        return ends
+
+    def extend(self, layers, end_date=None, overlap_days=32, **kwargs):
+        """
+        Extend saved data to a later end date without extracting the whole record again.
+        Only the missing tail of each timeseries is requested from GEE (and from the USGS for watersheds): the timeseries whose end date
+        is after the end date they were last requested with (today, if that was earlier than their end date).
+        Timeseries of folders that do not know their requested end date are extended if their data ends more than a day before their end date.
+        The deficit is continued from the saved D and D_wy on the day before the new data, and only the wateryears that changed are recalculated.
+        Called by get_data() when saved data is loaded and layers are given.
+
+        Args:
+            layers (str or :obj:`df`): see get_data(). Timeseries rows are extended to their end_date.
+            end_date (str, optional): (default None) end date for all timeseries and streamflow instead of the end_date column of layers and flow_end_date.
+            overlap_days (int, optional): (default 32) the tail is requested from this many days before the saved end of each timeseries,
+                so that days interpolated after the last saved image are interpolated again with the new images. Should be at least the time between images.
+            **kwargs: see get_data()
+
+        Returns:
+            bool: True if any new data was added.
+        """
+        kwargs = {**self.settings, **kwargs}
+        overlap = pd.Timedelta(days=overlap_days)
+        timeseries_end = self.metadata['timeseries_end']
+        requested_end = self.metadata.get('timeseries_requested_end', {})
+
+        # Find timeseries that end before the requested end date and request them from shortly before their saved end
+        tail_layers = []
+        for row in self.get_layers(layers).to_dict('records'):
+            if not pd.isnull(row['relative_date']):
+                continue
+            row_end = pd.to_datetime(end_date or row['end_date'])
+            saved_end = pd.to_datetime(timeseries_end.get(str(row['name'])))
+            # Composites (such as 8-day or monthly images) end before the requested end date, so compare with the requested end if it is known
+            requested = pd.to_datetime(requested_end.get(str(row['name'])))
+            if pd.isnull(requested):
+                outdated = pd.isnull(saved_end) or saved_end < row_end - pd.Timedelta(days=1)
             else:
-                df_streamflow = pd.DataFrame()
+                outdated = row_end > requested
+            if not outdated:
+                continue
+            if not pd.isnull(saved_end):
+                row['start_date'] = str(max(saved_end - overlap, pd.to_datetime(row['start_date'])).date())
+            row['end_date'] = str(row_end.date())
+            tail_layers.append(row)
+
+        # Request new streamflow from the day after the saved streamflow ends
+        df_streamflow_new = pd.DataFrame()
+        if self.kind == 'watershed':
+            flow_end = pd.to_datetime(end_date or kwargs['flow_end_date'])
+            flow_start = pd.to_datetime(self.metadata['streamflow_end']) + pd.Timedelta(days=1)
+            if flow_start < flow_end:
+                df_streamflow_new = _timed('nwis', watershed.extract_streamflow,
+                    self.coords[0], **{**kwargs, 'flow_start_date': str(flow_start.date()), 'flow_end_date': str(flow_end.date())})
+
+        if len(tail_layers) == 0 and len(df_streamflow_new) == 0:
+            print('\nSaved data is up to date.')
+            return False
+
+        # Only now read the saved dataframes
+        daily_data = self.daily_data
+        df_streamflow = pd.concat([self.streamflow, df_streamflow_new], ignore_index=True)
+
+        # Replace each timeseries from its first new date on
+        changed = []
+        if len(tail_layers) > 0:
+            print('\nExtending', ', '.join(str(row['name']) for row in tail_layers))
+            df_new, df_image = gee.extract(pd.DataFrame(tail_layers), self.gee_feature, self.kind, **kwargs)
+            data_new = SiteData.from_long(df_new)
+            daily_data = daily_data.update(data_new)
+            changed.append(data_new.values.index.min())
+        if len(df_streamflow_new) > 0:
+            changed.append(df_streamflow_new['date'].min())
+        first_changed = min(changed)
+        kwargs = self._with_latitude(daily_data, kwargs)
+
+        # Continue the deficit from the day before the first new date
+        df_deficit = self.deficit_timeseries
+        df_deficit_kept = df_deficit[df_deficit['date'] < first_changed]
+        if len(df_deficit_kept) > 0:
+            last = df_deficit_kept.iloc[-1]
+            carry = (last['D'], last['D_wy'], last['wateryear'])
+        else:
+            carry = None
+        data_tail = daily_data.since(first_changed)
+        df_deficit_tail = _timed('deficit', calcs.deficit, data_tail, _timed('make_wide_df', calcs.make_wide_df, data_tail, **kwargs),
+                                 **{**kwargs, 'carry': carry})
+        df_deficit = pd.concat([df_deficit_kept, df_deficit_tail], ignore_index=True)
+
+        # Recalculate the wide dataframe and wateryear totals for the wateryears that changed
+        start_month = kwargs.get('wateryear_start_month', 10)
+        first_wateryear = calcs.wateryear_of([first_changed], start_month)[0]
+        df_wide_tail = _timed('make_wide_df', calcs.make_wide_df, daily_data.since(calcs.wateryear_start(first_wateryear, start_month)), **kwargs)
+        df_wide_tail = calcs.merge(df_wide_tail, df_deficit, 'deficit')
+        if self.kind == 'watershed':
+            df_wide_tail = calcs.merge(df_wide_tail, df_streamflow, 'streamflow')
+        df_wide_tail, df_total_tail = _timed('wateryear', calcs.wateryear, df_wide_tail, **kwargs)
+        df_wide = self.daily_df_wide
+        df_wide = pd.concat([df_wide[df_wide['wateryear'] < first_wateryear], df_wide_tail], ignore_index=True)
+        df_total = self.wateryear_totals.reset_index(drop=True)
+        df_total = pd.concat([df_total[df_total['wateryear'] < first_wateryear].set_index('wateryear', drop=False),
+                              df_total_tail])
+
+        requested_end = {**requested_end, **self._requested_ends(pd.DataFrame(tail_layers))}
+        self._set_data(daily_data, df_wide, self.stats, df_streamflow, df_deficit, df_total, requested_end)
+        self._save()
+        return True
+
+    def _set_data(self, daily_data, df_wide, df_image, df_streamflow, df_deficit, df_total, requested_end=None):
+        """Add the daily data, the dataframes and the deficit parameters calculated from them as attributes."""
+        self.daily_data = daily_data
+        self.daily_df_wide = df_wide
+        self.stats = df_image
+        self.streamflow = df_streamflow
+        self.deficit_timeseries = df_deficit
+        self.wateryear_totals = df_total
+        self._set_metadata({
+            'smax': round(df_deficit.D.max()),
+            'maxdmax': round(df_deficit.D_wy.max()),
+            'MAP': round(df_total.P.mean()),
+            'deficit_timerange': (df_deficit.date.min(), df_deficit.date.max()),
+            'timeseries_end': daily_data.end_dates(),
+            'timeseries_requested_end': requested_end or {},
+            'streamflow_end': df_streamflow['date'].max() if 'date' in df_streamflow else None})
+
+    def _set_metadata(self, metadata):
+        """Set the metadata dict (scalar summaries saved in metadata.json) and the smax, maxdmax, MAP and deficit_timerange attributes."""
+        metadata['deficit_timerange'] = tuple(pd.to_datetime(date) for date in metadata['deficit_timerange'])
+        self.metadata = metadata
+        self.smax = metadata['smax']
+        self.maxdmax = metadata['maxdmax']
+        self.MAP = metadata['MAP']
+        self.deficit_timerange = metadata['deficit_timerange']
+
+    def _read_metadata(self):
+        """
+        Set the scalar summaries from metadata.json without reading any dataframe.
+        For folders saved before metadata.json existed, they are calculated from only the columns they need, and metadata.json is written.
+        """
+        path = self._file_path('metadata') + '.json'
+        if os.path.exists(path):
+            with open(path) as f:
+                self._set_metadata(json.load(f))
+            return
+        df_deficit = self.read_saved('deficit_timeseries', columns=['date', 'D', 'D_wy'])
+        df_streamflow = self.read_saved('streamflow')
+        self._set_metadata({
+            'smax': round(df_deficit.D.max()),
+            'maxdmax': round(df_deficit.D_wy.max()),
+            'MAP': round(self.read_saved('wateryear_totals', columns=['P']).P.mean()),
+            'deficit_timerange': (df_deficit.date.min(), df_deficit.date.max()),
+            'timeseries_end': self.daily_data.end_dates(),
+            'streamflow_end': df_streamflow['date'].max() if 'date' in df_streamflow else None})
+        self._write_metadata()
+
+    def _write_metadata(self):
+        with open(self._file_path('metadata') + '.json', 'w') as f:
+            json.dump(self.metadata, f, default=_json_default, indent=2)
+
+    def _save(self):
+        """Save all dataframes at saving_path (next to it in Google Colab) with the storage backend in settings."""
+        print("\nSaving all dataframes at:\n\t% s" %
+              os.path.abspath(self.saving_path))
+        if in_colab_shell() == False:
+            os.makedirs(self.saving_path, exist_ok=True)
+        backend = storage.get_storage(self.settings.get('storage', 'parquet'))
+        with instrument.stage('save'):
+            for name in SAVED_DATAFRAMES:
+                df = self._saved_frame(name)
+                backend.write(df, self._file_path(name))
+                instrument.count(rows=len(df))
+            self._write_metadata()
+
+        # Folders saved by earlier versions have the daily data in the long format, which daily_data replaces
+        for name in storage.STORAGES:
+            old = storage.get_storage(name)
+            if old.exists(self._file_path('daily_df_long')):
+                os.remove(old.path(self._file_path('daily_df_long')))
+
+    def _saved_frame(self, name):
+        """The dataframe saved for an attribute in SAVED_DATAFRAMES (daily_data is saved with one column per timeseries, see SiteData.to_frame())."""
+        df = getattr(self, name)
+        if isinstance(df, SiteData):
+            df = df.to_frame()
+        return df
+
+    def read_saved(self, name, columns=None):
+        """
+        Read a saved dataframe of the site. Folders saved in another format than the storage setting (such as csv files from earlier versions) are read too.
+
+        Args:
+            name (str): one of 'daily_data', 'daily_df_wide', 'stats', 'streamflow', 'deficit_timeseries' or 'wateryear_totals'.
+            columns (list of str, optional): (default None) only read these columns, which is much faster for parquet and feather. None reads all columns.
 
-            # Create wateryear cumulative and total dataframes
-            df_wide, df_total = calcs.wateryear(df_wide)
+        Returns:
+            :obj:`df`
+        """
+        backend = storage.find(self._file_path(name), self.settings.get('storage', 'parquet'))
+        if backend is None:
+            raise FileNotFoundError(f'No {name} saved at {self.saving_path}.')
+        return _timed('load', backend.read, self._file_path(name), columns)
 
-            # Save data (just long df for GoogleColab and all data otherwise)
-            print("\nSaving all dataframes at:\n\t% s" %
-                  os.path.abspath(self.saving_path))
-            if in_colab_shell() == False:
-                os.mkdir(self.saving_path)
-            with open(self.saving_path + path_format + 'daily_df_long.csv', 'w') as f:
-                df_long.to_csv(f)
-            with open(self.saving_path + path_format + 'daily_df_wide.csv', 'w') as f:
-                df_wide.to_csv(f)
-            with open(self.saving_path + path_format + 'streamflow.csv', 'w') as f:
-                df_streamflow.to_csv(f)
-            with open(self.saving_path + path_format + 'deficit_timeseries.csv', 'w') as f:
-                df_deficit.to_csv(f)
-            with open(self.saving_path + path_format + 'wateryear_totals.csv', 'w') as f:
-                df_total.to_csv(f)
-            with open(self.saving_path + path_format + 'stats.csv', 'w') as f:
-                df_image.to_csv(f)
-
-            # Add all attributes to self
-            self.daily_df_long = df_long
-            self.daily_df_wide = df_wide
-            self.stats = df_image
-            self.streamflow = df_streamflow
-            self.deficit_timeseries = df_deficit
-            self.wateryear_totals = df_total
-            self.smax = round(df_deficit.D.max())
-            self.maxdmax = round(df_deficit.D_wy.max())
-            self.deficit_timerange = (df_deficit_min, df_deficit_max)
+    def export_csv(self, folder=None):
+        """
+        Save all dataframes of the site as csv files, for example to open them in a spreadsheet.
+
+        Args:
+            folder (str, optional): (default None) folder for the csv files. None saves them in the site folder, next to the saved data.
+        """
+        if folder is None:
+            folder = self.saving_path
+        os.makedirs(folder, exist_ok=True)
+        backend = storage.CSVStorage()
+        for name in SAVED_DATAFRAMES:
+            backend.write(self._saved_frame(name), os.path.join(folder, name))
+        print('\nSaved csv files at:\n\t% s' % os.path.abspath(folder))
+
+    def deficit_state(self):
+        """
+        Get the current deficit of the site as a DeficitState, to continue it with new daily data without recalculating the whole record.
+
+        Returns:
+            :obj:`DeficitState`
+        """
+        kwargs = {key: self.settings[key] for key in ['snow_correction', 'snow_frac', 'wateryear_start_month'] if key in self.settings}
+        return DeficitState.from_deficit(self.deficit_timeseries, sites=[self.site_name], **kwargs)
 
     def describe(self):
         """
@@ -208,7 +530,7 @@ class StudyArea:
         """
         print('\n' + str(self.description))
         print('Geometry kind:', self.kind)
-        print('Data extracted from GEE:', self.daily_df_long.band.unique())
+        print('Data extracted from GEE:', self.daily_data.bands)
         print('GEE reducer used: MEAN() for watersheds and FIRST() for points')
         print('Data available for wateryear totals:',
               list(self.wateryear_totals))
@@ -257,6 +579,7 @@ class StudyArea:
             **title (str, optional): default None
 
         """
+        from waterpyk import plots  # matplotlib and seaborn are slow to import, so only imported when plotting
         if kind == 'timeseries':
             fig = plots.plot_timeseries(self, **kwargs)
         elif kind == 'spearman':
@@ -291,16 +614,31 @@ class StudyArea:
         self.saving_path = saving_path
         return saving_path
 
+    def _file_path(self, file_name):
+        """Path of a saved dataframe (without extension). In Google Colab, files are saved next to (not inside) the site folder."""
+        if in_colab_shell():
+            return self.saving_path + '_' + file_name
+        return os.path.join(self.saving_path, file_name)
+
     def __str__(self):
         return f'StudyArea({self.kind}), named {self.site_name}'
 
     def __repr__(self):
         return f"StudyArea(kind='{self.kind}', name={self.site_name})"
 
-    def __init__(self, coords, layers=None, saving_dir=default_saving_dir, **kwargs):
+    def __init__(self, coords, layers=None, saving_dir=None, **kwargs):
+        with instrument.recording() as recorder:
+            self._setup(coords, layers, saving_dir, **kwargs)
+            self.get_data(layers, **self.settings)
+        self.instrumentation = recorder.to_dict()
+        print('\nTime to access data: ' + recorder.report())
+
+    def _setup(self, coords, layers=None, saving_dir=None, **kwargs):
+        """Set settings, kind, location and saving path (everything except getting the data)."""
         default_kwargs = {
             'site_name': '',
             'interp': True,
+            'interp_method': 'linear',
             'combine_ET_bands': True,
             'bands_to_combine': ['Es', 'Ec'],
             'band_name_final': 'ET',
@@ -313,23 +651,155 @@ class StudyArea:
             'snow_correction': True,
             'snow_frac': 10,
             'flow_start_date': '1980-10-01',
-            'flow_end_date': '2021-10-01'
+            'flow_end_date': '2021-10-01',
+            'max_workers': None,
+            'stack_requests': True,
+            'stack_size': None,
+            'chunk_by': None,
+            'cache': None,
+            'extend_cached': True,
+            'storage': 'parquet'
         }
         kwargs = {**default_kwargs, **kwargs}
         self.settings = kwargs
         self.coords = coords
         self.layers = layers
+        if saving_dir is None:
+            saving_dir = get_default_saving_dir()
         self.saving_dir = saving_dir
-        if layers == 'all' or layers == 'minimal':
+        if isinstance(layers, str) and layers in ['all', 'minimal']:
             extracted_df = load_data(layers)
             self.extracted_df = extracted_df
         else:
             self.extracted_df = layers
         self.get_kind()
-        self.get_location(**kwargs)
+        with instrument.stage('location'):
+            self.get_location(**kwargs)
         self._path()
-        t1 = time()
-        self.get_data(layers, **kwargs)
-        t2 = time()
-        print('\nTime to access data: ' + str(round(t2-t1, 3)) + ' seconds')
-        self.MAP = round(self.wateryear_totals.P.mean())
+        return self
+
+    @classmethod
+    def from_extracted(cls, coords, df_long, df_image, layers=None, saving_dir=None, **kwargs):
+        """
+        Make a StudyArea from data that was already extracted from GEE (for example by gee.extract_many()), without extracting it again.
+
+        Args:
+            coords: see StudyArea.
+            df_long (:obj:`df`): daily long-form dataframe, as returned by gee.extract()
+            df_image (:obj:`df`): non-daily long-form dataframe, as returned by gee.extract()
+            layers (str or :obj:`df`, optional): layers used for the extraction.
+            saving_dir (str, optional): see StudyArea.
+            **kwargs: see get_data()
+
+        Returns:
+            :obj:`StudyArea`
+        """
+        self = cls.__new__(cls)
+        with instrument.recording() as recorder:
+            self._setup(coords, layers, saving_dir, **kwargs)
+            self.process_data(df_long, df_image, layers=layers, **self.settings)
+        self.instrumentation = recorder.to_dict()
+        return self
+
+
+class StudyAreaCollection:
+    """
+    Many StudyAreas extracted together. Sites that are not already saved are extracted from GEE in batches with gee.extract_many(),
+    so each request returns data for up to batch_size sites. The streamflow of gages is downloaded with watershed.extract_streamflow_many(), up to 100 gages per request.
+    The post-processing (deficit, streamflow, wateryear totals) is then done per site.
+
+    Args:
+        sites (list or :obj:`gdf`): a list of USGS gage IDs (watersheds), a list of [lat, long] pairs (points), or a geodataframe with one row per shape.
+        layers (str or :obj:`df`, optional): see StudyArea.
+        saving_dir (str, optional): see StudyArea.
+        batch_size (int, optional): (default 100) maximum number of sites in one GEE request.
+        name_column (str, optional): for a geodataframe, the column with site names (used for folder names). Default None, in which case sites are named shape_0, shape_1, etc.
+        **kwargs: see StudyArea.get_data()
+
+    The time and I/O of the whole run are kept in self.instrumentation, and those of each site in its StudyArea.instrumentation
+    (the requests shared by many sites, such as gee.extract_many() and the multi-site NWIS requests, are only in self.instrumentation).
+    """
+
+    def __init__(self, sites, layers=None, saving_dir=None, batch_size=100, name_column=None, **kwargs):
+        if saving_dir is None:
+            saving_dir = get_default_saving_dir()
+        self.layers = layers
+        self.saving_dir = saving_dir
+        self.study_areas = []
+        pending = []
+        recorders = {}
+        with instrument.recording() as recorder:
+            for coords, site_kwargs in self._site_coords(sites, name_column):
+                site_kwargs = {**kwargs, **site_kwargs}
+                study_area = StudyArea.__new__(StudyArea)
+                with instrument.recording() as site_recorder:
+                    study_area._setup(coords, layers, saving_dir, **site_kwargs)
+                    if os.path.exists(study_area.saving_path):
+                        study_area.get_data(layers, **study_area.settings)
+                    else:
+                        pending.append(study_area)
+                recorders[id(study_area)] = site_recorder
+                self.study_areas.append(study_area)
+
+            # Extract the remaining sites in batches, one group per kind (the reducer depends on the kind)
+            for kind in ['point', 'watershed', 'shape']:
+                group = [study_area for study_area in pending if study_area.kind == kind]
+                if len(group) == 0:
+                    continue
+                settings = group[0].settings
+                streamflow = {}
+                if kind == 'watershed':
+                    # Get the streamflow of all gages with a few multi-site NWIS requests instead of one per gage
+                    with instrument.stage('nwis_many'):
+                        streamflow = watershed.extract_streamflow_many([study_area.coords[0] for study_area in group], **settings)
+                extracted = gee.extract_many(layers, [study_area.gee_feature for study_area in group],
+                                             kind, batch_size=batch_size, **settings)
+                for study_area, (df_long, df_image) in zip(group, extracted):
+                    # Use the downloaded streamflow directly: the GageClients keeping it may be dropped for large groups (see watershed.get_client())
+                    df_streamflow = streamflow.get(watershed.format_gage(study_area.coords[0])) if kind == 'watershed' else None
+                    with instrument.recording(recorders[id(study_area)]):
+                        study_area.process_data(df_long, df_image, df_streamflow, layers=layers, **study_area.settings)
+        for study_area in self.study_areas:
+            study_area.instrumentation = recorders[id(study_area)].to_dict()
+        self.instrumentation = recorder.to_dict()
+        print('\nTime to access ' + str(len(self.study_areas)) + ' sites (' + str(len(pending)) + ' extracted): ' + recorder.report())
+
+    @staticmethod
+    def _site_coords(sites, name_column=None):
+        """Get (coords, kwargs) for each site in the form StudyArea takes them."""
+        if hasattr(sites, 'geometry'):
+            for i in range(len(sites)):
+                if name_column is None:
+                    site_name = 'shape_' + str(i)
+                else:
+                    site_name = str(sites[name_column].iloc[i])
+                yield sites.iloc[[i]], {'site_name': site_name}
+        else:
+            for site in sites:
+                if isinstance(site, (list, tuple)):
+                    yield list(site), {}
+                else:
+                    yield [site], {}
+
+    def summary(self):
+        """
+        Get a dataframe with one row per site and columns for site_name, kind, smax, maxdmax and MAP.
+        """
+        return pd.DataFrame({
+            'site_name': [study_area.site_name for study_area in self.study_areas],
+            'kind': [study_area.kind for study_area in self.study_areas],
+            'smax': [study_area.smax for study_area in self.study_areas],
+            'maxdmax': [study_area.maxdmax for study_area in self.study_areas],
+            'MAP': [study_area.MAP for study_area in self.study_areas]})
+
+    def __iter__(self):
+        return iter(self.study_areas)
+
+    def __len__(self):
+        return len(self.study_areas)
+
+    def __getitem__(self, i):
+        return self.study_areas[i]
+
+    def __repr__(self):
+        return f"StudyAreaCollection({len(self)} sites)"
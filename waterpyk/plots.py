@@ -103,17 +103,20 @@ def plot_timeseries(studyareaobject = None, df_daily_wide = None, deficit_timese
         **figsize (tuple, optional): default = (6,4)
         **legend (bool, optional): default = True
         **title (str, optional): default = None
+        **plot_PET (bool, optional): default = False. Cumulative wateryear PET, if prism tmin and tmax were extracted.
         **plot_Q (bool, optional): default = False
         **plot_P (bool, optional): default = True
         **plot_D (bool, optional): default = True
         **plot_Dwy (bool, optional): default = True
         **plot_ET (bool, optional): default = False
         **plot_ET_dry (bool, optional): default = False
+        **color_PET (str, optional): default = 'red'
         **color_Q (str, optional): default = 'blue'
         **color_P (str, optional): default = '#b1d6f0'
         **color_D (str, optional): default = 'black'
         **color_Dwy (str, optional): default = 'black'
         **color_ET (str, optional): default = 'purple'
+        **linestyle_PET (str, optional): default = '-'
         **linestyle_Q (str, optional): default = '-'
         **linestyle_P (str, optional): default = '-'
         **linestyle_D (str, optional): default = '-'
@@ -147,7 +150,10 @@ def plot_timeseries(studyareaobject = None, df_daily_wide = None, deficit_timese
         if studyareaobject.kind == 'watershed':
             ax.plot(df_wy['date'], df_wy['Q_mm_cumulative'], plot_kwargs['linestyle_Q'], color=plot_kwargs['color_Q'], lw = plot_kwargs['lw'], label= 'Q (mm)')
     if plot_kwargs['plot_PET']:
-        ax.plot(df_wy['date'], df_wy['PET_cumulative'], plot_kwargs['linestyle_PET'], color=plot_kwargs['color_PET'], lw = plot_kwargs['lw'], label= 'PET (mm)') 
+        if 'PET_cumulative' in df_wy:
+            ax.plot(df_wy['date'], df_wy['PET_cumulative'], plot_kwargs['linestyle_PET'], color=plot_kwargs['color_PET'], lw = plot_kwargs['lw'], label= 'PET (mm)')
+        else:
+            print('PET is not available: prism tmin and tmax must be extracted to calculate it.')
     if plot_kwargs['plot_P']:
         ax.fill_between(df_wy['date'], 0, df_wy['P_cumulative'],color='#b1d6f0', label='P (mm)', alpha = 0.7)
     if plot_kwargs['plot_ET']:
@@ -181,15 +187,18 @@ def plot_wateryear_totals(studyareaobject = None, df_wateryear_totals = None, **
         **figsize (tuple, optional): default = (6,4)
         **legend (bool, optional): default = True
         **title (str, optional): default = None
+        **plot_PET (bool, optional): default = False. Wateryear PET, if prism tmin and tmax were extracted.
         **plot_Q (bool, optional): default = True
         **plot_P (bool, optional): default = True
         **plot_D (bool, optional): default = True
         **plot_ET (bool, optional): default = True
         **plot_ET_dry (bool, optional): default = False
+        **color_PET (str, optional): default = 'red'
         **color_Q (str, optional): default = 'blue'
         **color_P (str, optional): default = '#b1d6f0'
         **color_D (str, optional): default = 'black'
         **color_ET (str, optional): default = 'purple'
+        **linestyle_PET (str, optional): default = '-'
         **linestyle_Q (str, optional): default = '-o'
         **linestyle_P (str, optional): default = '-o'
         **linestyle_D (str, optional): default = '-'
@@ -227,8 +236,10 @@ def plot_wateryear_totals(studyareaobject = None, df_wateryear_totals = None, **
         
     fig, ax = plt.subplots(dpi=plot_kwargs['dpi'], figsize = plot_kwargs['figsize'])
     if plot_kwargs['plot_PET']:
-        print('Plotting PET!')
-        ax.plot(df['wateryear'], df['PET'], plot_kwargs['linestyle_PET'], color = plot_kwargs['color_PET'], lw = plot_kwargs['lw'], markeredgecolor = plot_kwargs['markeredgecolor'], label = r'$\mathrm{PET}_{wy}\/\mathrm{(mm)}$')
+        if 'PET' in df:
+            ax.plot(df['wateryear'], df['PET'], plot_kwargs['linestyle_PET'], color = plot_kwargs['color_PET'], lw = plot_kwargs['lw'], markeredgecolor = plot_kwargs['markeredgecolor'], label = r'$\mathrm{PET}_{wy}\/\mathrm{(mm)}$')
+        else:
+            print('PET is not available: prism tmin and tmax must be extracted to calculate it.')
     if plot_kwargs['plot_P']:
         ax.plot(df['wateryear'], df['P'], plot_kwargs['linestyle_P'], color = plot_kwargs['color_P'], lw = plot_kwargs['lw'], markeredgecolor = plot_kwargs['markeredgecolor'], label = r'$\mathrm{P}_{wy}\/\mathrm{(mm)}$')
     if plot_kwargs['plot_Q']:
@@ -0,0 +1,211 @@
+import csv
+import io
+
+import pandas as pd
+
+# Default number of rows parsed at a time
+CHUNKSIZE = 100_000
+
+# Number of characters read from the stream at a time
+BLOCKSIZE = 1 << 20
+
+
+def parse_format(format_line):
+    """
+    Parse the format line of an RDB file (the line after the header), such as '5s\\t15s\\t20d\\t14n\\t10s'.
+
+    Returns:
+        list of str: type of each column: 's' (string), 'd' (date) or 'n' (numeric).
+    """
+    return [field.strip()[-1:].lower() or 's' for field in format_line.rstrip('\r\n').split('\t')]
+
+
+def _open(source):
+    """Get a text stream and whether it should be closed after reading."""
+    if isinstance(source, (bytes, bytearray)):
+        return io.TextIOWrapper(io.BytesIO(source), encoding='utf-8'), True
+    if isinstance(source, str) or hasattr(source, '__fspath__'):
+        return open(source, 'r', encoding='utf-8'), True
+    if isinstance(source, io.TextIOBase):
+        return source, False
+    return io.TextIOWrapper(source, encoding='utf-8'), False
+
+
+def _to_datetime(values):
+    """Parse a date column: daily values are plain dates, other services (such as instantaneous values) also give a time."""
+    try:
+        return pd.to_datetime(values, format='%Y-%m-%d')
+    except ValueError:
+        return pd.to_datetime(values)
+
+
+def _parse_chunk(pieces, columns, formats):
+    # Strings are read as categories and dates and numbers as objects, which is faster than pandas strings
+    dtype = {col: 'category' if kind == 's' else object for col, kind in zip(columns, formats)}
+    df = pd.read_csv(io.StringIO(''.join(pieces)), sep='\t', header=None, names=columns, dtype=dtype,
+                     keep_default_na=False, na_values=[''], quoting=csv.QUOTE_NONE, engine='c')
+    for col, kind in zip(columns, formats):
+        if kind == 'n':
+            # Non-numeric entries are qualifiers (such as 'Ice', 'Eqp' or 'Ssn'): keep them in their own column
+            values = pd.to_numeric(df[col], errors='coerce')
+            df[col + '_qualifier'] = df[col].where(values.isna()).astype('category')
+            df[col] = values.astype('float64')
+        elif kind == 'd':
+            df[col] = _to_datetime(df[col])
+    return df
+
+
+def _blocks(stream):
+    """Read the stream in blocks that end at the end of a line."""
+    rest = ''
+    while True:
+        block = stream.read(BLOCKSIZE)
+        if not block:
+            if rest:
+                yield rest if rest.endswith('\n') else rest + '\n'
+            return
+        block = rest + block
+        end = block.rfind('\n') + 1
+        if end == 0:
+            rest = block
+            continue
+        rest = block[end:]
+        yield block[:end]
+
+
+def iter_rdb(source, chunksize=CHUNKSIZE):
+    """
+    Parse an RDB file (the tab-separated format of USGS NWIS) in chunks, so large responses are never held in memory as one table.
+    Comment lines (starting with '#') are skipped and each section's header and format line give the column names and types:
+    numeric columns are float64 and their non-numeric entries (qualifiers such as 'Ice' or 'Eqp') are NaN, with the qualifier in a
+    column named after the numeric column plus '_qualifier'. Date columns are datetime64 and string columns are categorical.
+    Responses for several sites, where each site has its own comments, header and format line, are supported: a chunk never mixes sections.
+
+    Args:
+        source (bytes, str or file): content of the file, path to the file, or an open (text or binary) file.
+        chunksize (int, optional): (default 100000) maximum number of rows in each chunk.
+
+    Returns:
+        iterator of :obj:`df`
+    """
+    stream, close = _open(source)
+    try:
+        columns = formats = None
+        expect = 'header'
+        pieces, n_rows = [], 0
+
+        def flush():
+            df = _parse_chunk(pieces, columns, formats)
+            for i in range(0, len(df), chunksize):
+                yield df.iloc[i:i + chunksize].reset_index(drop=True)
+
+        for block in _blocks(stream):
+            pos = 0
+            while pos < len(block):
+                if expect == 'data' and block[pos] != '#':
+                    # Data runs until the next comment line, which starts the next section
+                    end = block.find('\n#', pos) + 1 or len(block)
+                    pieces.append(block[pos:end])
+                    n_rows += block.count('\n', pos, end)
+                    pos = end
+                    if n_rows >= chunksize:
+                        yield from flush()
+                        pieces, n_rows = [], 0
+                    continue
+                end = block.index('\n', pos) + 1
+                line = block[pos:end]
+                pos = end
+                if line.startswith('#'):
+                    if pieces:
+                        yield from flush()
+                        pieces, n_rows = [], 0
+                    expect = 'header'
+                elif not line.strip():
+                    continue
+                elif expect == 'header':
+                    columns = line.rstrip('\r\n').split('\t')
+                    expect = 'format'
+                elif expect == 'format':
+                    formats = parse_format(line)
+                    if len(formats) != len(columns):
+                        raise ValueError(f'RDB format line has {len(formats)} fields but the header has {len(columns)} columns.')
+                    expect = 'data'
+        if pieces:
+            yield from flush()
+    finally:
+        if close:
+            stream.close()
+
+
+def concat(chunks):
+    """
+    Concatenate chunks from iter_rdb() or iter_daily_values(), keeping categorical columns categorical even when the chunks have different categories.
+
+    Returns:
+        :obj:`df`: empty if there are no chunks.
+    """
+    if len(chunks) == 0:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        return chunks[0]
+    categorical = {col for chunk in chunks for col in chunk if isinstance(chunk[col].dtype, pd.CategoricalDtype)}
+    df = pd.concat(chunks, ignore_index=True)
+    for col in categorical:
+        df[col] = df[col].astype('category')
+    return df
+
+
+def read_rdb(source, chunksize=CHUNKSIZE):
+    """
+    Read an RDB file into one dataframe, see iter_rdb() for how it is parsed.
+
+    Args:
+        source (bytes, str or file): content of the file, path to the file, or an open (text or binary) file.
+        chunksize (int, optional): (default 100000) number of rows parsed at a time.
+
+    Returns:
+        :obj:`df`: empty if the file has no data.
+    """
+    return concat(list(iter_rdb(source, chunksize)))
+
+
+def iter_daily_values(source, parameter='00060', statistic='00003', name='Q_cfs', chunksize=CHUNKSIZE):
+    """
+    Parse an NWIS daily values RDB file in chunks, keeping one parameter and statistic (by default mean discharge).
+    Each chunk has the columns site_no, date, name (float), name + '_cd' (the NWIS qualification code, such as 'A' for approved or 'P' for provisional)
+    and name + '_qualifier' (the text given instead of a value, such as 'Ice', otherwise NaN).
+    Sections of sites without the parameter are skipped. If a site has several time series of the parameter, the first one is used.
+
+    Args:
+        source (bytes, str or file): content of the file, path to the file, or an open (text or binary) file.
+        parameter (str, optional): (default '00060') USGS parameter code. '00060' is discharge in cfs.
+        statistic (str, optional): (default '00003') USGS statistic code. '00003' is the daily mean.
+        name (str, optional): (default 'Q_cfs') name for the value column.
+        chunksize (int, optional): (default 100000) maximum number of rows in each chunk.
+
+    Returns:
+        iterator of :obj:`df`
+    """
+    suffix = f'_{parameter}_{statistic}'
+    for chunk in iter_rdb(source, chunksize):
+        value_cols = [col for col in chunk if col.endswith(suffix)]
+        if len(value_cols) == 0:
+            continue
+        col = value_cols[0]
+        df = pd.DataFrame({'site_no': chunk['site_no'], 'date': chunk['datetime'], name: chunk[col]})
+        df[name + '_cd'] = chunk[col + '_cd'] if col + '_cd' in chunk else pd.Categorical([None] * len(chunk))
+        df[name + '_qualifier'] = chunk[col + '_qualifier']
+        yield df
+
+
+def read_daily_values(source, parameter='00060', statistic='00003', name='Q_cfs', chunksize=CHUNKSIZE):
+    """
+    Read an NWIS daily values RDB file into one dataframe, see iter_daily_values().
+
+    Returns:
+        :obj:`df`: with columns site_no, date, name, name + '_cd' and name + '_qualifier' (empty if the file has no data).
+    """
+    df = concat(list(iter_daily_values(source, parameter, statistic, name, chunksize)))
+    if len(df.columns) == 0:
+        df = pd.DataFrame(columns=['site_no', 'date', name, name + '_cd', name + '_qualifier'])
+    return df
@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+
+# Separator of asset_name and band in the column names of to_frame()
+SEPARATOR = '/'
+
+
+class SiteData:
+    """
+    Compact daily data of one site: a float64 array with one row per date and one column per (asset_name, band),
+    instead of the long format where every value carries its date, asset_name and band.
+    Each column covers the dates from its first to its last value, so to_long() gives back the long format
+    (date, asset_name, value, band) with categorical asset_name and band.
+
+    Args:
+        values (:obj:`df`): float dataframe indexed by date, with (asset_name, band) column MultiIndex. Use from_long() to make one from a long dataframe.
+    """
+
+    def __init__(self, values):
+        values.index = pd.DatetimeIndex(values.index, name='date')
+        columns = list(values.columns)
+        values.columns = pd.MultiIndex.from_arrays([[column[0] for column in columns], [column[1] for column in columns]],
+                                                   names=['asset_name', 'band'])
+        self.values = values.astype('float64')
+
+    @classmethod
+    def from_long(cls, df_long):
+        """
+        Make a SiteData from a long dataframe with date, asset_name, value and band columns (such as from gee.extract()).
+        Columns keep the order in which asset_name and band first appear. If a date appears twice for the same asset_name and band, the first value is kept.
+
+        Returns:
+            :obj:`SiteData`
+        """
+        if isinstance(df_long, SiteData):
+            return df_long
+        if len(df_long) == 0:
+            return cls(pd.DataFrame(index=pd.DatetimeIndex([]), columns=[]))
+        # Number each (asset_name, band) pair in order of first appearance
+        asset_codes, asset_names = pd.factorize(df_long['asset_name'])
+        band_codes, bands = pd.factorize(df_long['band'])
+        col, pairs = pd.factorize(asset_codes * len(bands) + band_codes)
+        pairs = [(str(asset_names[pair // len(bands)]), str(bands[pair % len(bands)])) for pair in pairs]
+        dates = df_long['date']
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates)
+        dates, row = np.unique(dates.to_numpy(), return_inverse=True)
+        grid = np.full((len(dates), len(pairs)), np.nan)
+        # Assign in reverse so the first of duplicate values is the one kept
+        grid[row[::-1], col[::-1]] = df_long['value'].to_numpy(dtype=float)[::-1]
+        return cls(pd.DataFrame(grid, index=dates, columns=pairs))
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Make a SiteData from the flat dataframe of to_frame() (a date column and one 'asset_name/band' column per timeseries), as saved in site folders.
+
+        Returns:
+            :obj:`SiteData`
+        """
+        df = df.set_index('date')
+        df.columns = [tuple(name.rsplit(SEPARATOR, 1)) for name in df.columns]
+        return cls(df)
+
+    def to_frame(self):
+        """
+        Get a flat dataframe with a date column and one float column per timeseries, named 'asset_name/band'. Used for saving.
+        """
+        df = self.values.copy()
+        df.columns = [asset_name + SEPARATOR + band for asset_name, band in df.columns]
+        return df.reset_index()
+
+    def _ranges(self):
+        """First and last row of each column with a value (first > last if the column has no values)."""
+        valid = ~np.isnan(self.values.to_numpy())
+        if len(valid) == 0:
+            return np.zeros(valid.shape[1], dtype=int), np.full(valid.shape[1], -1)
+        first = valid.argmax(axis=0)
+        last = len(valid) - 1 - valid[::-1].argmax(axis=0)
+        first[~valid.any(axis=0)] = len(valid)
+        return first, last
+
+    def to_long(self):
+        """
+        Get the long format: columns date, asset_name (categorical), value and band (categorical), with one row per day
+        from the first to the last value of each timeseries, ordered by timeseries and then date.
+
+        Returns:
+            :obj:`df`
+        """
+        values = self.values.to_numpy()
+        first, last = self._ranges()
+        lengths = np.maximum(last - first + 1, 0)
+        rows = np.concatenate([np.arange(start, end + 1) for start, end in zip(first, last)] or [np.zeros(0, dtype=int)])
+        cols = np.repeat(np.arange(values.shape[1]), lengths)
+        asset_names = self.values.columns.get_level_values('asset_name')
+        bands = self.values.columns.get_level_values('band')
+        return pd.DataFrame({
+            'date': self.values.index[rows],
+            'asset_name': pd.Categorical(asset_names[cols], categories=asset_names.unique()),
+            'value': values[rows, cols],
+            'band': pd.Categorical(bands[cols], categories=bands.unique())})
+
+    def info(self):
+        """
+        Get a dataframe with one row per timeseries: asset_name and band (categorical), start and end date, and the number of days with a value.
+        """
+        first, last = self._ranges()
+        has_values = first <= last
+        dates = pd.Series(self.values.index.append(pd.DatetimeIndex([pd.NaT])))
+        return pd.DataFrame({
+            'asset_name': pd.Categorical(self.values.columns.get_level_values('asset_name')),
+            'band': pd.Categorical(self.values.columns.get_level_values('band')),
+            'start': dates.iloc[np.where(has_values, first, -1)].to_numpy(),
+            'end': dates.iloc[np.where(has_values, last, -1)].to_numpy(),
+            'count': self.values.notna().sum().to_numpy()})
+
+    def get(self, asset_name, band):
+        """
+        Get one timeseries as a float series indexed by date, from its first to its last value.
+
+        Raises:
+            KeyError: if the site has no such asset_name and band.
+        """
+        series = self.values[(asset_name, band)]
+        valid = series.notna().to_numpy()
+        if not valid.any():
+            return series.iloc[:0].rename('value')
+        first = valid.argmax()
+        last = len(valid) - 1 - valid[::-1].argmax()
+        return series.iloc[first:last + 1].rename('value')
+
+    def select(self, asset_name, band):
+        """
+        Get one timeseries in the long format (date, asset_name, value, band). Empty if the site has no such asset_name and band.
+        """
+        if (asset_name, band) in self:
+            series = self.get(asset_name, band)
+        else:
+            series = pd.Series(dtype=float, index=pd.DatetimeIndex([], name='date'), name='value')
+        return pd.DataFrame({'date': series.index, 'asset_name': asset_name, 'value': series.to_numpy(), 'band': band})
+
+    def since(self, start):
+        """
+        Get the data on and after start (date).
+
+        Returns:
+            :obj:`SiteData`
+        """
+        return SiteData(self.values[self.values.index >= pd.to_datetime(start)].copy())
+
+    def update(self, other):
+        """
+        Replace each timeseries in other from its first value on, keeping the earlier values of self (as when extending saved data).
+        Timeseries that are not in self are added.
+
+        Args:
+            other (:obj:`SiteData` or :obj:`df`): new data, as SiteData or in the long format.
+
+        Returns:
+            :obj:`SiteData`: a new SiteData.
+        """
+        other = SiteData.from_long(other)
+        index = self.values.index.union(other.values.index)
+        columns = self.values.columns.append(other.values.columns.difference(self.values.columns, sort=False))
+        values = self.values.reindex(index=index, columns=columns)
+        for column in other.values.columns:
+            new = other.get(*column)
+            if len(new) == 0:
+                continue
+            after = values.index >= new.index[0]
+            values.loc[after, column] = new.reindex(values.index[after]).to_numpy()
+        return SiteData(values)
+
+    def end_dates(self):
+        """Get the last date with a value of each asset_name, as a dict."""
+        info = self.info()
+        return info.groupby('asset_name', observed=True, sort=False)['end'].max().to_dict()
+
+    @property
+    def asset_names(self):
+        """List of asset names."""
+        return list(self.values.columns.get_level_values('asset_name').unique())
+
+    @property
+    def bands(self):
+        """List of band names."""
+        return list(self.values.columns.get_level_values('band').unique())
+
+    def memory_usage(self):
+        """Memory used by the data in bytes."""
+        return int(self.values.memory_usage(deep=True).sum())
+
+    def __contains__(self, column):
+        return tuple(column) in self.values.columns
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return f'SiteData({len(self.values)} days, {self.values.shape[1]} timeseries: {self.asset_names})'
@@ -0,0 +1,152 @@
+import os
+import uuid
+
+import pandas as pd
+
+
+class Storage:
+    """
+    Base class for the file format of the dataframes saved in a site folder. Subclasses set extension and implement _write() and _read().
+    Paths are given without extension, for example os.path.join(saving_path, 'daily_df_long').
+    """
+    extension = None
+
+    def path(self, path):
+        """Path of the file for path (without extension)."""
+        return path + self.extension
+
+    def exists(self, path):
+        """Whether a dataframe was saved at path (without extension) in this format."""
+        return os.path.exists(self.path(path))
+
+    def write(self, df, path):
+        """
+        Save df at path (without extension). The index is not saved. The file is written to a temporary file first, so an interrupted write never leaves a broken file behind.
+        """
+        df = df.reset_index(drop=True)
+        temp_path = self.path(path) + '.' + uuid.uuid4().hex + '.tmp'
+        try:
+            self._write(df, temp_path)
+            os.replace(temp_path, self.path(path))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def read(self, path, columns=None):
+        """
+        Read the dataframe saved at path (without extension).
+
+        Args:
+            path (str): path without extension.
+            columns (list of str, optional): (default None) only read these columns. None reads all columns.
+
+        Returns:
+            :obj:`df`
+        """
+        return self._read(self.path(path), columns)
+
+    def _write(self, df, file_path):
+        raise NotImplementedError
+
+    def _read(self, file_path, columns):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f'{type(self).__name__}()'
+
+
+class ParquetStorage(Storage):
+    """
+    Compressed, typed columnar storage with Apache Parquet (needs pyarrow). This is the default.
+
+    Args:
+        compression (str, optional): (default 'zstd') parquet compression codec, such as 'zstd', 'snappy' or None.
+    """
+    extension = '.parquet'
+
+    def __init__(self, compression='zstd'):
+        self.compression = compression
+
+    def _write(self, df, file_path):
+        df.to_parquet(file_path, compression=self.compression, index=False)
+
+    def _read(self, file_path, columns):
+        return pd.read_parquet(file_path, columns=columns)
+
+
+class FeatherStorage(Storage):
+    """
+    Compressed, typed columnar storage with Apache Arrow Feather files (needs pyarrow). Faster to read than parquet, but larger.
+
+    Args:
+        compression (str, optional): (default 'zstd') 'zstd', 'lz4' or 'uncompressed'.
+    """
+    extension = '.feather'
+
+    def __init__(self, compression='zstd'):
+        self.compression = compression
+
+    def _write(self, df, file_path):
+        df.to_feather(file_path, compression=self.compression)
+
+    def _read(self, file_path, columns):
+        return pd.read_feather(file_path, columns=columns)
+
+
+class CSVStorage(Storage):
+    """
+    Plain csv files. Reading also works for site folders saved as csv by earlier versions of waterpyk: the saved index column is dropped and dates are parsed.
+    """
+    extension = '.csv'
+
+    def _write(self, df, file_path):
+        df.to_csv(file_path, index=False)
+
+    def _read(self, file_path, columns):
+        try:
+            df = pd.read_csv(file_path)
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame()
+        # Older files have the index as the first column (and wateryear totals have the wateryear column twice)
+        df = df.drop(columns=[col for col in df if str(col).startswith('Unnamed:') or col == 'wateryear.1'])
+        if 'date' in df:
+            df['date'] = pd.to_datetime(df['date'])
+        if columns is not None:
+            df = df[columns]
+        return df
+
+
+STORAGES = {'parquet': ParquetStorage, 'feather': FeatherStorage, 'csv': CSVStorage}
+
+
+def get_storage(storage='parquet'):
+    """
+    Get a storage backend.
+
+    Args:
+        storage (str or :obj:`Storage`, optional): (default 'parquet') 'parquet', 'feather' or 'csv', or a Storage instance (returned as is).
+
+    Returns:
+        :obj:`Storage`
+    """
+    if isinstance(storage, Storage):
+        return storage
+    if storage not in STORAGES:
+        raise ValueError(f"Storage not recognized. Got {storage}, expected one of {list(STORAGES)}.")
+    return STORAGES[storage]()
+
+
+def find(path, storage='parquet'):
+    """
+    Get the storage backend that a dataframe was saved with at path (without extension), trying storage first and then the other formats.
+    This lets site folders saved in an older format (such as csv) still be read.
+
+    Returns:
+        :obj:`Storage` or None if nothing was saved at path.
+    """
+    storage = get_storage(storage)
+    candidates = [storage] + [get_storage(name) for name in STORAGES if not isinstance(storage, STORAGES[name])]
+    for candidate in candidates:
+        if candidate.exists(path):
+            return candidate
+    return None
@@ -1,29 +1,62 @@
 import json
-import urllib
+import threading
 import warnings
+from functools import lru_cache
+from urllib.parse import parse_qs, urlparse
 
-import ee
-import geopandas as gpd
-import numpy as np
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import waterpyk.errors as err
-from waterpyk.calcs import combine_bands, interp_daily
+from waterpyk import instrument, rdb
+from waterpyk.cache import resolve as resolve_cache
+from waterpyk.earthengine import ee
 
-ee.Initialize()
+# geopandas is slow to import, so it is imported by the functions that use it
 
 
-def extract_urls(gage, **kwargs):
+# USGS services
+NLDI_URL = 'https://labs.waterdata.usgs.gov/api/nldi/linked-data/nwissite/'
+NWIS_DV_URL = 'https://waterdata.usgs.gov/nwis/dv'
+NWIS_DV_SERVICE_URL = 'https://waterservices.usgs.gov/nwis/dv/'
+
+# Default dates of discharge
+FLOW_DATES = {'flow_start_date': '1980-10-01', 'flow_end_date': '2021-10-01'}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
     """
-    Return relevant urls for a USGS gage.
+    Get the requests session shared by all USGS requests. It keeps connections to the NLDI and NWIS servers open between requests
+    (up to 16 per host, for requests made from several threads) and retries failed requests with exponential backoff.
+
+    Returns:
+        :obj:`requests.Session`
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+            _session = requests.Session()
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+    return _session
+
+
+def format_gage(gage):
+    """
+    Get a USGS gage ID as an 8-character string, adding leading 0s if needed.
 
     Args:
-        gage (:obj:`str` or :obj:`int`): USGS 8-number gage ID. If int, leading 0s will automatically be added.
-        **flow_start_date (str, optional): default: '1980-10-01'
-        **flow_end_date (str, optional): default: '2021-10-01'
+        gage (str or int): USGS gage ID.
 
     Returns:
-        str, str, str, str: 4 strings with urls which (1) access basin lat/long geometry. (2) access geometry of flowline (i.e. rivers) lat/long geometry. (3) access basin metadata. (4) access basin discharge timeseries (between the dates of **kwargs).
+        str: 8-character gage ID.
     """
     gage = str(gage)
 
@@ -38,25 +71,241 @@ def extract_urls(gage, **kwargs):
             f'WARNING: Gage ID length is {len(gage)}. Zeros will be added to begginning until length = 8.')
         num = 8 - len(gage)
         gage = '0' * num + gage
+    return gage
+
+
+def extract_urls(gage, **kwargs):
+    """
+    Return relevant urls for a USGS gage.
 
-    # Default start_date and end_date kwargs
-    default_kwargs = {
-        'flow_start_date': '1980-10-01',
-        'flow_end_date': '2021-10-01',
-    }
-    kwargs = {**default_kwargs, **kwargs}
+    Args:
+        gage (:obj:`str` or :obj:`int`): USGS 8-number gage ID. If int, leading 0s will automatically be added.
+        **flow_start_date (str, optional): default: '1980-10-01'
+        **flow_end_date (str, optional): default: '2021-10-01'
+
+    Returns:
+        str, str, str, str: 4 strings with urls which (1) access basin lat/long geometry. (2) access geometry of flowline (i.e. rivers) lat/long geometry. (3) access basin metadata. (4) access basin discharge timeseries (between the dates of **kwargs).
+    """
+    gage = format_gage(gage)
+
+    kwargs = {**FLOW_DATES, **kwargs}
 
     # Data URLs
-    url_basin_geometry = 'https://labs.waterdata.usgs.gov/api/nldi/linked-data/nwissite/USGS-%s/basin?f=json' % gage
-    url_flow_geometry = 'https://labs.waterdata.usgs.gov/api/nldi/linked-data/nwissite/USGS-%s/navigation/UM/flowlines?f=json&distance=1000' % gage
-    url_metadata = "https://labs.waterdata.usgs.gov/api/nldi/linked-data/nwissite/USGS-%s/?f=json" % gage
-    url_flow = 'https://waterdata.usgs.gov/nwis/dv?cb_00060=on&format=rdb&site_no=' + gage + \
+    url_basin_geometry = NLDI_URL + 'USGS-%s/basin?f=json' % gage
+    url_flow_geometry = NLDI_URL + 'USGS-%s/navigation/UM/flowlines?f=json&distance=1000' % gage
+    url_metadata = NLDI_URL + 'USGS-%s/?f=json' % gage
+    url_flow = NWIS_DV_URL + '?cb_00060=on&format=rdb&site_no=' + gage + \
         '&referred_module=sw&period=&begin_date=' + \
         kwargs['flow_start_date'] + '&end_date=' + kwargs['flow_end_date']
 
     return url_basin_geometry, url_flow_geometry, url_metadata, url_flow
 
 
+def extract_streamflow_url(gages, **kwargs):
+    """
+    Return the url of the NWIS daily values service for the discharge of several gages in one request.
+
+    Args:
+        gages (list of str or int): USGS gage IDs (at most 100, the limit of the service).
+        **flow_start_date (str, optional): default: '1980-10-01'
+        **flow_end_date (str, optional): default: '2021-10-01'
+
+    Returns:
+        str
+    """
+    kwargs = {**FLOW_DATES, **kwargs}
+    sites = ','.join(format_gage(gage) for gage in gages)
+    return NWIS_DV_SERVICE_URL + '?format=rdb&sites=' + sites + '&parameterCd=00060&statCd=00003&siteStatus=all' + \
+        '&startDT=' + kwargs['flow_start_date'] + '&endDT=' + kwargs['flow_end_date']
+
+
+def usgs_cache_key(cache, url):
+    """Key of a USGS resource in an ExtractionCache."""
+    return cache.key(source='usgs', url=url)
+
+
+def is_cacheable(url):
+    """
+    Whether a USGS resource can be kept in the persistent cache. NLDI resources (geometry and metadata) always can.
+    NWIS discharge can only if its end date is in the past, because discharge for recent days is still being added.
+    """
+    if not url.startswith((NWIS_DV_URL, NWIS_DV_SERVICE_URL)):
+        return True
+    query = parse_qs(urlparse(url).query)
+    end_date = query.get('end_date', query.get('endDT', ['']))[0]
+    try:
+        return pd.Timestamp(end_date) < pd.Timestamp.now().normalize()
+    except ValueError:
+        return False
+
+
+class GageClient:
+    """
+    Client for the USGS data of one gage: NLDI basin geometry, flowlines and metadata, and NWIS daily discharge.
+    Each resource is downloaded at most once and kept in memory, and all requests go through the pooled session from get_session(),
+    so getting the geometry, name, drainage area, latitude and streamflow of a watershed downloads the basin only once.
+    Use get_client() to share one client per gage.
+
+    Args:
+        gage (str or int): USGS 8-number gage ID. If int, leading 0s will automatically be added.
+        session (:obj:`requests.Session`, optional): (default None) session for the requests. None uses get_session().
+        timeout (float, optional): (default 60) timeout in seconds for each request.
+        cache (:obj:`ExtractionCache` or bool, optional): (default None) persistent cache for downloaded resources (such as one filled by bulk.fetch_gages()).
+            None uses cache.get_default_cache() and False keeps resources in memory only. See is_cacheable() for what is stored.
+    """
+
+    def __init__(self, gage, session=None, timeout=60, cache=None):
+        self.gage = format_gage(gage)
+        self.session = session
+        self.timeout = timeout
+        self.cache = cache
+        self._responses = {}
+        self._parsed = {}
+        self._lock = threading.RLock()
+
+    def get(self, url):
+        """
+        Get the content of url, from memory, then from the persistent cache, and only then from the USGS.
+
+        Returns:
+            bytes
+        """
+        with self._lock:
+            if url not in self._responses:
+                self._responses[url] = _download(url, self.session, self.timeout, self.cache)
+            return self._responses[url]
+
+    def add_response(self, url, content):
+        """Keep content (bytes) downloaded elsewhere (such as by bulk.fetch_gages()) as the response for url."""
+        with self._lock:
+            self._responses[url] = content
+
+    def _memoize(self, key, func):
+        with self._lock:
+            if key not in self._parsed:
+                self._parsed[key] = func()
+            return self._parsed[key]
+
+    def urls(self, **kwargs):
+        """The 4 urls of the gage, see extract_urls()."""
+        return extract_urls(self.gage, **kwargs)
+
+    def basin(self):
+        """
+        Get the basin geometry (NLDI) as a geodataframe in EPSG:4326.
+        """
+        import geopandas as gpd
+
+        def read():
+            features = json.loads(self.get(self.urls()[0]))['features']
+            return gpd.GeoDataFrame.from_features(features, crs='EPSG:4326')
+        return self._memoize('basin', read)
+
+    def flowlines(self):
+        """
+        Get the upstream flowlines (NLDI) as a geodataframe in EPSG:4326.
+        """
+        import geopandas as gpd
+
+        def read():
+            features = json.loads(self.get(self.urls()[1]))['features']
+            return gpd.GeoDataFrame.from_features(features, crs='EPSG:4326')
+        return self._memoize('flowlines', read)
+
+    def metadata(self):
+        """
+        Get the properties of the gage from NLDI (such as name, comid and uri).
+        """
+        return self._memoize('metadata', lambda: json.loads(self.get(self.urls()[2]))['features'][0]['properties'])
+
+    def drainage_area_m2(self):
+        """
+        Get the area of the basin in m^2.
+        """
+        return self._memoize('drainage_area_m2', lambda: float(self.basin().to_crs('epsg:26910').geometry.area.iloc[0]))
+
+    def latitude(self):
+        """
+        Get the latitude of the centroid of the basin.
+        """
+        return self._memoize('latitude', lambda: self.basin().to_crs('epsg:4326').geometry[0].centroid.y)
+
+    def streamflow(self, **kwargs):
+        """
+        Get daily discharge from NWIS, see extract_streamflow(). Each date range is downloaded once.
+        """
+        url_flow = self.urls(**kwargs)[3]
+
+        def read():
+            print('\nStreamflow data is being retrieved from:', url_flow, '\n')
+            # Parse the RDB file: qualifiers such as 'Ice' become NaN in Q_cfs and are kept in Q_cfs_qualifier
+            return self.convert_streamflow(rdb.read_daily_values(self.get(url_flow), name='Q_cfs'))
+        return self._memoize(url_flow, read).copy()
+
+    def add_streamflow(self, df, **kwargs):
+        """
+        Keep discharge downloaded elsewhere (such as by extract_streamflow_many()) as the streamflow of this gage for the dates in **kwargs.
+
+        Args:
+            df (:obj:`df`): daily values of this gage, with columns date, Q_cfs, Q_cfs_cd and Q_cfs_qualifier (see rdb.read_daily_values()).
+            **flow_start_date (str, optional): default: '1980-10-01'
+            **flow_end_date (str, optional): default: '2021-10-01'
+        """
+        with self._lock:
+            self._parsed[self.urls(**kwargs)[3]] = self.convert_streamflow(df)
+
+    def convert_streamflow(self, df):
+        """
+        Add discharge in m3/day, m and mm (using the drainage area of the basin) to daily values in cfs.
+        """
+        df = df[['Q_cfs', 'date', 'Q_cfs_cd', 'Q_cfs_qualifier']].reset_index(drop=True)
+
+        # Convert Q to m^2 using drainage area
+        drainage_area_m2 = self.drainage_area_m2()
+        df['Q_m3day'] = (86400*df['Q_cfs'])/(35.31)  # m3/day
+        df['Q_m'] = df['Q_m3day'] / drainage_area_m2
+        df['Q_mm'] = df['Q_m3day'] / drainage_area_m2 * 1000
+        return df
+
+    def __repr__(self):
+        return f"GageClient('{self.gage}', {len(self._responses)} resources downloaded)"
+
+
+def _download(url, session=None, timeout=60, cache=None):
+    """Get the content (bytes) of a USGS url from the persistent cache, or from the USGS through the pooled session. See GageClient for the arguments."""
+    cache = resolve_cache(cache)
+    content = None if cache is None else cache.get(usgs_cache_key(cache, url))
+    if content is not None:
+        return content.encode('utf-8')
+    session = session if session is not None else get_session()
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+    content = response.content
+    instrument.count(remote_calls=1, bytes=len(content))
+    if cache is not None and is_cacheable(url):
+        cache.put(usgs_cache_key(cache, url), content.decode('utf-8'), source='usgs', url=url)
+    return content
+
+
+@lru_cache(maxsize=128)
+def _client(gage):
+    return GageClient(gage)
+
+
+def get_client(gage):
+    """
+    Get the shared GageClient for a gage, so data downloaded by one function (such as the basin geometry) is reused by the others.
+    The most recently used 128 gages are kept.
+
+    Args:
+        gage (str or int): USGS 8-number gage ID. If int, leading 0s will automatically be added.
+
+    Returns:
+        :obj:`GageClient`
+    """
+    return _client(format_gage(gage))
+
+
 def extract_geometry(gage, **kwargs):
     """
     Get the geometry of a USGS gage in Google Earth Engine (GEE) form and as a geopandas dataframe.
@@ -67,9 +316,8 @@ def extract_geometry(gage, **kwargs):
     Returns:
         :obj:`feature` and  :obj:`gdf`: GEE feature containing the basin's exterior polygon coordinates and geopandas dataframe containing the basin's coordinates.
     """
-    urls = extract_urls(gage, **kwargs)
     # Access site geometry
-    basin_geometry = gpd.read_file(urls[0])
+    basin_geometry = get_client(gage).basin()
     poly_coords = [item for item in basin_geometry.geometry[0].exterior.coords]
     # , {'Name': str(site_name[0]), 'Gage':int(watershed)})
     gee_feature = ee.Feature(ee.Geometry.Polygon(coords=poly_coords))
@@ -87,14 +335,10 @@ def extract_metadata(gage, **kwargs):
     Returns:
         str, str: 2 strings. (1) USGS long-name of gage. (2) description of the form 'USGS Basin + gage ID + imported at + site_name + CRS: + coordinate system
     """
-    url_basin_geometry, url_flow_geometry, url_metadata, url_flow = extract_urls(
-        gage, **kwargs)
-    request_metadata = urllib.request.urlopen(url_metadata)  # type: ignore
-    basin_geometry = gpd.read_file(url_basin_geometry)  # for CRS
-    site_name = [json.load(request_metadata)['features']
-                 [0]['properties']['name'].title()]
+    client = get_client(gage)
+    site_name = [client.metadata()['name'].title()]
     description = 'USGS Basin (' + str(gage) + ') imported at ' + \
-        str(site_name[0]) + 'CRS: ' + str(basin_geometry.crs)
+        str(site_name[0]) + 'CRS: ' + str(client.basin().crs)
 
     return site_name, description
 
@@ -110,28 +354,62 @@ def extract_streamflow(gage, **kwargs):
 
     Returns:
         :obj:`df`: dataframe with daily discharge (Q) in units of cfs, m3/day, m, and mm.
+        Days with a qualifier instead of a value (such as 'Ice' or 'Eqp') have NaN discharge and the qualifier in Q_cfs_qualifier. Q_cfs_cd has the NWIS approval codes.
     """
-    # get URLs and basin geometry
-    url_basin_geometry, url_flow_geometry, url_metadata, url_flow = extract_urls(
-        gage, **kwargs)
-    print('\nStreamflow data is being retrieved from:', url_flow_geometry, '\n')
-    basin_geometry = gpd.read_file(url_basin_geometry)  # for drainage area
-    drainage_area_m2 = basin_geometry.to_crs('epsg:26910').geometry.area
+    return get_client(gage).streamflow(**kwargs)
 
-    # read streamflow data and clean csv
-    df = pd.read_csv(url_flow, header=31, delim_whitespace=True)
-    df.columns = ['usgs', 'site_number', 'datetime', 'Q_cfs', 'a']
-    df['date'] = pd.to_datetime(df.datetime)
-    df = df[['Q_cfs', 'date']]
 
-    # Convert Q to m^2 using drainage area
-    # this is needed because sometimes there are non-numeric entries and we want to ignore them
-    df['Q_cfs'] = df['Q_cfs'].astype(float, errors='ignore')
-    df['Q_m3day'] = (86400*df['Q_cfs'])/(35.31)  # m3/day
-    df['Q_m'] = df['Q_m3day'] / float(drainage_area_m2)
-    df['Q_mm'] = df['Q_m3day'] / float(drainage_area_m2) * 1000
+def extract_streamflow_many(gages, batch_size=100, session=None, timeout=120, cache=None, **kwargs):
+    """
+    Get streamflow for many USGS gages with one NWIS request per batch_size gages instead of one per gage.
+    The combined response is parsed in chunks and split by gage, and discharge is converted to mm with each gage's drainage area
+    (from its shared GageClient, so the basin is downloaded once per gage). The frames are also kept by the shared GageClients,
+    so extract_streamflow() with the same dates does not download them again while the client of the gage is kept (only the 128 most recently
+    used gages are, see get_client()). For more gages, use the returned frames (as StudyAreaCollection does).
 
-    return df
+    Args:
+        gages (list of str or int): USGS gage IDs. If int, leading 0s will automatically be added.
+        batch_size (int, optional): (default 100) maximum number of gages in one request (the NWIS service accepts up to 100).
+        session (:obj:`requests.Session`, optional): (default None) session for the requests. None uses get_session().
+        timeout (float, optional): (default 120) timeout in seconds for each request.
+        cache (:obj:`ExtractionCache` or bool, optional): (default None) persistent cache for the responses, see GageClient.
+        **flow_start_date (str, optional): default: '1980-10-01'
+        **flow_end_date (str, optional): default: '2021-10-01'
+
+    Returns:
+        dict: {gage: :obj:`df`} with one dataframe per gage, as returned by extract_streamflow() (empty if NWIS has no discharge for the gage).
+    """
+    kwargs = {**FLOW_DATES, **{key: kwargs[key] for key in FLOW_DATES if key in kwargs}}
+    gages = list(dict.fromkeys(format_gage(gage) for gage in gages))
+    streamflow = {}
+    for i in range(0, len(gages), batch_size):
+        batch = gages[i:i + batch_size]
+        url = extract_streamflow_url(batch, **kwargs)
+        print('\nStreamflow data for ' + str(len(batch)) + ' gages is being retrieved from:', url, '\n')
+        try:
+            content = _download(url, session, timeout, cache)
+        except requests.HTTPError as e:
+            # The service answers 404 when none of the gages has discharge for the dates
+            if e.response is None or e.response.status_code != 404:
+                raise
+            content = b''
+
+        # Each chunk has the rows of one gage
+        chunks = {gage: [] for gage in batch}
+        for chunk in rdb.iter_daily_values(content, name='Q_cfs'):
+            site = str(chunk['site_no'].iloc[0])
+            if site in chunks:
+                chunks[site].append(chunk)
+        for gage in batch:
+            if len(chunks[gage]) > 0:
+                df = rdb.concat(chunks[gage])
+            else:
+                df = pd.DataFrame({'Q_cfs': pd.Series(dtype=float), 'date': pd.Series(dtype='datetime64[ns]'),
+                                   'Q_cfs_cd': pd.Series(dtype='category'), 'Q_cfs_qualifier': pd.Series(dtype='category')})
+            client = get_client(gage)
+            client.add_streamflow(df, **kwargs)
+            streamflow[gage] = client.streamflow(**kwargs)
+    return streamflow
 
 
 def extract_geometry_flowline(gage, **kwargs):
@@ -144,10 +422,7 @@ def extract_geometry_flowline(gage, **kwargs):
     Returns:
         :obj:`df`: geopandas dataframe with geometry of flowlines (rivers) for plotting.
     """
-    urls = extract_urls(gage, **kwargs)
-    geometry_df = gpd.read_file(urls[1])
-
-    return geometry_df
+    return get_client(gage).flowlines()
 
 
 def extract_latitude(gage, **kwargs):
@@ -160,8 +435,4 @@ def extract_latitude(gage, **kwargs):
     Returns:
         float: latitude
     """
-    urls = extract_urls(gage, **kwargs)
-    basin_geometry = gpd.read_file(urls[0])
-    latitude = basin_geometry.to_crs('epsg:4326').geometry[0].centroid.y
-
-    return latitude
+    return get_client(gage).latitude()